@@ -6,7 +6,7 @@ from django.utils.html import escape, format_html, format_html_join
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 
-from blogs.models import Blog, PersistentStore, Post, RssSubscriber, Stylesheet, Upvote, Hit, Subscriber, UserSettings, Media
+from blogs.models import Blog, DailyFeedSubscribers, PersistentStore, Post, Stylesheet, Upvote, Hit, Subscriber, UserSettings, Media
 from blogs.helpers import root
 
 
@@ -26,6 +26,9 @@ admin.site.register(User, UserAdmin)
 @admin.register(UserSettings)
 class UserSettingsAdmin(admin.ModelAdmin):
     list_display = ('email', 'date_joined', 'blogs', 'display_is_active', 'upgraded', 'upgraded_date', 'order_id')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user').prefetch_related('user__blogs')
     
     def email(self, obj):
         return obj.user.email
@@ -64,7 +67,7 @@ class UserSettingsAdmin(admin.ModelAdmin):
 @admin.register(Blog)
 class BlogAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
-        return Blog.objects.annotate(posts_count=Count('posts'))
+        return Blog.objects.select_related('user', 'user__settings').annotate(posts_count=Count('posts'))
 
     def post_count(self, obj):
         return obj.posts_count
@@ -147,7 +150,7 @@ class PostAdmin(admin.ModelAdmin):
 
 admin.site.register(Upvote)
 admin.site.register(Stylesheet)
-admin.site.register(RssSubscriber)
+admin.site.register(DailyFeedSubscribers)
 admin.site.register(Media)
 
 
@@ -0,0 +1,85 @@
+from django.core.cache import cache
+
+from collections import OrderedDict
+from functools import wraps
+import hashlib
+import threading
+import time
+
+
+# Host resolution: maps a normalised address to the blog row (with its user and settings).
+# Other processes can't reach this process's cache, so a cached row is checked against the blog's
+# cache_version once it's older than ADDRESS_REVALIDATE_INTERVAL. Misses aren't cached, a new blog
+# would stay missing in every other process.
+ADDRESS_CACHE_TIMEOUT = 3600  # 1 hour in seconds
+ADDRESS_REVALIDATE_INTERVAL = 5  # seconds
+
+
+def address_cache_key(kind, name):
+    return f'address_{kind}_{name}'
+
+
+def domain_variants(domain):
+    domain = domain.lower()
+    bare_domain = domain.replace('www.', '')
+    return {domain, bare_domain, f'www.{bare_domain}'}
+
+
+def invalidate_blog_address(subdomain, domain):
+    keys = []
+    if subdomain:
+        keys.append(address_cache_key('subdomain', subdomain.lower()))
+    if domain:
+        keys.extend(address_cache_key('domain', variant) for variant in domain_variants(domain))
+    cache.delete_many(keys)
+
+
+# Anonymous full page cache, keyed on the version stored with the blog so every process sees a bump
+PAGE_CACHE_TIMEOUT = 300  # 5 minutes in seconds
+
+
+def new_cache_version():
+    # Time based so it doubles as the pages' last modified time
+    return time.time_ns()
+
+
+def invalidate_blog_pages(blog_pk):
+    from blogs.models import Blog
+
+    version = new_cache_version()
+    Blog.objects.filter(pk=blog_pk).update(cache_version=version)
+    return version
+
+
+# Cached blog rows carry their user and settings, so changes to those move the version on too
+def invalidate_user_blog_pages(user_id):
+    from blogs.models import Blog
+
+    Blog.objects.filter(user_id=user_id).update(cache_version=new_cache_version())
+
+
+# An lru_cache for functions of one long string (post markup, a code block) and maybe some short arguments,
+# keyed on the string's digest so the cache doesn't keep whole documents alive in every process
+def memoise_by_digest(maxsize):
+    def decorator(function):
+        entries = OrderedDict()
+        lock = threading.Lock()
+
+        @wraps(function)
+        def wrapper(content, *args):
+            key = (hashlib.sha1(content.encode('utf-8')).digest(), *args)
+            with lock:
+                if key in entries:
+                    entries.move_to_end(key)
+                    return entries[key]
+
+            result = function(content, *args)
+            with lock:
+                entries[key] = result
+                if len(entries) > maxsize:
+                    entries.popitem(last=False)
+            return result
+
+        wrapper.cache_clear = entries.clear
+        return wrapper
+    return decorator
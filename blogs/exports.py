@@ -0,0 +1,89 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+import csv
+import datetime
+import json
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'txt': 'text/plain; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def export_fields(queryset):
+    # Export from a values queryset so rows never become model instances
+    if queryset._fields:
+        values = queryset
+    else:
+        values = queryset.values()
+    return values, list(values.query.values_select) + list(values.query.annotation_select)
+
+
+def export_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def chunked(lines):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def csv_lines(queryset):
+    values, fields = export_fields(queryset)
+    headers = {field.name: field.verbose_name for field in queryset.model._meta.fields}
+    writer = csv.writer(Echo())
+
+    # BOM so Excel opens the file as utf-8
+    yield '\ufeff'
+    yield writer.writerow([headers.get(field, field) for field in fields])
+    for row in values.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield writer.writerow([export_value(row[field]) for field in fields])
+
+
+def txt_lines(queryset):
+    values, fields = export_fields(queryset)
+    for row in values.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield '\t'.join(export_value(row[field]) for field in fields) + '\n'
+
+
+def ndjson_lines(queryset):
+    values, fields = export_fields(queryset)
+    for row in values.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+EXPORT_WRITERS = {
+    'csv': csv_lines,
+    'txt': txt_lines,
+    'ndjson': ndjson_lines,
+}
+
+
+def export_response(queryset, name, export_format='csv'):
+    if export_format not in EXPORT_FORMATS:
+        export_format = 'csv'
+
+    response = StreamingHttpResponse(
+        chunked(EXPORT_WRITERS[export_format](queryset)),
+        content_type=EXPORT_FORMATS[export_format]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{name}.{export_format}"'
+    return response
@@ -0,0 +1,162 @@
+from django.db import DatabaseError, close_old_connections, transaction
+from django.utils import timezone
+
+from blogs.models import DailyFeedSubscribers
+
+from collections import defaultdict
+from datetime import timedelta
+import atexit
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 2^11 registers gives a standard error of 1.04 / sqrt(2048), about 2.3%
+HLL_PRECISION = 11
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+
+FLUSH_INTERVAL = 60  # seconds
+FLUSH_MAX_PENDING = 10000  # readers buffered before flushing early
+FLUSH_MAX_ATTEMPTS = 3  # a day's readers are dropped after failing this many flushes in a row
+
+pending_lock = threading.Lock()
+flush_lock = threading.Lock()
+pending = defaultdict(set)
+pending_count = 0
+failed_attempts = defaultdict(int)
+flush_due = threading.Event()
+flusher_pid = None
+
+
+def empty_sketch():
+    return bytearray(HLL_REGISTERS)
+
+
+def load_sketch(sketch):
+    return bytearray.fromhex(sketch) if sketch else empty_sketch()
+
+
+def add_to_sketch(registers, hash_id):
+    # hash_id is a sha256 hex digest, 64 bits of it are plenty
+    value = int(hash_id[:16], 16)
+    index = value >> (64 - HLL_PRECISION)
+    rest = value & ((1 << (64 - HLL_PRECISION)) - 1)
+    rank = (64 - HLL_PRECISION) - rest.bit_length() + 1
+    if rank > registers[index]:
+        registers[index] = rank
+
+
+def merge_sketches(registers, other):
+    for i, rank in enumerate(other):
+        if rank > registers[i]:
+            registers[i] = rank
+
+
+def count_sketch(registers):
+    estimate = HLL_ALPHA * HLL_REGISTERS ** 2 / sum(2.0 ** -rank for rank in registers)
+    zeros = registers.count(0)
+    # Linear counting is more accurate for small cardinalities
+    if estimate <= 2.5 * HLL_REGISTERS and zeros:
+        estimate = HLL_REGISTERS * math.log(HLL_REGISTERS / zeros)
+    return int(round(estimate))
+
+
+# Called on every feed request, only touches memory. A background thread writes the readers out
+def record_feed_subscriber(blog_id, hash_id):
+    global pending_count
+    start_flusher()
+    with pending_lock:
+        readers = pending[(blog_id, timezone.now().date())]
+        if hash_id not in readers:
+            readers.add(hash_id)
+            pending_count += 1
+        if pending_count >= FLUSH_MAX_PENDING:
+            flush_due.set()
+
+
+def start_flusher():
+    global flusher_pid
+
+    # Threads don't survive a fork, so each worker process starts its own
+    if flusher_pid == os.getpid():
+        return
+
+    with pending_lock:
+        if flusher_pid == os.getpid():
+            return
+        threading.Thread(target=flush_periodically, daemon=True).start()
+        flusher_pid = os.getpid()
+
+
+def flush_periodically():
+    while True:
+        flush_due.wait(FLUSH_INTERVAL)
+        flush_due.clear()
+        close_old_connections()
+        flush_feed_subscribers()
+
+
+def flush_feed_subscribers():
+    global pending, pending_count
+
+    with flush_lock:
+        with pending_lock:
+            flushing = pending
+            pending = defaultdict(set)
+            pending_count = 0
+
+        for (blog_id, date), readers in flushing.items():
+            try:
+                save_readers(blog_id, date, readers)
+                failed_attempts.pop((blog_id, date), None)
+            except DatabaseError:
+                failed_attempts[(blog_id, date)] += 1
+                if failed_attempts[(blog_id, date)] >= FLUSH_MAX_ATTEMPTS:
+                    failed_attempts.pop((blog_id, date))
+                    logger.exception(f'Dropping {len(readers)} feed readers for blog {blog_id} on {date}')
+                    continue
+                logger.warning(f'Error saving feed readers for blog {blog_id} on {date}, retrying', exc_info=True)
+                # Kept for the next flush
+                with pending_lock:
+                    buffered = pending[(blog_id, date)]
+                    pending_count -= len(buffered)
+                    buffered |= readers
+                    pending_count += len(buffered)
+
+
+def save_readers(blog_id, date, readers):
+    with transaction.atomic():
+        row, created = DailyFeedSubscribers.objects.select_for_update().get_or_create(blog_id=blog_id, date=date)
+        if row.subscribers and not row.sketch:
+            # The day was already closed, its count can't take more readers
+            return
+        registers = load_sketch(row.sketch)
+        for hash_id in readers:
+            add_to_sketch(registers, hash_id)
+        row.sketch = registers.hex()
+        row.subscribers = count_sketch(registers)
+        row.save(update_fields=['sketch', 'subscribers'])
+
+
+# Don't lose the last minute of readers when a web process shuts down cleanly
+atexit.register(flush_feed_subscribers)
+
+
+def feed_subscriber_count(blog):
+    # Yesterday is the last complete day, today catches new blogs
+    today = timezone.now().date()
+    counts = DailyFeedSubscribers.objects.filter(
+        blog=blog,
+        date__gte=today - timedelta(days=1)
+    ).values_list('subscribers', flat=True)
+    return max(counts, default=0)
+
+
+# Only the count is kept once a day is over
+def clear_old_sketches():
+    yesterday = timezone.now().date() - timedelta(days=1)
+    return DailyFeedSubscribers.objects.filter(date__lt=yesterday).exclude(sketch='').update(sketch='')
@@ -1,6 +1,6 @@
 from django.utils import timezone
 from django.contrib.sites.models import Site
-from django.core.mail import send_mail, get_connection, EmailMultiAlternatives
+from django.core.mail import get_connection, EmailMultiAlternatives
 from django.contrib.gis.geoip2 import GeoIP2
 from django.http import Http404
 from django.conf import settings
@@ -10,15 +10,18 @@ import string
 import os
 import random
 import threading
+import time
 import bleach
 from requests.exceptions import ConnectionError, ReadTimeout
 import requests
 import subprocess
 from datetime import timedelta
+from functools import lru_cache
 import geoip2
 from ipaddr import client_ip
 import hashlib
 
+from blogs.caching import memoise_by_digest
 from blogs.models import Post
 
 
@@ -138,33 +141,89 @@ def salt_and_hash(request, duration='day'):
     return hash_id
 
 
-def get_country(user_ip):
-    # user_ip = '45.222.31.178'
+GEOIP_CACHE_SIZE = 4096
+GEOIP_RELOAD_INTERVAL = 60  # seconds
+
+geoip_lock = threading.Lock()
+geoip_reader = None
+geoip_version = None
+geoip_checked_at = 0
+
+
+def geoip_database_version():
+    # Latest modification time of the databases under GEOIP_PATH
     try:
-        g = GeoIP2()
-        country = g.country(user_ip)
+        return max(entry.stat().st_mtime for entry in os.scandir(settings.GEOIP_PATH) if entry.name.endswith('.mmdb'))
+    except (OSError, ValueError):
+        return None
+
+
+def get_geoip_reader():
+    global geoip_reader, geoip_version, geoip_checked_at
+
+    now = time.monotonic()
+    if geoip_reader and now - geoip_checked_at < GEOIP_RELOAD_INTERVAL:
+        return geoip_reader
+
+    with geoip_lock:
+        geoip_checked_at = now
+        version = geoip_database_version()
+        if geoip_reader is None or version != geoip_version:
+            reload_geoip(version)
+        return geoip_reader
+
 
-        return country
+def reload_geoip(version=None):
+    global geoip_reader, geoip_version
+
+    # MODE_AUTO memory-maps the database (with the C extension when available).
+    # The old reader is left to be garbage collected as other threads may still use it.
+    geoip_reader = GeoIP2(cache=GeoIP2.MODE_AUTO)
+    geoip_version = version or geoip_database_version()
+    lookup_country.cache_clear()
+
+
+@lru_cache(maxsize=GEOIP_CACHE_SIZE)
+def lookup_country(user_ip):
+    try:
+        return get_geoip_reader().country(user_ip)
     except geoip2.errors.AddressNotFoundError:
         return {}
 
 
+def get_country(user_ip):
+    # user_ip = '45.222.31.178'
+    return dict(lookup_country(user_ip))
+
+
+UNMARK_CACHE_SIZE = 1024
+
+# Applied in order, a pattern only runs when the text it needs is there.
+# They can't be merged into one alternation: \s{0,3} spans the lines emptied by the earlier patterns
+UNMARK_PATTERNS = [
+    ('#', re.compile(r'^\s{0,3}#{1,6}\s+.*$', re.MULTILINE)),
+    ('', re.compile(r'^\s{0,3}[-*]{3,}\s*$', re.MULTILINE)),
+    ('>', re.compile(r'^\s{0,3}>\s+.*$', re.MULTILINE)),
+    ('```', re.compile(r'```.*?```', re.DOTALL)),
+    ('`', re.compile(r'`[^`]+`')),
+    ('![', re.compile(r'!\[.*?\]\(.*?\)')),
+    ('](', re.compile(r'\[.*?\]\(.*?\)')),
+    ('', re.compile(r'(\*\*|__)(.*?)\1')),
+    ('', re.compile(r'(\*|_)(.*?)\1')),
+    ('~~', re.compile(r'~~.*?~~')),
+    ('', re.compile(r'^\s{0,3}[-*+]\s+.*$', re.MULTILINE)),
+    ('.', re.compile(r'^\s{0,3}\d+\.\s+.*$', re.MULTILINE)),
+    ('|', re.compile(r'^\s*\|.*?\|\s*$', re.MULTILINE)),
+    ('', re.compile(r'^\s*[:-]{3,}\s*$', re.MULTILINE)),
+]
+
+
+# Blog and post views build their meta description from this on every request
+@memoise_by_digest(maxsize=UNMARK_CACHE_SIZE)
 def unmark(content):
-    content = re.sub(r'^\s{0,3}#{1,6}\s+.*$', '', content, flags=re.MULTILINE)
-    content = re.sub(r'^\s{0,3}[-*]{3,}\s*$', '', content, flags=re.MULTILINE)
-    content = re.sub(r'^\s{0,3}>\s+.*$', '', content, flags=re.MULTILINE)
-    content = re.sub(r'```.*?```', '', content, flags=re.DOTALL)
-    content = re.sub(r'`[^`]+`', '', content)
-    content = re.sub(r'!\[.*?\]\(.*?\)', '', content)
-    content = re.sub(r'\[.*?\]\(.*?\)', '', content)
-    content = re.sub(r'(\*\*|__)(.*?)\1', '', content)
-    content = re.sub(r'(\*|_)(.*?)\1', '', content)
-    content = re.sub(r'~~.*?~~', '', content)
-    content = re.sub(r'^\s{0,3}[-*+]\s+.*$', '', content, flags=re.MULTILINE)
-    content = re.sub(r'^\s{0,3}\d+\.\s+.*$', '', content, flags=re.MULTILINE)
-    content = re.sub(r'^\s*\|.*?\|\s*$', '', content, flags=re.MULTILINE)
-    content = re.sub(r'^\s*[:-]{3,}\s*$', '', content, flags=re.MULTILINE)
-
+    for required, pattern in UNMARK_PATTERNS:
+        if required in content:
+            content = pattern.sub('', content)
     return content
 
 
@@ -198,30 +257,13 @@ def send_mass_html_mail(datatuple, fail_silently=False, user=None, password=None
     return connection.send_messages(messages)
 
 
-class EmailThread(threading.Thread):
-    def __init__(self, subject, html_message, from_email, recipient_list):
-        self.subject = subject
-        self.html_message = html_message
-        self.from_email = from_email
-        self.recipient_list = recipient_list
-        threading.Thread.__init__(self)
-
-    def run(self):
-        send_mail(
-            self.subject,
-            self.html_message,
-            self.from_email,
-            self.recipient_list,
-            fail_silently=True,
-            html_message=self.html_message)
-
-
 def send_async_mail(subject, html_message, from_email, recipient_list):
     if settings.DEBUG:
         print(html_message)
     else:
-        print('Sent email to ', recipient_list)
-        EmailThread(subject, html_message, from_email, recipient_list).start()
+        # Sent (and retried) by the job worker
+        from blogs.jobs import enqueue
+        enqueue('send_email', subject=subject, html_message=html_message, from_email=from_email, recipient_list=list(recipient_list))
 
 
 def random_post_link():
@@ -0,0 +1,183 @@
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+
+from blogs.helpers import get_country
+from blogs.models import Hit, Post
+
+from urllib.parse import urlparse
+import atexit
+import httpagentparser
+import os
+import queue
+import threading
+import time
+
+HIT_QUEUE_SIZE = 10000
+HIT_WORKERS = 2
+HIT_BATCH_SIZE = 200
+HIT_FLUSH_INTERVAL = 5  # seconds
+HIT_SEEN_LIMIT = 100000
+
+STOP = None
+
+hit_queue = queue.Queue(maxsize=HIT_QUEUE_SIZE)
+counters = {'queued': 0, 'dropped': 0, 'bots': 0, 'duplicates': 0, 'saved': 0}
+
+lock = threading.Lock()
+flush_lock = threading.Lock()
+pending_hits = []
+seen_hits = set()
+last_flush = time.monotonic()
+workers = []
+workers_pid = None
+
+
+def enqueue_hit(uid, hash_id, ip, user_agent, referrer):
+    start_workers()
+    try:
+        hit_queue.put_nowait((uid, hash_id, ip, user_agent, referrer))
+        count('queued')
+    except queue.Full:
+        count('dropped')
+
+
+def hit_stats():
+    with lock:
+        return {**counters, 'queue_depth': hit_queue.qsize(), 'pending': len(pending_hits)}
+
+
+def count(counter, amount=1):
+    with lock:
+        counters[counter] += amount
+
+
+def start_workers():
+    global workers, workers_pid
+
+    # Threads don't survive a fork, so each worker process starts its own pool
+    if workers_pid == os.getpid():
+        return
+
+    with lock:
+        if workers_pid == os.getpid():
+            return
+        workers = [threading.Thread(target=work, daemon=True) for _ in range(HIT_WORKERS)]
+        for worker in workers:
+            worker.start()
+        workers_pid = os.getpid()
+
+
+def work():
+    while True:
+        try:
+            item = hit_queue.get(timeout=HIT_FLUSH_INTERVAL)
+        except queue.Empty:
+            item = False
+
+        if item is STOP:
+            break
+
+        if item:
+            process_hit(*item)
+
+        if len(pending_hits) >= HIT_BATCH_SIZE or time.monotonic() - last_flush >= HIT_FLUSH_INTERVAL:
+            flush_hits()
+
+
+def process_hit(uid, hash_id, ip, user_agent, referrer):
+    try:
+        user_agent = httpagentparser.detect(user_agent)
+        if user_agent.get('bot', False):
+            count('bots')
+            return
+
+        # Prevent duplicates with ip hash + date
+        hit_key = (uid, hash_id, timezone.now().date())
+        with lock:
+            if hit_key in seen_hits:
+                counters['duplicates'] += 1
+                return
+            if len(seen_hits) >= HIT_SEEN_LIMIT:
+                seen_hits.clear()
+            seen_hits.add(hit_key)
+
+        country = get_country(ip).get('country_name', '')
+        device = user_agent.get('platform', {}).get('name', '')
+        browser = user_agent.get('browser', {}).get('name', '')
+
+        if referrer:
+            referrer = urlparse(referrer)
+            referrer = '{uri.scheme}://{uri.netloc}/'.format(uri=referrer)
+
+        with lock:
+            pending_hits.append({
+                'uid': uid,
+                'hash_id': hash_id,
+                'referrer': referrer,
+                'country': country,
+                'device': device,
+                'browser': browser,
+            })
+    except Exception as e:
+        print('Error processing hit', e)
+
+
+def flush_hits():
+    global pending_hits, last_flush
+
+    with flush_lock:
+        with lock:
+            hits, pending_hits = pending_hits, []
+            last_flush = time.monotonic()
+
+        if not hits:
+            return
+
+        close_old_connections()
+        try:
+            post_pks = dict(Post.objects.filter(uid__in={hit['uid'] for hit in hits}).values_list('uid', 'pk'))
+
+            # Hits already stored by another process
+            existing = set(Hit.objects.filter(
+                post_id__in=post_pks.values(),
+                hash_id__in={hit['hash_id'] for hit in hits}
+            ).values_list('post_id', 'hash_id'))
+
+            new_hits = []
+            for hit in hits:
+                post_pk = post_pks.get(hit.pop('uid'))
+                if post_pk and (post_pk, hit['hash_id']) not in existing:
+                    existing.add((post_pk, hit['hash_id']))
+                    new_hits.append(Hit(post_id=post_pk, **hit))
+
+            Hit.objects.bulk_create(new_hits, batch_size=HIT_BATCH_SIZE, ignore_conflicts=True)
+            count('saved', len(new_hits))
+            print(f'Saved {len(new_hits)} hits', hit_stats())
+        except DatabaseError as e:
+            print('Error saving hits', e)
+
+
+def stop_workers():
+    if workers_pid != os.getpid():
+        return
+
+    for worker in workers:
+        try:
+            hit_queue.put(STOP, timeout=1)
+        except queue.Full:
+            pass
+    for worker in workers:
+        worker.join(timeout=HIT_FLUSH_INTERVAL)
+
+    # Drain anything left behind and save it before the process exits
+    while True:
+        try:
+            item = hit_queue.get_nowait()
+        except queue.Empty:
+            break
+        if item is not STOP:
+            process_hit(*item)
+    flush_hits()
+
+
+atexit.register(stop_workers)
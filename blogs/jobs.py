@@ -0,0 +1,266 @@
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Avg, Count, F, Max
+from django.utils import timezone
+
+from blogs.models import Job
+
+from datetime import datetime, timedelta
+import json
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+
+JOB_POLL_INTERVAL = 2  # seconds
+JOB_TIMEOUT = 30 * 60  # running jobs not heard from in this long are assumed dead, long jobs call heartbeat()
+JOB_RETRY_BACKOFF = 30  # seconds, doubled on every attempt
+JOB_RETRY_BACKOFF_MAX = 6 * 60 * 60
+JOB_ERROR_BACKOFF_MAX = 60  # seconds a worker waits after its own errors, e.g. the database going away
+JOB_SCHEDULE_INTERVAL = 60
+JOB_SHUTDOWN_TIMEOUT = 20  # seconds running jobs get to finish, inside Heroku's 30 second grace period
+
+tasks = {}
+# The job each worker thread is running, for heartbeat()
+current_job = threading.local()
+
+
+class JobLost(Exception):
+    """The job timed out and was queued again, so another worker may be running it"""
+
+
+# Register a function as a job, e.g. @task(queue='email', max_attempts=3)
+def task(queue='default', max_attempts=5):
+    def register(func):
+        tasks[func.__name__] = {'func': func, 'queue': queue, 'max_attempts': max_attempts}
+        return func
+    return register
+
+
+def load_tasks():
+    # Tasks register themselves on import
+    import blogs.tasks  # noqa: F401
+
+
+def enqueue(name, run_at=None, unique_key=None, **kwargs):
+    load_tasks()
+    options = tasks[name]
+    try:
+        return Job.objects.create(
+            name=name,
+            kwargs=json.dumps(kwargs),
+            queue=options['queue'],
+            max_attempts=options['max_attempts'],
+            run_at=run_at or timezone.now(),
+            unique_key=unique_key)
+    except IntegrityError:
+        # Already queued under the same unique key (e.g. by another dyno)
+        return None
+
+
+# Queue one run of each periodic job per interval. The unique key makes this idempotent across workers.
+def schedule_periodic_jobs(now=None):
+    load_tasks()
+    now = now or timezone.now()
+    jobs = []
+    for name, interval in settings.PERIODIC_JOBS.items():
+        slot = int(now.timestamp() // interval)
+        jobs.append(Job(
+            name=name,
+            queue=tasks[name]['queue'],
+            max_attempts=tasks[name]['max_attempts'],
+            run_at=datetime.fromtimestamp(slot * interval, tz=timezone.utc),
+            unique_key=f'{name}:{slot}'))
+    Job.objects.bulk_create(jobs, ignore_conflicts=True)
+
+
+def requeue_stale_jobs():
+    return Job.objects.filter(
+        status=Job.RUNNING,
+        locked_at__lt=timezone.now() - timedelta(seconds=JOB_TIMEOUT)
+    ).update(status=Job.QUEUED, locked_by='', last_error='Timed out')
+
+
+def claim_job(worker_id):
+    now = timezone.now()
+
+    # Queues that already have as many running jobs as they're allowed
+    running = dict(Job.objects.filter(status=Job.RUNNING).values('queue').annotate(count=Count('id')).values_list('queue', 'count'))
+    full_queues = [queue for queue, limit in settings.JOB_QUEUE_CONCURRENCY.items() if running.get(queue, 0) >= limit]
+
+    candidates = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).exclude(queue__in=full_queues).order_by('run_at')
+    for job in candidates[:10]:
+        # Only one worker wins the update
+        claimed = Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+            status=Job.RUNNING,
+            locked_at=now,
+            locked_by=worker_id,
+            attempts=F('attempts') + 1)
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def retry_delay(attempts):
+    return min(JOB_RETRY_BACKOFF * 2 ** (attempts - 1), JOB_RETRY_BACKOFF_MAX)
+
+
+# Long running tasks call this between batches so the job isn't taken for dead after JOB_TIMEOUT
+def heartbeat():
+    job = getattr(current_job, 'job', None)
+    if job is None:
+        # Not running in a worker, e.g. called from the shell
+        return
+    if not Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by).update(locked_at=timezone.now()):
+        raise JobLost(f'Job {job.pk} is no longer held by {job.locked_by}')
+
+
+def run_job(job):
+    load_tasks()
+    started = time.monotonic()
+    current_job.job = job
+    try:
+        tasks[job.name]['func'](**json.loads(job.kwargs))
+    except JobLost as e:
+        # Whoever holds the job now records how it ends
+        print(f'Job {job.name} stopped:', e)
+        return job
+    except Exception as e:
+        fail_job(job, e)
+    else:
+        job.status = Job.DONE
+        job.finished_date = timezone.now()
+    finally:
+        current_job.job = None
+
+    job.duration = time.monotonic() - started
+    job.locked_by = ''
+    job.save(update_fields=['status', 'run_at', 'finished_date', 'duration', 'locked_by', 'last_error'])
+    return job
+
+
+# Queues the job again with backoff, or fails it for good once it's out of attempts. Doesn't save.
+def fail_job(job, error):
+    job.last_error = traceback.format_exc()
+    if job.attempts < job.max_attempts:
+        job.status = Job.QUEUED
+        job.run_at = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+        print(f'Job {job.name} failed, retrying in {retry_delay(job.attempts)}s:', error)
+    else:
+        job.status = Job.FAILED
+        job.finished_date = timezone.now()
+        print(f'Job {job.name} failed for good:', error)
+
+
+def work(worker_id, stop_event, burst=False):
+    last_scheduled = 0
+    errors = 0
+    while not stop_event.is_set():
+        job = None
+        try:
+            close_old_connections()
+
+            if time.monotonic() - last_scheduled >= JOB_SCHEDULE_INTERVAL:
+                with transaction.atomic():
+                    schedule_periodic_jobs()
+                    requeue_stale_jobs()
+                last_scheduled = time.monotonic()
+
+            job = claim_job(worker_id)
+            if job:
+                run_job(job)
+            elif burst:
+                break
+            else:
+                stop_event.wait(JOB_POLL_INTERVAL)
+            errors = 0
+        except Exception as e:
+            # Usually the database going away, keep the worker alive and back off
+            errors += 1
+            print(f'Worker {worker_id} error:', e)
+            if job:
+                release_failed_job(job, e)
+            stop_event.wait(min(JOB_POLL_INTERVAL * 2 ** errors, JOB_ERROR_BACKOFF_MAX))
+
+
+def release_failed_job(job, error):
+    try:
+        close_old_connections()
+        fail_job(job, error)
+        Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+            status=job.status,
+            run_at=job.run_at,
+            finished_date=job.finished_date,
+            last_error=job.last_error,
+            locked_by='')
+    except Exception as e:
+        # requeue_stale_jobs picks it up once it times out
+        print(f'Could not release job {job.pk}:', e)
+
+
+# Jobs still running when the worker stops are queued again rather than waiting out JOB_TIMEOUT
+def release_running_jobs(worker_id):
+    close_old_connections()
+    return Job.objects.filter(status=Job.RUNNING, locked_by__startswith=f'{worker_id}:').update(
+        status=Job.QUEUED, locked_by='', last_error='Worker stopped')
+
+
+def run_worker(concurrency=1, burst=False, shutdown_timeout=JOB_SHUTDOWN_TIMEOUT):
+    load_tasks()
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    stop_event = threading.Event()
+
+    # Heroku sends SIGTERM and kills the dyno 30 seconds later
+    def stop(signum, frame):
+        print(f'Stopping worker {worker_id}')
+        stop_event.set()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f'Worker {worker_id} running {concurrency} thread(s) for', ', '.join(sorted(tasks)))
+    threads = [
+        threading.Thread(target=work, args=(f'{worker_id}:{i}', stop_event, burst), daemon=True)
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+
+    while any(thread.is_alive() for thread in threads) and not stop_event.is_set():
+        stop_event.wait(1)
+
+    # Let running jobs finish, then hand back the ones that didn't
+    deadline = time.monotonic() + shutdown_timeout
+    for thread in threads:
+        thread.join(timeout=max(deadline - time.monotonic(), 0))
+    if any(thread.is_alive() for thread in threads):
+        print(f'Released {release_running_jobs(worker_id)} unfinished job(s)')
+
+
+def job_stats(since=None):
+    since = since or timezone.now() - timedelta(days=1)
+    stats = {
+        'backlog': Job.objects.filter(status=Job.QUEUED, run_at__lte=timezone.now()).count(),
+        'scheduled': Job.objects.filter(status=Job.QUEUED, run_at__gt=timezone.now()).count(),
+        'running': Job.objects.filter(status=Job.RUNNING).count(),
+        'tasks': {},
+    }
+
+    finished = Job.objects.filter(finished_date__gte=since).values('name', 'status').annotate(
+        count=Count('id'),
+        avg_duration=Avg('duration'),
+        max_duration=Max('duration'))
+    for row in finished:
+        task_stats = stats['tasks'].setdefault(row['name'], {})
+        task_stats[row['status']] = {
+            'count': row['count'],
+            'avg_duration': round(row['avg_duration'] or 0, 3),
+            'max_duration': round(row['max_duration'] or 0, 3),
+        }
+    return stats
+
+
+def delete_finished_jobs(days=7):
+    return Job.objects.filter(status=Job.DONE, finished_date__lt=timezone.now() - timedelta(days=days)).delete()[0]
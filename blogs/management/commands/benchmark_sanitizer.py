@@ -0,0 +1,143 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from blogs.sanitizer import HOST_WHITELIST, sanitize_html
+from blogs.templatetags.custom_tags import markdown_renderer
+
+from pathlib import Path
+import re
+import time
+
+DEFAULT_REPEAT = 20
+CORPUS_DOCUMENTS = ['README.md', 'CONTRIBUTIONS.md', 'architecture.md', 'LICENSE.md']
+
+# Markup non-upgraded blogs write: embeds, inline html and code blocks
+SAMPLE_POST = '''# A post with embeds
+
+Some *text* with a [link](https://example.com/page?a=1&b=2), a [relative link](/about/) and an ![image](https://example.com/cat.png "A cat").
+
+<iframe width="560" height="315" src="https://www.youtube.com/embed/dQw4w9WgXcQ" frameborder="0" allowfullscreen></iframe>
+
+<div class="note" style="color: #333"><p>Inline <b>html</b> and a <a href="mailto:me@example.com">mail link</a>.</p></div>
+
+| Column | Other |
+| ------ | ----- |
+| 1 < 2  | a & b |
+
+```python
+if a < b and b > c:
+    print("<script>not a tag</script>")
+```
+
+<iframe src="https://open.spotify.com/embed/track/1" width="300" height="80"></iframe>
+'''
+
+# Each one is removed or neutralised by the sanitizer
+XSS_VECTORS = [
+    '<a href="javascript:alert(1)">x</a>',
+    "<a href='JaVaScRiPt:alert(1)'>x</a>",
+    '<a href=javascript:alert(1)>x</a>',
+    '<a href=" java&#x09;script:alert(1)">x</a>',
+    '<a href="&#106;avascript:alert(1)">x</a>',
+    '<a href="vbscript:msgbox(1)">x</a>',
+    '<a class="x" href="javascript:alert(1)" title="y">x</a>',
+    '<math><a xlink:href="javascript:alert(1)">x</a></math>',
+    '<img src=x onerror=alert(1)>',
+    '<img src="x" onerror="alert(1)">',
+    '<img src="x" ONERROR=\'alert(1)\'>',
+    '<div onmouseover = "alert(1)">x</div>',
+    '<svg/onload=alert(1)>',
+    '<body onload=alert(1)>',
+    '<script>alert(1)</script>',
+    '<SCRIPT src=//evil.example/x.js></SCRIPT>',
+    '<script type="text/javascript">\nalert(1)\n</script >',
+    '<scr<script>ipt>alert(1)</script>',
+    '<!--><script>alert(1)</script>-->',
+    '<form action="javascript:alert(1)"><button formaction=javascript:alert(1)>x</button></form>',
+    '<object data="javascript:alert(1)"></object>',
+    '<embed src=javascript:alert(1)>',
+    '<input onfocus=alert(1) autofocus>',
+    '<iframe src="https://evil.example/"></iframe>',
+    '<iframe src="https://evil.example/?www.youtube.com"></iframe>',
+    '<iframe src="https://www.youtube.com.evil.example/embed/x"></iframe>',
+    '<iframe src="javascript:alert(1)"></iframe>',
+    '<iframe srcdoc="&lt;script&gt;alert(1)&lt;/script&gt;" src="https://www.youtube.com/embed/x"></iframe>',
+    '<iframe src="https://www.youtube.com/embed/x" onload="alert(1)"></iframe>',
+    # Unclosed tags
+    '<script>alert(1)',
+    '<iframe src="https://evil.example/">',
+    '<img src=x onerror=alert(1)',
+    '<a href="javascript:alert(1)"',
+    '<div onclick="alert(1)" <b>x</b>',
+]
+
+
+# clean() before the single pass sanitizer, kept to check sanitize_html against
+def regex_clean(markup):
+    cleaned_markup = re.sub(r'<script.*?>.*?</script>', '', markup, flags=re.DOTALL | re.IGNORECASE)
+
+    cleaned_markup = re.sub(r'\son\w+="[^"]*"', '', cleaned_markup, flags=re.IGNORECASE)
+    cleaned_markup = re.sub(r'\son\w+=\'[^\']*\'', '', cleaned_markup, flags=re.IGNORECASE)
+    cleaned_markup = re.sub(r'\son\w+=\w+', '', cleaned_markup, flags=re.IGNORECASE)
+    cleaned_markup = re.sub(r'(<\w+\s+.*?)(href|src)\s*=\s*["\']?javascript:[^"\']*["\']?', r'\1', cleaned_markup, flags=re.IGNORECASE)
+    cleaned_markup = re.sub(r'<(object|embed|form|input|button).*?>', '', cleaned_markup, flags=re.IGNORECASE)
+    cleaned_markup = re.sub(r'</(object|embed|form|input|button)>', '', cleaned_markup, flags=re.IGNORECASE)
+
+    def iframe_whitelisted(match):
+        src = match.group(2)
+        if any(host in src for host in HOST_WHITELIST):
+            return match.group(0)
+        return ''
+
+    cleaned_markup = re.sub(r'(<iframe.*?src=["\'])([^"\']*)(["\'].*?>.*?</iframe>)', iframe_whitelisted, cleaned_markup, flags=re.DOTALL | re.IGNORECASE)
+
+    return cleaned_markup
+
+
+# Rendered markdown as clean() gets it: the repo's own docs, a post with embeds, and both with the XSS vectors appended
+def build_corpus():
+    sources = {name: (Path(settings.BASE_DIR) / name).read_text() for name in CORPUS_DOCUMENTS}
+    sources['sample post'] = SAMPLE_POST
+    sources['long post'] = '\n\n'.join(sources.values()) * 10
+
+    corpus = {name: markdown_renderer(content) for name, content in sources.items()}
+    vectors = '\n\n'.join(XSS_VECTORS)
+    for name in list(corpus):
+        corpus[f'{name} + vectors'] = corpus[name] + vectors
+    return corpus
+
+
+def time_calls(function, markup, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function(markup)
+    return (time.perf_counter() - started) * 1000 / repeat
+
+
+class Command(BaseCommand):
+    help = 'Compare the sanitizer with the previous regex clean() over a rendered markdown corpus and time both'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Runs per document, timings are averaged')
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        corpus = build_corpus()
+        # An unterminated tag makes a backtracking sanitizer quadratic
+        corpus['unterminated 80KB tag'] = '<a title="x" ' + 'b=c ' * 20000
+
+        totals = {'old': 0, 'new': 0}
+        identical = 0
+        print(f'{"document":32} {"size":>9} {"old ms":>9} {"new ms":>9}  output')
+        for name, markup in corpus.items():
+            old_ms = time_calls(regex_clean, markup, repeat)
+            new_ms = time_calls(sanitize_html, markup, repeat)
+            totals['old'] += old_ms
+            totals['new'] += new_ms
+            same = regex_clean(markup) == sanitize_html(markup)
+            identical += same
+
+            print(f'{name:32} {len(markup):9} {old_ms:9.3f} {new_ms:9.3f}  {"identical" if same else "differs"}')
+
+        print(f'{"total":32} {sum(map(len, corpus.values())):9} {totals["old"]:9.3f} {totals["new"]:9.3f}'
+              f'  {identical}/{len(corpus)} identical, {totals["old"] / totals["new"]:.1f}x')
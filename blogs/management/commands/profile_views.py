@@ -0,0 +1,201 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from blogs.feed_subscribers import flush_feed_subscribers
+from blogs.models import Blog, Hit, Post, Subscriber, Upvote
+from blogs.urls import urlpatterns
+
+from datetime import timedelta
+import json
+import time
+
+SEED_POSTS = 60
+SEED_HITS = 3000
+DEFAULT_QUERY_BUDGET = 20
+DEFAULT_TIME_BUDGET = 1000  # ms
+
+# How to request each named URL. Views that change state, call out to other services or need a POST are skipped.
+# budget is the most queries the view may run, for the first (cold cache) request, ViewBudgetTests enforces it.
+VIEW_REQUESTS = {
+    'home': {'host': 'blog', 'path': '/', 'budget': 6},
+    'post': {'host': 'blog', 'path': '/{post.slug}/', 'budget': 8},
+    'rss_feed': {'host': 'blog', 'path': '/feed/', 'budget': 6},
+    'sitemap': {'host': 'blog', 'path': '/sitemap.xml', 'budget': 4},
+    'robots': {'host': 'blog', 'path': '/robots.txt', 'budget': 3},
+    'public_analytics': {'host': 'blog', 'path': '/public-analytics/', 'budget': 16},
+    'subscribe': {'host': 'blog', 'path': '/subscribe/', 'budget': 3},
+    'stylesheet': {'host': 'blog', 'path': '/styles/{blog.pk}.{blog.styles_hash}.css', 'budget': 1},
+    'discover': {'path': '/discover/', 'budget': 6},
+    'discover_feed': {'path': '/discover/feed/', 'budget': 4},
+    'search': {'path': '/search/?query=seeded', 'budget': 4},
+    'signup_flow': {'path': '/signup/', 'budget': 2},
+    'account': {'path': '/dashboard/', 'user': 'owner', 'budget': 8},
+    'dashboard_customisation': {'path': '/dashboard/customise/', 'user': 'owner', 'budget': 6},
+    'dashboard': {'path': '/{blog.subdomain}/dashboard/', 'user': 'owner', 'budget': 8},
+    'nav': {'path': '/{blog.subdomain}/dashboard/nav/', 'user': 'owner', 'budget': 6},
+    'styles': {'path': '/{blog.subdomain}/dashboard/styles/', 'user': 'owner', 'budget': 8},
+    'settings': {'path': '/{blog.subdomain}/dashboard/settings/', 'user': 'owner', 'budget': 6},
+    'custom_domain_edit': {'path': '/{blog.subdomain}/dashboard/custom-domain/', 'user': 'owner', 'budget': 6},
+    'advanced_settings': {'path': '/{blog.subdomain}/dashboard/settings/advanced/', 'user': 'owner', 'budget': 6},
+    'directive_edit': {'path': '/{blog.subdomain}/dashboard/directives/', 'user': 'owner', 'budget': 6},
+    'email_list': {'path': '/{blog.subdomain}/dashboard/email-list/', 'user': 'owner', 'budget': 8},
+    'analytics': {'path': '/{blog.subdomain}/dashboard/analytics/', 'user': 'owner', 'budget': 18},
+    'analytics_upgraded': {'path': '/{blog.subdomain}/dashboard/analytics-upgraded/', 'user': 'owner', 'budget': 18},
+    'opt_in_review': {'path': '/{blog.subdomain}/dashboard/opt-in-review/', 'user': 'owner', 'budget': 6},
+    'posts_edit': {'path': '/{blog.subdomain}/dashboard/posts/', 'user': 'owner', 'budget': 6},
+    'pages_edit': {'path': '/{blog.subdomain}/dashboard/pages/', 'user': 'owner', 'budget': 6},
+    'post_new': {'path': '/{blog.subdomain}/dashboard/posts/new/', 'user': 'owner', 'budget': 6},
+    'post_edit': {'path': '/{blog.subdomain}/dashboard/posts/{post.uid}/', 'user': 'owner', 'budget': 8},
+    'post_template': {'path': '/{blog.subdomain}/dashboard/post-template/', 'user': 'owner', 'budget': 6},
+    'staff_dashboard': {'path': '/staff/dashboard/', 'user': 'staff', 'budget': 40},
+    'review_new': {'path': '/staff/review/new/', 'user': 'staff', 'budget': 12},
+    'review_opt_in': {'path': '/staff/review/opt-in/', 'user': 'staff', 'budget': 12},
+    'review_dodgy': {'path': '/staff/review/dodgy/', 'user': 'staff', 'budget': 12},
+}
+SKIPPED_VIEWS = {
+    'review_approve', 'review_block', 'review_ignore', 'review_delete', 'delete_empty', 'migrate_blog',
+    'user_delete', 'blog_delete', 'post_delete', 'upload_image', 'image-proxy', 'post_preview',
+    'ping', 'upvote', 'post_hit', 'email_subscribe', 'confirm_subscription', 'unsubscribe', 'upgrade',
+}
+
+
+def seed_dataset():
+    now = timezone.now()
+    owner = User.objects.create_user('profile-owner', 'owner@example.com', 'password')
+    staff = User.objects.create_user('profile-staff', 'staff@example.com', 'password', is_staff=True, is_superuser=True)
+
+    blog = Blog.objects.create(
+        user=owner,
+        title='Seeded blog',
+        subdomain='profile-seeded',
+        content='Hello {{ blog_title }}, last posted {{ blog_last_posted }}\n\n{{ posts limit:10 description:True }}',
+        reviewed=True,
+        public_analytics=True,
+        custom_styles='body { color: #333; }')
+    Blog.objects.create(user=staff, title='Another blog', subdomain='profile-other')
+
+    # One blog in each staff review queue: new, opted in and dodgy
+    for queue in ('new', 'opt-in', 'dodgy'):
+        reviewee = User.objects.create_user(f'profile-{queue}', f'{queue}@example.com', 'password')
+        review_blog = Blog.objects.create(user=reviewee, title=f'{queue} blog', subdomain=f'profile-{queue}', content='Waiting for review')
+        Post.objects.create(blog=review_blog, title='First post', slug='first-post', content='Hello', published_date=now)
+        # Saving reviews the blog of an upgraded user, which new users are
+        Blog.objects.filter(pk=review_blog.pk).update(
+            reviewed=False,
+            created_date=now - timedelta(days=3),
+            to_review=queue == 'opt-in',
+            dodginess_score=5 if queue == 'dodgy' else 0)
+
+    posts = []
+    for i in range(SEED_POSTS):
+        post = Post(
+            blog=blog,
+            title=f'Seeded post {i}',
+            slug=f'seeded-post-{i}',
+            content=f'# Seeded post {i}\n\nSome *seeded* text {{{{ post_title }}}}.\n\n```python\nprint({i})\n```\n' * 5,
+            all_tags=json.dumps(['seeded', f'tag-{i % 5}']),
+            is_page=i % 10 == 0,
+            published_date=now - timedelta(days=i))
+        post.save()
+        posts.append(post)
+
+    Hit.objects.bulk_create([
+        Hit(post=posts[i % len(posts)], hash_id=f'visitor-{i % 500}', country='ES', device='Desktop', browser='Firefox')
+        for i in range(SEED_HITS)
+    ], batch_size=500)
+    Upvote.objects.bulk_create([Upvote(post=posts[1], hash_id=f'visitor-{i}') for i in range(20)])
+    Subscriber.objects.bulk_create([Subscriber(blog=blog, email_address=f'reader{i}@example.com') for i in range(50)])
+
+    return {'blog': blog, 'post': posts[1], 'owner': owner, 'staff': staff}
+
+
+# Logged in clients and hosts for the seeded dataset, keyed the way VIEW_REQUESTS names them
+def seeded_clients(seeded):
+    # Errors are reported as 500s rather than stopping the run
+    clients = {user: Client(raise_request_exception=False) for user in (None, 'owner', 'staff')}
+    clients['owner'].force_login(seeded['owner'])
+    clients['staff'].force_login(seeded['staff'])
+    hosts = {None: 'ichoria.cc', 'blog': f'{seeded["blog"].subdomain}.ichoria.cc'}
+    return clients, hosts
+
+
+def profile_view(client, path, host):
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = client.get(path, HTTP_HOST=host)
+        total_time = (time.perf_counter() - started) * 1000
+
+    sql_time = sum(float(query['time']) for query in queries.captured_queries) * 1000
+    return {
+        'status': response.status_code,
+        'queries': len(queries),
+        'sql_ms': round(sql_time, 2),
+        'render_ms': round(total_time - sql_time, 2),
+        'total_ms': round(total_time, 2),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway test database and report query counts and timings for every URL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--time-budget', type=float, default=DEFAULT_TIME_BUDGET, help='Most milliseconds a cold request may take')
+
+    def handle(self, *args, **options):
+        report = {'views': {}, 'skipped': [], 'unknown': [], 'over_budget': []}
+
+        # Seeded into a test database, never the configured one
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.profile(report, options['time_budget'])
+            # Feed readers are buffered, write them while the seeded blog still exists
+            flush_feed_subscribers()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+            print(f'Report written to {options["output"]}')
+
+        if report['unknown']:
+            print('URLs without a profile entry:', ', '.join(report['unknown']))
+        if report['over_budget']:
+            print('Over budget:', ', '.join(report['over_budget']))
+
+    def profile(self, report, time_budget):
+        seeded = seed_dataset()
+        clients, hosts = seeded_clients(seeded)
+
+        for pattern in urlpatterns:
+            name = pattern.name
+            if name in SKIPPED_VIEWS:
+                report['skipped'].append(name)
+                continue
+            if name not in VIEW_REQUESTS:
+                if name:
+                    report['unknown'].append(name)
+                continue
+
+            options = VIEW_REQUESTS[name]
+            path = options['path'].format(**seeded)
+            client = clients[options.get('user')]
+            host = hosts[options.get('host')]
+
+            cold = profile_view(client, path, host)
+            warm = profile_view(client, path, host)
+            budget = options.get('budget', DEFAULT_QUERY_BUDGET)
+            within_budget = cold['status'] < 500 and cold['queries'] <= budget and cold['total_ms'] <= time_budget
+
+            report['views'][name] = {'path': path, 'budget': budget, 'cold': cold, 'warm': warm}
+            if not within_budget:
+                report['over_budget'].append(name)
+
+            print(f'{name:25} {cold["status"]} {cold["queries"]:3}/{budget:<3} queries {cold["total_ms"]:8.1f}ms'
+                  f' (sql {cold["sql_ms"]:.1f}ms)  warm: {warm["queries"]} queries {warm["total_ms"]:.1f}ms'
+                  f'{"" if within_budget else "  OVER BUDGET"}')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from blogs.models import Post
+from blogs.search import index_post
+
+
+class Command(BaseCommand):
+    help = 'Index every published post for full-text search'
+
+    def handle(self, *args, **options):
+        posts = Post.objects.filter(publish=True).select_related('blog')
+        count = 0
+        for post in posts.iterator(chunk_size=500):
+            index_post(post)
+            count += 1
+            if count % 1000 == 0:
+                print(f'Indexed {count} posts')
+        print(f'Indexed {count} posts')
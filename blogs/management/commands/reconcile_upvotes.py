@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from blogs.tasks import reconcile_upvotes
+
+
+class Command(BaseCommand):
+    help = 'Re-derive post upvote counters and scores from the Upvote rows'
+
+    def handle(self, *args, **options):
+        reconcile_upvotes()
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from blogs.scoring import SCORE_FORMULAS
+from blogs.tasks import rescore_posts
+
+
+class Command(BaseCommand):
+    help = 'Recompute discover trending scores for recently published posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formula', choices=sorted(SCORE_FORMULAS), help=f'Score formula (default: {settings.DISCOVER_SCORE_FORMULA})')
+        parser.add_argument('--window', type=int, help=f'Days of posts to rescore (default: {settings.DISCOVER_SCORE_WINDOW})')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Report what would change without writing")
+
+    def handle(self, *args, **options):
+        changed = rescore_posts(options['formula'], options['window'], options['dry_run'], options['chunk_size'])
+        if options['dry_run']:
+            for pk, score in changed[:20]:
+                print(f'Post {pk}: {score}')
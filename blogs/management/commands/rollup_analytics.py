@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from blogs.models import Hit, PersistentStore
+from blogs.rollups import rollup_hits
+
+from datetime import date, timedelta
+
+
+class Command(BaseCommand):
+    help = 'Backfill the daily analytics rollups from the raw hits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='from_date', type=date.fromisoformat, help='First day to roll up (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='to_date', type=date.fromisoformat, help='Last day to roll up (YYYY-MM-DD), defaults to yesterday')
+
+    def handle(self, *args, **options):
+        yesterday = timezone.now().date() - timedelta(days=1)
+        rolled_up_to = PersistentStore.load().analytics_rolled_up_to
+
+        if rolled_up_to:
+            next_date = rolled_up_to + timedelta(days=1)
+        else:
+            first_hit = Hit.objects.order_by('created_date').first()
+            next_date = first_hit.created_date.date() if first_hit else yesterday
+
+        from_date = options['from_date'] or next_date
+        to_date = min(options['to_date'] or yesterday, yesterday)
+
+        day = from_date
+        while day <= to_date:
+            rows = rollup_hits(day, day)
+            print(f'Rolled up {day}: {rows} blogs')
+            day += timedelta(days=1)
+
+        # Only move the marker forward if there are no gaps behind it
+        if from_date <= next_date and (rolled_up_to is None or to_date > rolled_up_to):
+            PersistentStore.objects.filter(pk=1).update(analytics_rolled_up_to=to_date)
+            print(f'Analytics rolled up to {to_date}')
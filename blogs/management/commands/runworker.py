@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from blogs.jobs import job_stats, run_worker
+
+import json
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2, help='Number of worker threads')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--stats', action='store_true', help='Print job metrics for the last day and exit')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            print(json.dumps(job_stats(), indent=2))
+            return
+        run_worker(options['concurrency'], options['burst'])
@@ -0,0 +1,53 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0020_media'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='persistentstore',
+            name='analytics_rolled_up_to',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='DailyPostStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('hits', models.IntegerField(default=0)),
+                ('unique_visitors', models.IntegerField(default=0)),
+                ('referrers', models.TextField(default='{}')),
+                ('devices', models.TextField(default='{}')),
+                ('browsers', models.TextField(default='{}')),
+                ('countries', models.TextField(default='{}')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='blogs.post')),
+            ],
+            options={
+                'unique_together': {('post', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyBlogStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('hits', models.IntegerField(default=0)),
+                ('unique_visitors', models.IntegerField(default=0)),
+                ('referrers', models.TextField(default='{}')),
+                ('devices', models.TextField(default='{}')),
+                ('browsers', models.TextField(default='{}')),
+                ('countries', models.TextField(default='{}')),
+                ('blog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='blogs.blog')),
+            ],
+            options={
+                'unique_together': {('blog', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:21
+
+from django.db import migrations, models
+from django.db.models.functions import Length
+import django.db.models.deletion
+
+def build_discover_index(apps, schema_editor):
+    Post = apps.get_model('blogs', 'Post')
+    DiscoverEntry = apps.get_model('blogs', 'DiscoverEntry')
+
+    posts = Post.objects.annotate(content_length=Length('content')).filter(
+        publish=True,
+        content_length__gt=100,
+        hidden=False,
+        blog__reviewed=True,
+        blog__user__is_active=True,
+        blog__hidden=False,
+        make_discoverable=True,
+    ).values('pk', 'blog_id', 'score', 'published_date', 'lang', 'blog__lang', 'content_length')
+
+    DiscoverEntry.objects.bulk_create([
+        DiscoverEntry(
+            post_id=post['pk'],
+            blog_id=post['blog_id'],
+            score=post['score'],
+            published_date=post['published_date'],
+            lang=post['lang'] or post['blog__lang'],
+            content_length=post['content_length'])
+        for post in posts.iterator()
+    ], batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0021_analytics_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiscoverEntry',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='discover_entry', serialize=False, to='blogs.post')),
+                ('score', models.FloatField(default=0)),
+                ('published_date', models.DateTimeField()),
+                ('lang', models.CharField(blank=True, max_length=10)),
+                ('content_length', models.IntegerField(default=0)),
+                ('blog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='discover_entries', to='blogs.blog')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='discoverentry',
+            index=models.Index(fields=['-score', '-published_date', '-post'], name='discover_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discoverentry',
+            index=models.Index(fields=['-published_date', '-post'], name='discover_newest_idx'),
+        ),
+        migrations.RunPython(build_discover_index, migrations.RunPython.noop),
+    ]
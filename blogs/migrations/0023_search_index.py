@@ -0,0 +1,94 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+POSTGRES_SQL = [
+    "ALTER TABLE blogs_searchdocument ADD COLUMN vector tsvector",
+    "CREATE INDEX blogs_searchdocument_vector_idx ON blogs_searchdocument USING GIN (vector)",
+    """
+    CREATE FUNCTION blogs_searchdocument_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.vector :=
+            setweight(to_tsvector(NEW.config::regconfig, NEW.title), 'A') ||
+            setweight(to_tsvector(NEW.config::regconfig, NEW.body), 'B') ||
+            to_tsvector('simple', NEW.title || ' ' || NEW.body);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER blogs_searchdocument_vector_trigger
+    BEFORE INSERT OR UPDATE ON blogs_searchdocument
+    FOR EACH ROW EXECUTE PROCEDURE blogs_searchdocument_vector_update()
+    """,
+]
+
+POSTGRES_REVERSE_SQL = [
+    "DROP TRIGGER IF EXISTS blogs_searchdocument_vector_trigger ON blogs_searchdocument",
+    "DROP FUNCTION IF EXISTS blogs_searchdocument_vector_update()",
+]
+
+SQLITE_SQL = [
+    """
+    CREATE VIRTUAL TABLE blogs_searchdocument_fts USING fts5(
+        title, body,
+        content='blogs_searchdocument', content_rowid='post_id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER blogs_searchdocument_fts_insert AFTER INSERT ON blogs_searchdocument BEGIN
+        INSERT INTO blogs_searchdocument_fts(rowid, title, body) VALUES (new.post_id, new.title, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER blogs_searchdocument_fts_delete AFTER DELETE ON blogs_searchdocument BEGIN
+        INSERT INTO blogs_searchdocument_fts(blogs_searchdocument_fts, rowid, title, body) VALUES ('delete', old.post_id, old.title, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER blogs_searchdocument_fts_update AFTER UPDATE ON blogs_searchdocument BEGIN
+        INSERT INTO blogs_searchdocument_fts(blogs_searchdocument_fts, rowid, title, body) VALUES ('delete', old.post_id, old.title, old.body);
+        INSERT INTO blogs_searchdocument_fts(rowid, title, body) VALUES (new.post_id, new.title, new.body);
+    END
+    """,
+]
+
+SQLITE_REVERSE_SQL = [
+    "DROP TRIGGER IF EXISTS blogs_searchdocument_fts_insert",
+    "DROP TRIGGER IF EXISTS blogs_searchdocument_fts_delete",
+    "DROP TRIGGER IF EXISTS blogs_searchdocument_fts_update",
+    "DROP TABLE IF EXISTS blogs_searchdocument_fts",
+]
+
+
+def run_vendor_sql(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+create_search_index = run_vendor_sql({'postgresql': POSTGRES_SQL, 'sqlite': SQLITE_SQL})
+drop_search_index = run_vendor_sql({'postgresql': POSTGRES_REVERSE_SQL, 'sqlite': SQLITE_REVERSE_SQL})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0022_discover_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='blogs.post')),
+                ('config', models.CharField(default='simple', max_length=20)),
+                ('title', models.CharField(max_length=200)),
+                ('body', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+import json
+
+def backfill_tags(apps, schema_editor):
+    Post = apps.get_model('blogs', 'Post')
+    Tag = apps.get_model('blogs', 'Tag')
+    PostTag = apps.get_model('blogs', 'PostTag')
+
+    post_tags = []
+    for post in Post.objects.exclude(all_tags__in=['', '[]']).values('pk', 'blog_id', 'all_tags').iterator():
+        try:
+            names = {name[:200] for name in json.loads(post['all_tags']) if name}
+        except (ValueError, TypeError):
+            continue
+        post_tags.extend((post['pk'], post['blog_id'], name) for name in names)
+
+    Tag.objects.bulk_create(
+        [Tag(blog_id=blog_id, name=name) for blog_id, name in {(blog_id, name) for _, blog_id, name in post_tags}],
+        batch_size=500,
+        ignore_conflicts=True)
+
+    tag_ids = {(tag.blog_id, tag.name): tag.pk for tag in Tag.objects.all()}
+    PostTag.objects.bulk_create(
+        [PostTag(post_id=post_id, tag_id=tag_ids[(blog_id, name)]) for post_id, blog_id, name in post_tags],
+        batch_size=500,
+        ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0023_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('blog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blog_tags', to='blogs.blog')),
+            ],
+            options={
+                'unique_together': {('blog', 'name')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PostTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_tags', to='blogs.post')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_tags', to='blogs.tag')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='posttag',
+            index=models.Index(fields=['tag', 'post'], name='blogs_postt_tag_id_aa5ecc_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='posttag',
+            unique_together={('post', 'tag')},
+        ),
+        migrations.RunPython(backfill_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0025_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Newsletter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('subject', models.CharField(max_length=200)),
+                ('html_message', models.TextField(blank=True)),
+                ('text_message', models.TextField(blank=True)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('started_date', models.DateTimeField(blank=True, null=True)),
+                ('finished_date', models.DateTimeField(blank=True, null=True)),
+                ('last_subscriber_id', models.IntegerField(default=0)),
+                ('sent_count', models.IntegerField(default=0)),
+                ('failed_count', models.IntegerField(default=0)),
+                ('sending_time', models.FloatField(default=0)),
+                ('blog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='newsletters', to='blogs.blog')),
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='newsletter', to='blogs.post')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='NewsletterDelivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email_address', models.EmailField(max_length=254)),
+                ('status', models.CharField(choices=[('sent', 'Sent'), ('failed', 'Failed')], max_length=10)),
+                ('error', models.TextField(blank=True)),
+                ('sent_date', models.DateTimeField(auto_now_add=True)),
+                ('newsletter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='blogs.newsletter')),
+                ('subscriber', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='blogs.subscriber')),
+            ],
+            options={
+                'unique_together': {('newsletter', 'email_address')},
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+import hashlib
+import re
+
+# Copied from blogs.stylesheets as it was when this migration was written
+CSS_TOKEN_REGEX = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*.*?\*/)', re.S)
+CSS_WHITESPACE_REGEX = re.compile(r'\s+')
+CSS_PUNCTUATION_REGEX = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_css(css):
+    parts = []
+    for i, part in enumerate(CSS_TOKEN_REGEX.split(css)):
+        if i % 2:
+            if not part.startswith('/*'):
+                parts.append(part)
+        else:
+            part = CSS_WHITESPACE_REGEX.sub(' ', part)
+            part = CSS_PUNCTUATION_REGEX.sub(r'\1', part)
+            parts.append(part.replace(';}', '}'))
+    return ''.join(parts).strip()
+
+
+# Only the blog's own styles, the default stylesheet is linked on its own
+def compile_stylesheets(apps, schema_editor):
+    Blog = apps.get_model('blogs', 'Blog')
+
+    blogs = []
+    for blog in Blog.objects.only('pk', 'custom_styles').iterator():
+        blog.compiled_styles = minify_css(blog.custom_styles or '')
+        blog.styles_hash = hashlib.md5(blog.compiled_styles.encode('utf-8')).hexdigest()[:12]
+        blogs.append(blog)
+    Blog.objects.bulk_update(blogs, ['compiled_styles', 'styles_hash'], batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0026_newsletters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blog',
+            name='compiled_styles',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='styles_hash',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.RunPython(compile_stylesheets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from collections import defaultdict
+import math
+
+# Copied from blogs.feed_subscribers as it was when this migration was written
+HLL_PRECISION = 11
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+
+
+def empty_sketch():
+    return bytearray(HLL_REGISTERS)
+
+
+def add_to_sketch(registers, hash_id):
+    value = int(hash_id[:16], 16)
+    index = value >> (64 - HLL_PRECISION)
+    rest = value & ((1 << (64 - HLL_PRECISION)) - 1)
+    rank = (64 - HLL_PRECISION) - rest.bit_length() + 1
+    if rank > registers[index]:
+        registers[index] = rank
+
+
+def count_sketch(registers):
+    estimate = HLL_ALPHA * HLL_REGISTERS ** 2 / sum(2.0 ** -rank for rank in registers)
+    zeros = registers.count(0)
+    if estimate <= 2.5 * HLL_REGISTERS and zeros:
+        estimate = HLL_REGISTERS * math.log(HLL_REGISTERS / zeros)
+    return int(round(estimate))
+
+def seed_feed_subscribers(apps, schema_editor):
+    RssSubscriber = apps.get_model('blogs', 'RssSubscriber')
+    DailyFeedSubscribers = apps.get_model('blogs', 'DailyFeedSubscribers')
+
+    # The raw rows only cover the last day, so carry them over rather than starting from zero
+    sketches = defaultdict(empty_sketch)
+    for blog_id, access_date, hash_id in RssSubscriber.objects.values_list('blog_id', 'access_date', 'hash_id').iterator():
+        add_to_sketch(sketches[(blog_id, access_date.date())], hash_id)
+
+    DailyFeedSubscribers.objects.bulk_create([
+        DailyFeedSubscribers(blog_id=blog_id, date=date, sketch=registers.hex(), subscribers=count_sketch(registers))
+        for (blog_id, date), registers in sketches.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0027_blog_stylesheet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyFeedSubscribers',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('subscribers', models.IntegerField(default=0)),
+                ('sketch', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='dailyfeedsubscribers',
+            name='blog',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_feed_subscribers', to='blogs.blog'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyfeedsubscribers',
+            unique_together={('blog', 'date')},
+        ),
+        migrations.RunPython(seed_feed_subscribers, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='RssSubscriber',
+        ),
+    ]
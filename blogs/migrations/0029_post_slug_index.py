@@ -0,0 +1,45 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:10
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+def normalise_slugs(apps, schema_editor):
+    Post = apps.get_model('blogs', 'Post')
+
+    # Older rows may predate lowercasing in Post.save
+    for post in Post.objects.exclude(slug=Lower('slug')).only('pk', 'slug').iterator():
+        Post.objects.filter(pk=post.pk).update(slug=post.slug.lower())
+    for post in Post.objects.exclude(alias=Lower('alias')).only('pk', 'alias').iterator():
+        Post.objects.filter(pk=post.pk).update(alias=post.alias.lower())
+
+    # Rename clashing slugs the way the studio does, keeping the oldest post's link
+    clashes = Post.objects.values('blog_id', 'slug').annotate(count=Count('id')).filter(count__gt=1)
+    for clash in clashes:
+        posts = Post.objects.filter(blog_id=clash['blog_id'], slug=clash['slug']).order_by('pk')
+        for post in list(posts)[1:]:
+            slug = post.slug
+            new_stack = '-new'
+            while Post.objects.filter(blog_id=post.blog_id, slug=slug).exists():
+                slug = f'{post.slug}{new_stack}'
+                new_stack += '-new'
+            Post.objects.filter(pk=post.pk).update(slug=slug)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0028_daily_feed_subscribers'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalise_slugs, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='post',
+            unique_together={('blog', 'slug')},
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['blog', 'alias'], name='post_alias_idx'),
+        ),
+    ]
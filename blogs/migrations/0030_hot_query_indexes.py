@@ -0,0 +1,69 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+# CREATE INDEX CONCURRENTLY on Postgres so Post, Hit and the rest stay writable during the deploy.
+# django.contrib.postgres's AddIndexConcurrently needs psycopg2 to import and can't run on SQLite, so this falls back there.
+class AddIndexConcurrently(migrations.AddIndex):
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if schema_editor.connection.vendor == 'postgresql' and self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, concurrently=True)
+        else:
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if schema_editor.connection.vendor == 'postgresql' and self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+        else:
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+    # Concurrent index builds can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('blogs', '0029_post_slug_index'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='hit',
+            index=models.Index(fields=['post', 'created_date'], name='hit_post_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='hit',
+            index=models.Index(fields=['post', 'hash_id'], name='hit_post_visitor_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='hit',
+            index=models.Index(fields=['created_date'], name='hit_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='post',
+            index=models.Index(fields=['uid'], name='post_uid_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='post',
+            index=models.Index(condition=models.Q(publish=True), fields=['blog', '-published_date'], name='post_published_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='post',
+            index=models.Index(fields=['blog', 'is_page', '-published_date'], name='post_studio_list_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='subscriber',
+            index=models.Index(fields=['blog', 'email_address'], name='subscriber_email_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='subscriber',
+            index=models.Index(fields=['subscribed_date'], name='subscriber_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='upvote',
+            index=models.Index(fields=['post', 'hash_id'], name='upvote_post_visitor_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:33
+
+import blogs.caching
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0030_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blog',
+            name='cache_version',
+            field=models.BigIntegerField(default=blogs.caching.new_cache_version),
+        ),
+    ]
@@ -0,0 +1,88 @@
+from django.db import migrations
+
+import re
+
+BATCH_SIZE = 500
+
+# Copied from blogs.search and blogs.helpers as index_post used them when this migration was written
+SEARCH_CONFIGS = {
+    'da': 'danish',
+    'de': 'german',
+    'en': 'english',
+    'es': 'spanish',
+    'fi': 'finnish',
+    'fr': 'french',
+    'hu': 'hungarian',
+    'it': 'italian',
+    'nb': 'norwegian',
+    'nl': 'dutch',
+    'nn': 'norwegian',
+    'no': 'norwegian',
+    'pt': 'portuguese',
+    'ro': 'romanian',
+    'ru': 'russian',
+    'sv': 'swedish',
+    'tr': 'turkish',
+}
+UNMARK_PATTERNS = [
+    ('#', re.compile(r'^\s{0,3}#{1,6}\s+.*$', re.MULTILINE)),
+    ('', re.compile(r'^\s{0,3}[-*]{3,}\s*$', re.MULTILINE)),
+    ('>', re.compile(r'^\s{0,3}>\s+.*$', re.MULTILINE)),
+    ('```', re.compile(r'```.*?```', re.DOTALL)),
+    ('`', re.compile(r'`[^`]+`')),
+    ('![', re.compile(r'!\[.*?\]\(.*?\)')),
+    ('](', re.compile(r'\[.*?\]\(.*?\)')),
+    ('', re.compile(r'(\*\*|__)(.*?)\1')),
+    ('', re.compile(r'(\*|_)(.*?)\1')),
+    ('~~', re.compile(r'~~.*?~~')),
+    ('', re.compile(r'^\s{0,3}[-*+]\s+.*$', re.MULTILINE)),
+    ('.', re.compile(r'^\s{0,3}\d+\.\s+.*$', re.MULTILINE)),
+    ('|', re.compile(r'^\s*\|.*?\|\s*$', re.MULTILINE)),
+    ('', re.compile(r'^\s*[:-]{3,}\s*$', re.MULTILINE)),
+]
+
+
+def search_config(lang):
+    return SEARCH_CONFIGS.get((lang or '').lower()[:2], 'simple')
+
+
+def unmark(content):
+    for required, pattern in UNMARK_PATTERNS:
+        if required in content:
+            content = pattern.sub('', content)
+    return content
+
+
+def backfill_search_index(apps, schema_editor):
+    Post = apps.get_model('blogs', 'Post')
+    SearchDocument = apps.get_model('blogs', 'SearchDocument')
+
+    posts = Post.objects.filter(publish=True).order_by('pk').values('pk', 'title', 'content', 'lang', 'blog__lang')
+    last_pk = 0
+    while True:
+        batch = list(posts.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            break
+        # The triggers from 0023 fill in the FTS5 table or the tsvector column, posts saved since are already indexed
+        SearchDocument.objects.bulk_create([
+            SearchDocument(
+                post_id=post['pk'],
+                config=search_config(post['lang'] or post['blog__lang']),
+                title=post['title'],
+                body=unmark(post['content']))
+            for post in batch
+        ], ignore_conflicts=True)
+        last_pk = batch[-1]['pk']
+
+
+class Migration(migrations.Migration):
+    # Each batch commits on its own rather than holding one transaction over every post
+    atomic = False
+
+    dependencies = [
+        ('blogs', '0031_blog_cache_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_search_index, migrations.RunPython.noop),
+    ]
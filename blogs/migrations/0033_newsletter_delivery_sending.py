@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogs', '0032_backfill_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='newsletterdelivery',
+            name='status',
+            field=models.CharField(choices=[('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], max_length=10),
+        ),
+    ]
@@ -1,15 +1,19 @@
 from django.utils import timezone
-from django.db import models
+from django.db import connection, models, transaction
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
-from django.db.models.signals import post_save
+from django.db.models import Case, Count, F, Q, Value, When
+from django.db.models.functions import Length, Log
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.core.cache import cache
 
 from allauth.account.models import EmailAddress
 
+from blogs.caching import invalidate_blog_address, invalidate_blog_pages, invalidate_user_blog_pages, new_cache_version
+from blogs.scoring import SCORE_EPOCH, SCORE_PERIOD, calculate_score, score_formula
+from blogs.stylesheets import compile_blog_stylesheet
+
 import json
-from math import log
 import random
 import string
 import hashlib
@@ -28,12 +32,43 @@ class UserSettings(models.Model):
         return f'{self.user} - Settings'
 
 
+# Cached blog rows carry the user's settings (upgraded changes how posts render)
+@receiver(post_save, sender=UserSettings)
+def invalidate_user_settings_blog_pages(sender, instance, created=False, **kwargs):
+    if not created:
+        invalidate_user_blog_pages(instance.user_id)
+
+
 # On User save, create UserSettigs
 @receiver(post_save, sender=User)
 def create_user_settings(sender, instance, **kwargs):
     user_settings, created = UserSettings.objects.get_or_create(user=instance)
     if user_settings.upgraded:
-        user_settings.user.blogs.update(reviewed=True)
+        unreviewed = list(user_settings.user.blogs.filter(reviewed=False))
+        if unreviewed:
+            user_settings.user.blogs.update(reviewed=True)
+            for blog in unreviewed:
+                blog.reviewed = True
+                blog.update_discover_entries()
+
+
+# On User save, drop cached addresses of their blogs (is_active may have changed)
+@receiver(post_save, sender=User)
+def invalidate_user_blog_addresses(sender, instance, update_fields=None, **kwargs):
+    if update_fields and 'is_active' not in update_fields:
+        return
+    for subdomain, domain in instance.blogs.values_list('subdomain', 'domain'):
+        invalidate_blog_address(subdomain, domain)
+    invalidate_user_blog_pages(instance.pk)
+
+
+# On User save, (de)list their posts from discover (is_active may have changed)
+@receiver(post_save, sender=User)
+def update_user_discover_entries(sender, instance, created=False, update_fields=None, **kwargs):
+    if created or (update_fields and 'is_active' not in update_fields):
+        return
+    for blog in instance.blogs.all():
+        blog.update_discover_entries()
 
 
 class Blog(models.Model):
@@ -68,6 +103,9 @@ class Blog(models.Model):
         default=False,
         choices=((True, 'Overwrite default styles'), (False, 'Extend default styles')),
         verbose_name='')
+    compiled_styles = models.TextField(blank=True)
+    styles_hash = models.CharField(max_length=16, blank=True)
+    cache_version = models.BigIntegerField(default=new_cache_version)
     favicon = models.CharField(max_length=100, default="⭐", blank=True)
 
     date_format = models.CharField(max_length=32, blank=True)
@@ -79,7 +117,48 @@ class Blog(models.Model):
     post_template = models.TextField(blank=True)
     robots_txt = models.TextField(blank=True)
     rss_alias = models.CharField(max_length=100, blank=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Blog, cls).from_db(db, field_names, values)
+        # Keep the loaded address to know when the address cache needs invalidating
+        loaded_values = dict(zip(field_names, values))
+        instance._loaded_address = (loaded_values.get('subdomain'), loaded_values.get('domain'))
+        instance._loaded_discover = (loaded_values.get('reviewed'), loaded_values.get('hidden'), loaded_values.get('lang'))
+        instance._loaded_styles = (loaded_values.get('custom_styles'), loaded_values.get('overwrite_styles'))
+        return instance
+
+    @property
+    def discoverable(self):
+        return self.reviewed and not self.hidden and self.user.is_active
+
+    def update_discover_entries(self):
+        DiscoverEntry.objects.filter(blog=self).delete()
+        if not self.discoverable:
+            return
+
+        posts = self.posts.annotate(content_length=Length('content')).filter(
+            publish=True,
+            hidden=False,
+            make_discoverable=True,
+            content_length__gt=100
+        ).values('pk', 'score', 'published_date', 'lang', 'content_length')
+
+        DiscoverEntry.objects.bulk_create([
+            DiscoverEntry(
+                post_id=post['pk'],
+                blog=self,
+                score=post['score'],
+                published_date=post['published_date'],
+                lang=post['lang'] or self.lang,
+                content_length=post['content_length'])
+            for post in posts
+        ], batch_size=500)
     
+    def update_stylesheet(self):
+        self.compiled_styles, self.styles_hash = compile_blog_stylesheet(self.custom_styles)
+        self._loaded_styles = (self.custom_styles, self.overwrite_styles)
+
     @property
     def older_than_one_day(self):
         return (timezone.now() - self.created_date).days > 1
@@ -120,13 +199,20 @@ class Blog(models.Model):
         content_length = len(self.content) if self.content is not None else 0
         return not self.user.settings.upgraded and content_length < 20 and self.posts.count() == 0 and self.custom_styles == ""
     
+    def published_tags(self):
+        return Tag.objects.filter(
+            blog=self,
+            post_tags__post__publish=True,
+            post_tags__post__is_page=False,
+            post_tags__post__published_date__lt=timezone.now())
+
     @property
     def tags(self):
-        all_tags = []
-        for post in Post.objects.filter(blog=self, publish=True, is_page=False, published_date__lt=timezone.now()):
-            all_tags.extend(json.loads(post.all_tags))
-            all_tags = list(set(all_tags))
-        return sorted(all_tags)
+        return sorted(self.published_tags().values_list('name', flat=True).distinct())
+
+    @property
+    def tag_counts(self):
+        return dict(self.published_tags().values('name').annotate(count=Count('post_tags')).values_list('name', 'count'))
     
     @property
     def last_posted(self):
@@ -157,17 +243,39 @@ class Blog(models.Model):
         
         if not self.reviewed:
             self.determine_dodginess()
-        
-        # Invalidate feed cache
-        CACHE_KEY = f'{self.subdomain}_all_posts'
-        cache.delete(CACHE_KEY)
 
+        # Rebuild the stylesheet, its new hash busts the browser cache
+        if not self.styles_hash or getattr(self, '_loaded_styles', (None,))[0] != self.custom_styles:
+            self.update_stylesheet()
+        
         super(Blog, self).save(*args, **kwargs)
 
+        # Invalidate cached pages
+        self.cache_version = invalidate_blog_pages(self.pk)
+
+        # Invalidate address cache if the subdomain or domain changed
+        loaded_address = getattr(self, '_loaded_address', None)
+        if loaded_address != (self.subdomain, self.domain):
+            if loaded_address:
+                invalidate_blog_address(*loaded_address)
+            invalidate_blog_address(self.subdomain, self.domain)
+            self._loaded_address = (self.subdomain, self.domain)
+
+        # Relist the posts on discover if the blog's eligibility or language changed
+        loaded_discover = getattr(self, '_loaded_discover', None)
+        if loaded_discover and loaded_discover != (self.reviewed, self.hidden, self.lang):
+            self.update_discover_entries()
+            self._loaded_discover = (self.reviewed, self.hidden, self.lang)
+
     def __str__(self):
         return f'{self.title} ({self.useful_domain})'
 
 
+@receiver(post_delete, sender=Blog)
+def invalidate_deleted_blog_address(sender, instance, **kwargs):
+    invalidate_blog_address(instance.subdomain, instance.domain)
+
+
 class Post(models.Model):
     blog = models.ForeignKey(Blog, on_delete=models.CASCADE, related_name='posts')
     uid = models.CharField(max_length=200)
@@ -194,6 +302,18 @@ class Post(models.Model):
     pinned = models.BooleanField(default=False)
     deprioritise = models.BooleanField(default=False)
 
+    class Meta:
+        # Slugs and aliases are stored lowercased so readers' paths resolve with plain indexed lookups
+        unique_together = ('blog', 'slug')
+        indexes = [
+            models.Index(fields=['blog', 'alias'], name='post_alias_idx'),
+            models.Index(fields=['uid'], name='post_uid_idx'),
+            # Blog home, blog listing and feed. Partial, drafts are never listed to readers
+            models.Index(fields=['blog', '-published_date'], condition=Q(publish=True), name='post_published_idx'),
+            # Studio post and page lists
+            models.Index(fields=['blog', 'is_page', '-published_date'], name='post_studio_list_idx'),
+        ]
+
     @property
     def contains_code(self):
         return "```" in self.content
@@ -206,24 +326,82 @@ class Post(models.Model):
     def token(self):
         return hashlib.sha256(self.uid.encode()).hexdigest()[0:10]
 
+    @property
+    def discoverable(self):
+        return (self.publish and not self.hidden and self.make_discoverable
+                and len(self.content) > 100 and self.blog.discoverable)
+
+    def update_discover_entry(self):
+        if self.discoverable:
+            DiscoverEntry.objects.update_or_create(post=self, defaults={
+                'blog': self.blog,
+                'score': self.score,
+                'published_date': self.published_date,
+                'lang': self.lang or self.blog.lang,
+                'content_length': len(self.content),
+            })
+        else:
+            DiscoverEntry.objects.filter(post=self).delete()
+
+    def update_tags(self):
+        names = {name[:200] for name in self.tags if name}
+        existing = {post_tag.tag.name: post_tag.pk for post_tag in self.post_tags.select_related('tag')}
+
+        # Tags left without posts are deleted by the prune_tags job, pruning here races other saves
+        stale = [pk for name, pk in existing.items() if name not in names]
+        if stale:
+            PostTag.objects.filter(pk__in=stale).delete()
+
+        new = names - set(existing)
+        if new:
+            # A new tag only becomes visible to the prune together with its link
+            with transaction.atomic():
+                Tag.objects.bulk_create([Tag(blog_id=self.blog_id, name=name) for name in new], ignore_conflicts=True)
+                PostTag.objects.bulk_create([
+                    PostTag(post=self, tag=tag)
+                    for tag in Tag.objects.filter(blog_id=self.blog_id, name__in=new)
+                ], ignore_conflicts=True)
+
+    # SQL version of the log score for when the upvote counter moves by delta in the same UPDATE.
+    # Other formulas are left to the rescore_posts job.
+    def score_expression(self, delta):
+        posted_at = self.first_published_at or self.published_date
+        if score_formula() != 'log' or not posted_at or posted_at.timestamp() <= 0:
+            return F('score')
+        seconds = posted_at.timestamp()
+
+        if self.blog.deprioritise:
+            score = Value(0.0)
+        else:
+            score = Case(
+                When(deprioritise=True, then=Value(0.0)),
+                default=Log(Value(10.0), F('upvotes') + delta) + Value((seconds - SCORE_EPOCH) / SCORE_PERIOD),
+                output_field=models.FloatField())
+
+        return Case(
+            When(upvotes__gt=1 - delta, then=score),
+            default=F('score'),
+            output_field=models.FloatField())
+
+    def add_upvotes(self, count=1):
+        Post.objects.filter(pk=self.pk).update(
+            upvotes=F('upvotes') + count,
+            score=self.score_expression(count))
+        self.refresh_from_db(fields=['upvotes', 'score'])
+        DiscoverEntry.objects.filter(post_id=self.pk).update(score=self.score)
+
     def update_score(self):
         self.upvotes = self.upvote_set.count()
-
-        if self.upvotes > 1:
-            log_of_upvotes = log(self.upvotes, 10)
-
-            posted_at = self.first_published_at or self.published_date
-
-            seconds = posted_at.timestamp()
-            if seconds > 0:
-                if self.blog.deprioritise or self.deprioritise:
-                    score = 0
-                else:
-                    score = (log_of_upvotes) + ((seconds - 1577811600) / (14 * 86400))
-                self.score = score
+        self.score = calculate_score(
+            self.upvotes,
+            self.first_published_at or self.published_date,
+            self.blog.deprioritise or self.deprioritise,
+            timezone.now(),
+            self.score)
     
     def save(self, *args, **kwargs):
         self.slug = self.slug.lower()
+        self.alias = self.alias.lower()
         if not self.all_tags:
             self.all_tags = '[]'
         
@@ -244,21 +422,85 @@ class Post(models.Model):
 
         super(Post, self).save(*args, **kwargs)
 
+        # Keep the tag, discover and search indexes in step
+        self.update_tags()
+        self.update_discover_entry()
+        from blogs.search import index_post
+        index_post(self)
+
+        # Invalidate cached pages
+        invalidate_blog_pages(self.blog_id)
+
+        # Pre-render the markup so readers get it from the cache
+        from blogs.templatetags.custom_tags import render_markup
+        render_markup(self.content, self.blog.user.settings.upgraded)
+
     def __str__(self):
         return self.title
 
 
+@receiver(post_delete, sender=Post)
+def invalidate_deleted_post_pages(sender, instance, **kwargs):
+    invalidate_blog_pages(instance.blog_id)
+
+
+class Tag(models.Model):
+    blog = models.ForeignKey(Blog, on_delete=models.CASCADE, related_name='blog_tags')
+    name = models.CharField(max_length=200)
+
+    class Meta:
+        unique_together = ('blog', 'name')
+
+    def __str__(self):
+        return self.name
+
+
+# Normalised copy of Post.all_tags, synced on Post.save
+class PostTag(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='post_tags')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='post_tags')
+
+    class Meta:
+        unique_together = ('post', 'tag')
+        indexes = [
+            models.Index(fields=['tag', 'post']),
+        ]
+
+    def __str__(self):
+        return f'{self.post} - {self.tag}'
+
+
+# One statement, so a tag linked by a concurrent save is never seen as orphaned
+def delete_orphan_tags():
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            DELETE FROM {Tag._meta.db_table}
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {PostTag._meta.db_table} WHERE {PostTag._meta.db_table}.tag_id = {Tag._meta.db_table}.id
+            )
+        ''')
+        return cursor.rowcount
+
+
 class Upvote(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     created_date = models.DateTimeField(auto_now_add=True)
     hash_id = models.CharField(max_length=200)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'hash_id'], name='upvote_post_visitor_idx'),
+        ]
+
     def save(self, *args, **kwargs):
+        adding = self._state.adding
+
         # Save the Upvote instance
         super(Upvote, self).save(*args, **kwargs)
-        
-        # Update the post score on post save
-        self.post.save()
+
+        # Bump the counter and score in place, without saving the post or blog
+        if adding:
+            self.post.add_upvotes()
 
     def __str__(self):
         return f"{self.created_date.strftime('%d %b %Y, %X')} - {self.hash_id} - {self.post}"
@@ -273,26 +515,168 @@ class Hit(models.Model):
     device = models.CharField(max_length=200, blank=True)
     browser = models.CharField(max_length=200, blank=True)
 
+    class Meta:
+        indexes = [
+            # Analytics: a blog's posts joined to their hits in the date range
+            models.Index(fields=['post', 'created_date'], name='hit_post_date_idx'),
+            # De-duplicating batched hits
+            models.Index(fields=['post', 'hash_id'], name='hit_post_visitor_idx'),
+            # Daily rollups
+            models.Index(fields=['created_date'], name='hit_date_idx'),
+        ]
+
     def __str__(self):
         return f"{self.created_date.strftime('%d %b %Y, %X')} - {self.hash_id} - {self.post}"
 
 
+# Denormalised listing of discoverable posts, so discover pages are index range scans
+class DiscoverEntry(models.Model):
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='discover_entry')
+    blog = models.ForeignKey(Blog, on_delete=models.CASCADE, related_name='discover_entries')
+    score = models.FloatField(default=0)
+    published_date = models.DateTimeField()
+    lang = models.CharField(max_length=10, blank=True)
+    content_length = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score', '-published_date', '-post'], name='discover_trending_idx'),
+            models.Index(fields=['-published_date', '-post'], name='discover_newest_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.post_id} - {self.score}'
+
+
+# Plain text of published posts for full-text search. The vendor specific index
+# (tsvector + GIN on Postgres, FTS5 on SQLite) is created and kept in sync by the migration.
+class SearchDocument(models.Model):
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    config = models.CharField(max_length=20, default='simple')
+    title = models.CharField(max_length=200)
+    body = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.title
+
+
+# Daily analytics rollups of closed days, built from Hit rows by blogs.rollups
+class DailyBlogStats(models.Model):
+    blog = models.ForeignKey(Blog, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    hits = models.IntegerField(default=0)
+    unique_visitors = models.IntegerField(default=0)
+    referrers = models.TextField(default='{}')
+    devices = models.TextField(default='{}')
+    browsers = models.TextField(default='{}')
+    countries = models.TextField(default='{}')
+
+    class Meta:
+        unique_together = ('blog', 'date')
+
+    def __str__(self):
+        return f"{self.date} - {self.blog.subdomain} - {self.hits}"
+
+
+class DailyPostStats(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    hits = models.IntegerField(default=0)
+    unique_visitors = models.IntegerField(default=0)
+    referrers = models.TextField(default='{}')
+    devices = models.TextField(default='{}')
+    browsers = models.TextField(default='{}')
+    countries = models.TextField(default='{}')
+
+    class Meta:
+        unique_together = ('post', 'date')
+
+    def __str__(self):
+        return f"{self.date} - {self.post} - {self.hits}"
+
+
 class Subscriber(models.Model):
     blog = models.ForeignKey(Blog, on_delete=models.CASCADE)
     email_address = models.EmailField()
     subscribed_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['blog', 'email_address'], name='subscriber_email_idx'),
+            # Global sign-up rate limit
+            models.Index(fields=['subscribed_date'], name='subscriber_date_idx'),
+        ]
     
     def __str__(self):
         return f"{self.blog.title} - {self.email_address}"
 
 
-class RssSubscriber(models.Model):
-    blog = models.ForeignKey(Blog, on_delete=models.CASCADE)
-    access_date = models.DateTimeField(auto_now_add=True)
-    hash_id = models.CharField(max_length=200)
+# A post sent to the blog's subscribers, see blogs/newsletters.py
+class Newsletter(models.Model):
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (SENDING, 'Sending'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    blog = models.ForeignKey(Blog, on_delete=models.CASCADE, related_name='newsletters')
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, related_name='newsletter')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    subject = models.CharField(max_length=200)
+    html_message = models.TextField(blank=True)
+    text_message = models.TextField(blank=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+    started_date = models.DateTimeField(blank=True, null=True)
+    finished_date = models.DateTimeField(blank=True, null=True)
+    last_subscriber_id = models.IntegerField(default=0)
+    sent_count = models.IntegerField(default=0)
+    failed_count = models.IntegerField(default=0)
+    sending_time = models.FloatField(default=0)
+
+    @property
+    def throughput(self):
+        if not self.sending_time:
+            return 0
+        return round(self.sent_count / self.sending_time, 1)
+
+    def __str__(self):
+        return f'{self.blog.title} - {self.subject} ({self.status})'
+
+
+class NewsletterDelivery(models.Model):
+    # Sending is recorded before the email goes out, it stays that way if the worker died mid-send
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(SENDING, 'Sending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    newsletter = models.ForeignKey(Newsletter, on_delete=models.CASCADE, related_name='deliveries')
+    subscriber = models.ForeignKey(Subscriber, on_delete=models.SET_NULL, blank=True, null=True)
+    email_address = models.EmailField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    error = models.TextField(blank=True)
+    sent_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('newsletter', 'email_address')
+
+    def __str__(self):
+        return f'{self.email_address} - {self.status}'
+
+
+# Approximate daily count of distinct feed readers, see blogs/feed_subscribers.py
+class DailyFeedSubscribers(models.Model):
+    blog = models.ForeignKey(Blog, on_delete=models.CASCADE, related_name='daily_feed_subscribers')
+    date = models.DateField()
+    subscribers = models.IntegerField(default=0)
+    # HyperLogLog registers as hex, cleared once the day is over
+    sketch = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = ('blog', 'date')
 
     def __str__(self):
-        return f"{self.access_date.strftime('%d %b %Y, %X')} - {self.blog.title} - {self.hash_id}"
+        return f"{self.date} - {self.blog.subdomain} - {self.subscribers}"
 
 
 class Stylesheet(models.Model):
@@ -318,11 +702,44 @@ class Media(models.Model):
         return f"{self.blog.subdomain} - {self.url} - {self.created_at}"
     
 
+# Database backed job queue, see blogs/jobs.py
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=100)
+    kwargs = models.TextField(default='{}')
+    queue = models.CharField(max_length=50, default='default')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    unique_key = models.CharField(max_length=200, blank=True, null=True, unique=True)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    created_date = models.DateTimeField(auto_now_add=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    finished_date = models.DateTimeField(blank=True, null=True)
+    duration = models.FloatField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
+
+
 # Singleton model to store Bear specific settings
 class PersistentStore(models.Model):
     last_executed = models.DateTimeField(default=timezone.now)
     review_ignore_terms = models.TextField(blank=True, default='[]')
     review_highlight_terms = models.TextField(blank=True, default='[]')
+    analytics_rolled_up_to = models.DateField(blank=True, null=True)
 
     @property
     def ignore_terms(self):
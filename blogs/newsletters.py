@@ -0,0 +1,177 @@
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from django.utils.html import escape
+
+from blogs.helpers import unmark
+from blogs.jobs import JobLost, enqueue, heartbeat
+from blogs.models import Newsletter, NewsletterDelivery, Subscriber
+
+from email.utils import formataddr, parseaddr
+from urllib.parse import urlencode
+import smtplib
+import time
+
+NEWSLETTER_BATCH_SIZE = 50
+NEWSLETTER_BATCH_DELAY = 1  # seconds between batches, to stay under the SMTP provider's rate limits
+
+
+# The unsubscribe link is added per subscriber when sending
+def render_newsletter(post):
+    from blogs.templatetags.custom_tags import markdown
+
+    blog = post.blog
+    post_url = f'https://{blog.subdomain}.ichoria.cc/{post.slug}/'
+    content = post.content.replace('{{ email-signup }}', '')
+
+    html_message = f'''
+        <h1>{escape(post.title)}</h1>
+        {markdown(content, post)}
+        <br>
+        <br>
+        <a href="{post_url}">Leer en {escape(blog.title)}</a>
+        <br>
+        <small>Recibes este correo porque te suscribiste a <a href="https://{blog.subdomain}.ichoria.cc">{escape(blog.title)}</a>.</small>
+    '''
+    text_message = f'''
+        {post.title}
+
+        {unmark(content)}
+
+        Leer en {blog.title}: {post_url}
+    '''
+    return html_message, text_message
+
+
+def unsubscribe_token(blog, email_address):
+    return salted_hmac('newsletter-unsubscribe', f'{blog.pk} {email_address.lower()}').hexdigest()
+
+
+def unsubscribe_url(blog, email_address):
+    query = urlencode({'email': email_address, 'token': unsubscribe_token(blog, email_address)})
+    return f'https://{blog.subdomain}.ichoria.cc/unsubscribe/?{query}'
+
+
+def subscriber_message(newsletter, email_address, from_email, connection):
+    url = unsubscribe_url(newsletter.blog, email_address)
+    message = EmailMultiAlternatives(
+        newsletter.subject,
+        f'{newsletter.text_message}\n        Cancelar suscripción: {url}\n',
+        from_email,
+        [email_address],
+        connection=connection,
+        headers={'List-Unsubscribe': f'<{url}>', 'List-Unsubscribe-Post': 'List-Unsubscribe=One-Click'})
+    message.attach_alternative(
+        f'{newsletter.html_message}<br><small><a href="{escape(url)}">Cancelar suscripción</a></small>',
+        'text/html')
+    return message
+
+
+def queue_newsletter(post):
+    html_message, text_message = render_newsletter(post)
+    newsletter, created = Newsletter.objects.get_or_create(post=post, defaults={
+        'blog': post.blog,
+        'subject': post.title,
+        'html_message': html_message,
+        'text_message': text_message,
+    })
+    if created:
+        enqueue('send_newsletter', newsletter_id=newsletter.pk)
+    return newsletter, created
+
+
+def send_message(connection, message):
+    try:
+        connection.send_messages([message])
+    except smtplib.SMTPServerDisconnected:
+        # The pooled connection went stale, reconnect and try once more
+        connection.close()
+        connection.open()
+        connection.send_messages([message])
+
+
+# Send a newsletter over one SMTP connection, a batch of subscribers at a time.
+# Each delivery is recorded before its email goes out, so a retried job never emails anyone twice,
+# and progress is saved after every batch so the retry carries on where it stopped.
+def deliver_newsletter(newsletter_id):
+    newsletter = Newsletter.objects.select_related('blog').get(pk=newsletter_id)
+    if newsletter.status == Newsletter.DONE:
+        return newsletter
+
+    newsletter.status = Newsletter.SENDING
+    newsletter.started_date = newsletter.started_date or timezone.now()
+    newsletter.save(update_fields=['status', 'started_date'])
+
+    from_email = formataddr((newsletter.blog.title, parseaddr(settings.DEFAULT_FROM_EMAIL)[1]))
+
+    connection = get_connection()
+    connection.open()
+    try:
+        while True:
+            subscribers = list(Subscriber.objects.filter(
+                blog=newsletter.blog,
+                pk__gt=newsletter.last_subscriber_id
+            ).order_by('pk').values('pk', 'email_address')[:NEWSLETTER_BATCH_SIZE])
+            if not subscribers:
+                break
+
+            started = time.monotonic()
+            delivered = set(NewsletterDelivery.objects.filter(
+                newsletter=newsletter,
+                email_address__in=[subscriber['email_address'] for subscriber in subscribers]
+            ).values_list('email_address', flat=True))
+
+            deliveries = []
+            for subscriber in subscribers:
+                if subscriber['email_address'] in delivered:
+                    continue
+                delivered.add(subscriber['email_address'])
+
+                try:
+                    delivery = NewsletterDelivery.objects.create(
+                        newsletter=newsletter,
+                        subscriber_id=subscriber['pk'],
+                        email_address=subscriber['email_address'],
+                        status=NewsletterDelivery.SENDING)
+                except IntegrityError:
+                    # Recorded by another attempt in the meantime
+                    continue
+
+                message = subscriber_message(newsletter, subscriber['email_address'], from_email, connection)
+                try:
+                    send_message(connection, message)
+                    delivery.status = NewsletterDelivery.SENT
+                except (smtplib.SMTPException, OSError) as e:
+                    delivery.status = NewsletterDelivery.FAILED
+                    delivery.error = str(e)
+                NewsletterDelivery.objects.filter(pk=delivery.pk).update(status=delivery.status, error=delivery.error)
+                deliveries.append(delivery)
+
+            sent = sum(1 for delivery in deliveries if delivery.status == NewsletterDelivery.SENT)
+            newsletter.last_subscriber_id = subscribers[-1]['pk']
+            Newsletter.objects.filter(pk=newsletter.pk).update(
+                last_subscriber_id=newsletter.last_subscriber_id,
+                sent_count=F('sent_count') + sent,
+                failed_count=F('failed_count') + len(deliveries) - sent,
+                sending_time=F('sending_time') + time.monotonic() - started)
+            # Big lists take longer than JOB_TIMEOUT, keep the job from being handed to another worker
+            heartbeat()
+
+            if len(subscribers) == NEWSLETTER_BATCH_SIZE:
+                time.sleep(NEWSLETTER_BATCH_DELAY)
+    except JobLost:
+        # Another worker carries on from last_subscriber_id
+        raise
+    except Exception:
+        Newsletter.objects.filter(pk=newsletter.pk).update(status=Newsletter.FAILED)
+        raise
+    finally:
+        connection.close()
+
+    Newsletter.objects.filter(pk=newsletter.pk).update(status=Newsletter.DONE, finished_date=timezone.now())
+    newsletter.refresh_from_db()
+    print(f'Sent newsletter {newsletter}: {newsletter.sent_count} sent, {newsletter.failed_count} failed, {newsletter.throughput}/s')
+    return newsletter
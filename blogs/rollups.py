@@ -0,0 +1,138 @@
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from blogs.models import DailyBlogStats, DailyPostStats, Hit, PersistentStore
+
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+import json
+
+BREAKDOWNS = {
+    'referrer': 'referrers',
+    'device': 'devices',
+    'browser': 'browsers',
+    'country': 'countries',
+}
+TOP_REFERRERS = 100
+
+
+def day_start(date):
+    return timezone.make_aware(datetime.combine(date, time.min))
+
+
+def hits_between(start_date, end_date):
+    return Hit.objects.filter(
+        created_date__gte=day_start(start_date),
+        created_date__lt=day_start(end_date + timedelta(days=1)))
+
+
+def empty_stats():
+    return {'hits': 0, 'unique_visitors': 0, **{name: Counter() for name in BREAKDOWNS.values()}}
+
+
+def serialise_stats(stats):
+    stats = dict(stats)
+    stats['referrers'] = stats['referrers'].most_common(TOP_REFERRERS)
+    for name in BREAKDOWNS.values():
+        stats[name] = json.dumps(dict(stats[name]))
+    return stats
+
+
+# Recompute the rollups of start_date to end_date (inclusive) from the raw hits
+def rollup_hits(start_date, end_date, blog_ids=None):
+    hits = hits_between(start_date, end_date)
+    if blog_ids is not None:
+        hits = hits.filter(post__blog_id__in=blog_ids)
+    hits = hits.annotate(date=TruncDate('created_date')).order_by()
+
+    post_stats = defaultdict(empty_stats)
+    post_blogs = {}
+    for row in hits.values('date', 'post_id', 'post__blog_id').annotate(
+            hit_count=Count('id'), visitor_count=Count('hash_id', distinct=True)):
+        stats = post_stats[(row['date'], row['post_id'])]
+        stats['hits'] = row['hit_count']
+        stats['unique_visitors'] = row['visitor_count']
+        post_blogs[row['post_id']] = row['post__blog_id']
+
+    for field, name in BREAKDOWNS.items():
+        rows = hits.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True}).values('date', 'post_id', field).annotate(count=Count('id'))
+        for row in rows:
+            post_stats[(row['date'], row['post_id'])][name][row[field]] = row['count']
+
+    # Blog totals are the sum of their posts, except for visitors who may read several posts
+    blog_stats = defaultdict(empty_stats)
+    for (date, post_id), stats in post_stats.items():
+        totals = blog_stats[(date, post_blogs[post_id])]
+        totals['hits'] += stats['hits']
+        for name in BREAKDOWNS.values():
+            totals[name].update(stats[name])
+
+    for row in hits.values('date', 'post__blog_id').annotate(visitor_count=Count('hash_id', distinct=True)):
+        blog_stats[(row['date'], row['post__blog_id'])]['unique_visitors'] = row['visitor_count']
+
+    with transaction.atomic():
+        old_post_stats = DailyPostStats.objects.filter(date__range=(start_date, end_date))
+        old_blog_stats = DailyBlogStats.objects.filter(date__range=(start_date, end_date))
+        if blog_ids is not None:
+            old_post_stats = old_post_stats.filter(post__blog_id__in=blog_ids)
+            old_blog_stats = old_blog_stats.filter(blog_id__in=blog_ids)
+        old_post_stats.delete()
+        old_blog_stats.delete()
+
+        DailyPostStats.objects.bulk_create([
+            DailyPostStats(date=date, post_id=post_id, **serialise_stats(stats))
+            for (date, post_id), stats in post_stats.items()
+        ], batch_size=500)
+        DailyBlogStats.objects.bulk_create([
+            DailyBlogStats(date=date, blog_id=blog_id, **serialise_stats(stats))
+            for (date, blog_id), stats in blog_stats.items()
+        ], batch_size=500)
+
+    return len(blog_stats)
+
+
+# Roll up every day that closed since the last rollup. Only one process wins the claim.
+def close_analytics_days():
+    yesterday = timezone.now().date() - timedelta(days=1)
+    rolled_up_to = PersistentStore.load().analytics_rolled_up_to
+
+    # Nothing to do, or the history hasn't been backfilled yet
+    if rolled_up_to is None or rolled_up_to >= yesterday:
+        return
+
+    with transaction.atomic():
+        claimed = PersistentStore.objects.filter(
+            pk=1,
+            analytics_rolled_up_to=rolled_up_to
+        ).update(analytics_rolled_up_to=yesterday)
+
+        if claimed:
+            day = rolled_up_to + timedelta(days=1)
+            while day <= yesterday:
+                rollup_hits(day, day)
+                day += timedelta(days=1)
+            print(f'Rolled up analytics to {yesterday}')
+
+
+def rolled_up_to():
+    return PersistentStore.load().analytics_rolled_up_to
+
+
+def merge_rollups(rollups):
+    totals = empty_stats()
+    for rollup in rollups:
+        totals['hits'] += rollup.hits
+        totals['unique_visitors'] += rollup.unique_visitors
+        for name in BREAKDOWNS.values():
+            totals[name].update(json.loads(getattr(rollup, name)))
+    return totals
+
+
+def rollup_hit_counts(post_stats):
+    return dict(post_stats.values('post_id').annotate(hit_count=Sum('hits')).values_list('post_id', 'hit_count'))
+
+
+def rollup_chart_data(stats):
+    return dict(stats.values_list('date', 'hits'))
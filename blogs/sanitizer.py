@@ -0,0 +1,143 @@
+from html import unescape
+from urllib.parse import urlsplit
+import re
+
+# Iframes are only kept when their src is on one of these hosts
+HOST_WHITELIST = frozenset([
+    'www.youtube.com',
+    'www.youtube-nocookie.com',
+    'www.slideshare.net',
+    'player.vimeo.com',
+    'w.soundcloud.com',
+    'www.google.com',
+    'codepen.io',
+    'stackblitz.com',
+    'onedrive.live.com',
+    'docs.google.com',
+    'bandcamp.com',
+    'embed.music.apple.com',
+    'drive.google.com',
+    'share.transistor.fm',
+    'share.descript.com',
+    'mrkennedy.ca',
+    'open.spotify.com',
+    'umap.openstreetmap.fr',
+    'music.163.com',
+    'sheevcharan.substack.com',
+])
+
+# Dropped with everything inside them
+DROPPED_BLOCKS = {'script'}
+# Dropped, but their content is kept
+DROPPED_TAGS = {'object', 'embed', 'form', 'input', 'button'}
+URL_ATTRIBUTES = {'href', 'src', 'action', 'formaction', 'xlink:href'}
+UNSAFE_SCHEMES = ('javascript:', 'vbscript:')
+
+ATTRIBUTE_PATTERN = r'''\s+([^\s"'>/=]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+))?'''
+# Read from a '<' that isn't part of a safe run
+TOKEN_REGEX = re.compile(
+    r'<!--.*?-->'
+    r'|<(?P<closing>/)?(?P<name>[a-zA-Z][\w:-]*)(?P<attributes>(?:' + ATTRIBUTE_PATTERN + r')*)\s*/?>'
+    r'|<(?=/?[a-zA-Z!])',
+    re.DOTALL)
+# Text and tags that can't need changing: no dropped tags, no event handlers and URLs with a known safe start.
+# Anything else stops the run and goes through TOKEN_REGEX
+SAFE_URL_VALUE = r'''(?:"(?:https?:/|/|#|mailto:)[^"]*"|'(?:https?:/|/|#|mailto:)[^']*')'''
+SAFE_ATTRIBUTE = (
+    r'\s+(?:(?:href|src)\s*=\s*' + SAFE_URL_VALUE +
+    r'''|(?!on|srcdoc|href|src|action|formaction|xlink:href)[^\s"'>/=]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'>]+))?)''')
+SAFE_RUN_REGEX = re.compile(
+    r'(?:[^<]+|<(?!/?[a-zA-Z!])'
+    r'|</?(?!(?:script|iframe|object|embed|form|input|button)[\s/>])[a-zA-Z][\w:-]*(?:' + SAFE_ATTRIBUTE + r')*\s*/?>)*',
+    re.IGNORECASE)
+ATTRIBUTE_REGEX = re.compile(ATTRIBUTE_PATTERN)
+BLOCK_END_REGEXES = {
+    'script': re.compile(r'</script\s*>', re.IGNORECASE),
+    'iframe': re.compile(r'</iframe\s*>', re.IGNORECASE),
+}
+# Browsers ignore whitespace and control characters inside a URL scheme
+URL_IGNORED_CHARACTERS_REGEX = re.compile(r'[\x00-\x20]')
+
+
+def is_unsafe_url(value):
+    url = URL_IGNORED_CHARACTERS_REGEX.sub('', unescape(value)).lower()
+    return url.startswith(UNSAFE_SCHEMES)
+
+
+def attribute_value(raw_value):
+    if raw_value and raw_value[0] in '"\'':
+        return raw_value[1:-1]
+    return raw_value or ''
+
+
+def whitelisted_iframe(attributes):
+    src = attributes.get('src')
+    if not src or 'srcdoc' in attributes:
+        return False
+    try:
+        host = urlsplit(unescape(src).strip()).hostname
+    except ValueError:
+        return False
+    return host in HOST_WHITELIST
+
+
+# Returns the tag without event handlers and script URLs, or as written when there's nothing to remove
+def clean_tag(match):
+    kept = []
+    changed = False
+    for attribute in ATTRIBUTE_REGEX.finditer(match.group('attributes')):
+        name = attribute.group(1).lower()
+        if name.startswith('on') or name == 'srcdoc' or (name in URL_ATTRIBUTES and is_unsafe_url(attribute_value(attribute.group(2)))):
+            changed = True
+        else:
+            kept.append(attribute.group(0))
+
+    if not changed:
+        return match.group(0)
+    end = '/>' if match.group(0).endswith('/>') else '>'
+    return f'<{match.group("name")}{"".join(kept)}{end}'
+
+
+# One pass over the markup: text is copied, tags are checked as they're met
+def sanitize_html(markup):
+    output = []
+    position = 0
+
+    while True:
+        safe_run = SAFE_RUN_REGEX.match(markup, position)
+        output.append(safe_run.group(0))
+        position = safe_run.end()
+        if position == len(markup):
+            break
+
+        match = TOKEN_REGEX.match(markup, position)
+        position = match.end()
+
+        name = match.group('name')
+        if name is None:
+            # Comments are dropped, browsers end them in more places than -->
+            if match.group(0) == '<':
+                # Something that looks like a tag but doesn't parse as one
+                output.append('&lt;')
+            continue
+
+        name = name.lower()
+        if match.group('closing'):
+            if name not in DROPPED_TAGS:
+                output.append(match.group(0))
+            continue
+
+        if name in DROPPED_TAGS:
+            continue
+
+        if name in DROPPED_BLOCKS or (name == 'iframe' and not whitelisted_iframe({
+            attribute.group(1).lower(): attribute_value(attribute.group(2))
+            for attribute in ATTRIBUTE_REGEX.finditer(match.group('attributes'))
+        })):
+            block_end = BLOCK_END_REGEXES[name].search(markup, position)
+            position = block_end.end() if block_end else len(markup)
+            continue
+
+        output.append(clean_tag(match))
+
+    return ''.join(output)
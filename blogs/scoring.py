@@ -0,0 +1,42 @@
+from django.conf import settings
+
+from math import log
+
+SCORE_EPOCH = 1577811600
+SCORE_PERIOD = 14 * 86400  # seconds
+
+
+# Log of upvotes plus a bonus that grows with publish time. Relative order never changes
+# without new votes, so only posts with new votes need rescoring.
+def log_score(upvotes, posted_at, now):
+    return log(upvotes, 10) + ((posted_at.timestamp() - SCORE_EPOCH) / SCORE_PERIOD)
+
+
+# Upvotes divided by age, so scores sink over time and need periodic rescoring
+def gravity_score(upvotes, posted_at, now):
+    age_hours = max((now - posted_at).total_seconds(), 0) / 3600
+    return (upvotes - 1) / ((age_hours + 2) ** settings.DISCOVER_SCORE_GRAVITY)
+
+
+SCORE_FORMULAS = {
+    'log': log_score,
+    'gravity': gravity_score,
+}
+
+# Formulas whose scores change with time alone
+DECAYING_FORMULAS = {'gravity'}
+
+
+def score_formula():
+    return settings.DISCOVER_SCORE_FORMULA
+
+
+def calculate_score(upvotes, posted_at, deprioritised, now, score=0, formula=None):
+    formula = formula or score_formula()
+
+    # Posts need a second vote to rank (the first is the author's)
+    if upvotes <= 1 or not posted_at or posted_at.timestamp() <= 0:
+        return score
+    if deprioritised:
+        return 0
+    return SCORE_FORMULAS[formula](upvotes, posted_at, now)
@@ -0,0 +1,144 @@
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from blogs.helpers import unmark
+from blogs.models import Post, SearchDocument
+
+import re
+
+SEARCH_RESULTS_PER_PAGE = 20
+SNIPPET_WORDS = 30
+
+# Postgres text search configurations for the languages it can stem
+SEARCH_CONFIGS = {
+    'da': 'danish',
+    'de': 'german',
+    'en': 'english',
+    'es': 'spanish',
+    'fi': 'finnish',
+    'fr': 'french',
+    'hu': 'hungarian',
+    'it': 'italian',
+    'nb': 'norwegian',
+    'nl': 'dutch',
+    'nn': 'norwegian',
+    'no': 'norwegian',
+    'pt': 'portuguese',
+    'ro': 'romanian',
+    'ru': 'russian',
+    'sv': 'swedish',
+    'tr': 'turkish',
+}
+
+# Snippets are highlighted with control characters so the text can be escaped before adding <mark>
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+WORD_REGEX = re.compile(r'\w+', re.UNICODE)
+
+
+def search_config(lang):
+    # Blog and post langs can be things like "en-GB"
+    return SEARCH_CONFIGS.get((lang or '').lower()[:2], 'simple')
+
+
+def index_post(post):
+    if not post.publish:
+        SearchDocument.objects.filter(post=post).delete()
+        return
+
+    SearchDocument.objects.update_or_create(post=post, defaults={
+        'config': search_config(post.lang or post.blog.lang),
+        'title': post.title,
+        'body': unmark(post.content),
+    })
+
+
+def highlight(snippet):
+    snippet = escape(snippet or '')
+    return mark_safe(snippet.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>'))
+
+
+def postgres_search(query, lang, limit, offset):
+    config = search_config(lang)
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            SELECT d.post_id, ts_rank_cd(d.vector, q) AS rank
+            FROM blogs_searchdocument d
+            JOIN blogs_discoverentry e ON e.post_id = d.post_id,
+                (websearch_to_tsquery(%s::regconfig, %s) || websearch_to_tsquery('simple', %s)) q
+            WHERE d.vector @@ q AND e.published_date <= %s
+            ORDER BY rank DESC, e.published_date DESC
+            LIMIT %s OFFSET %s
+        ''', [config, query, query, timezone.now(), limit, offset])
+        ranks = dict(cursor.fetchall())
+
+        # Headlines are expensive, so only build them for the page being shown
+        snippets = {}
+        if ranks:
+            cursor.execute(f'''
+                SELECT post_id, ts_headline(config::regconfig, body, websearch_to_tsquery(config::regconfig, %s),
+                    'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxWords={SNIPPET_WORDS}, MinWords=15')
+                FROM blogs_searchdocument
+                WHERE post_id = ANY(%s)
+            ''', [query, list(ranks)])
+            snippets = dict(cursor.fetchall())
+
+    return [(post_id, rank, snippets.get(post_id)) for post_id, rank in ranks.items()]
+
+
+def sqlite_search(query, lang, limit, offset):
+    # Quote every word so user input can't use FTS5 query syntax
+    words = WORD_REGEX.findall(query)
+    if not words:
+        return []
+    match = ' '.join(f'"{word}"' for word in words)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            SELECT f.rowid, bm25(blogs_searchdocument_fts, 10.0, 1.0) AS rank,
+                snippet(blogs_searchdocument_fts, 1, '{HIGHLIGHT_START}', '{HIGHLIGHT_STOP}', '…', {SNIPPET_WORDS})
+            FROM blogs_searchdocument_fts f
+            JOIN blogs_discoverentry e ON e.post_id = f.rowid
+            WHERE blogs_searchdocument_fts MATCH %s AND e.published_date <= %s
+            ORDER BY rank, e.published_date DESC
+            LIMIT %s OFFSET %s
+        ''', [match, timezone.now(), limit, offset])
+        return [(post_id, -rank, snippet) for post_id, rank, snippet in cursor.fetchall()]
+
+
+def fallback_search(query, lang, limit, offset):
+    from blogs.views.discover import get_base_query
+    posts = get_base_query().filter(
+        Q(content__icontains=query) | Q(title__icontains=query)
+    ).order_by('-upvotes', '-published_date').values_list('pk', flat=True)[offset:offset + limit]
+    return [(post_id, 0, None) for post_id in posts]
+
+
+SEARCH_BACKENDS = {
+    'postgresql': postgres_search,
+    'sqlite': sqlite_search,
+}
+
+
+def search_posts(query, lang=None, page=0):
+    backend = SEARCH_BACKENDS.get(connection.vendor, fallback_search)
+
+    # Fetch one extra result to know if there's a next page
+    results = backend(query, lang, SEARCH_RESULTS_PER_PAGE + 1, page * SEARCH_RESULTS_PER_PAGE)
+    has_next = len(results) > SEARCH_RESULTS_PER_PAGE
+    results = results[:SEARCH_RESULTS_PER_PAGE]
+
+    posts = Post.objects.select_related('blog').in_bulk([post_id for post_id, rank, snippet in results])
+    found = []
+    for post_id, rank, snippet in results:
+        post = posts.get(post_id)
+        if post:
+            post.rank = rank
+            post.snippet = highlight(snippet) if snippet else None
+            found.append(post)
+
+    return found, has_next
@@ -0,0 +1,47 @@
+from django.template.loader import render_to_string
+
+from functools import lru_cache
+import hashlib
+import re
+
+STYLESHEET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Shared stylesheets that aren't tied to a blog
+STYLESHEET_TEMPLATES = {
+    'default': ['styles/blog/default.css'],
+    'dashboard': ['styles/blog/default.css', 'styles/dashboard.css'],
+}
+
+# Strings are kept as they are, comments are dropped
+CSS_TOKEN_REGEX = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*.*?\*/)', re.S)
+CSS_WHITESPACE_REGEX = re.compile(r'\s+')
+CSS_PUNCTUATION_REGEX = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_css(css):
+    parts = []
+    for i, part in enumerate(CSS_TOKEN_REGEX.split(css)):
+        if i % 2:
+            if not part.startswith('/*'):
+                parts.append(part)
+        else:
+            part = CSS_WHITESPACE_REGEX.sub(' ', part)
+            part = CSS_PUNCTUATION_REGEX.sub(r'\1', part)
+            parts.append(part.replace(';}', '}'))
+    return ''.join(parts).strip()
+
+
+def stylesheet_hash(css):
+    return hashlib.md5(css.encode('utf-8')).hexdigest()[:12]
+
+
+@lru_cache(maxsize=None)
+def shared_stylesheet(name):
+    css = minify_css('\n'.join(render_to_string(template) for template in STYLESHEET_TEMPLATES[name]))
+    return css, stylesheet_hash(css)
+
+
+# Only the blog's own styles, the default stylesheet is linked separately so changes to it reach every blog
+def compile_blog_stylesheet(custom_styles):
+    css = minify_css(custom_styles or '')
+    return css, stylesheet_hash(css)
@@ -1,30 +1,117 @@
 from datetime import timedelta
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db.models import Count, F
 from django.utils import timezone
-import threading
+import time
 
-from blogs.models import Hit, PersistentStore, RssSubscriber
+from blogs import feed_subscribers, newsletters, rollups
+from blogs.jobs import delete_finished_jobs, task
+from blogs.models import DiscoverEntry, Post, delete_orphan_tags
+from blogs.scoring import DECAYING_FORMULAS, calculate_score, score_formula
 
+# Jobs run by `manage.py runworker`. Periodic ones are scheduled in settings.PERIODIC_JOBS.
 
-def daily_task():
-    current_time = timezone.now()
-    time_24_hours_ago = current_time - timedelta(hours=24)
 
-    persistent_store = PersistentStore.load()
+@task(queue='email', max_attempts=5)
+def send_email(subject, html_message, from_email, recipient_list):
+    send_mail(
+        subject,
+        html_message,
+        from_email,
+        recipient_list,
+        html_message=html_message)
+    print('Sent email to ', recipient_list)
 
-    if persistent_store.last_executed < time_24_hours_ago:
-        persistent_store.last_executed = current_time
-        persistent_store.save()
 
-        print('Executing daily task')
-
-        t = threading.Thread(target=scrub_hash_ids)
-        t.start()
+# Resumable, so a retry carries on from the last delivered batch
+@task(queue='email', max_attempts=5)
+def send_newsletter(newsletter_id):
+    newsletters.deliver_newsletter(newsletter_id)
 
 
 # Scrub all hash_ids that are over 24 hours old
+@task()
 def scrub_hash_ids():
-    current_time = timezone.now()
-    time_24_hours_ago = current_time - timedelta(hours=24)
-    RssSubscriber.objects.filter(access_date__lt=time_24_hours_ago).delete()
+    # Feed reader sketches are built from hash_ids, only their counts outlive the day
+    feed_subscribers.clear_old_sketches()
     # Hit.objects.filter(created_date__lt=time_24_hours_ago).exclude(hash_id='scrubbed').update(hash_id='scrubbed')
     print('Scrubbed hash_ids')
+
+
+# Re-derive upvote counters (and scores) from the Upvote rows, in case the in-place increments drifted
+@task()
+def reconcile_upvotes():
+    drifted = Post.objects.annotate(upvote_count=Count('upvote')).exclude(upvotes=F('upvote_count')).select_related('blog')
+
+    count = 0
+    for post in drifted:
+        post.update_score()
+        Post.objects.filter(pk=post.pk).update(upvotes=post.upvotes, score=post.score)
+        DiscoverEntry.objects.filter(post_id=post.pk).update(score=post.score)
+        count += 1
+
+    print(f'Reconciled upvotes on {count} posts')
+    return count
+
+
+# Recompute discover scores for every discoverable post published within the window
+@task()
+def rescore_posts(formula=None, window=None, dry_run=False, chunk_size=1000):
+    started = time.monotonic()
+    now = timezone.now()
+    formula = formula or score_formula()
+    window_start = now - timedelta(days=window or settings.DISCOVER_SCORE_WINDOW)
+
+    posts = Post.objects.filter(
+        discover_entry__published_date__gte=window_start
+    ).values('pk', 'upvotes', 'score', 'first_published_at', 'published_date', 'deprioritise', 'blog__deprioritise')
+
+    total = 0
+    changed = []
+    for post in posts.iterator(chunk_size=chunk_size):
+        total += 1
+        score = calculate_score(
+            post['upvotes'],
+            post['first_published_at'] or post['published_date'],
+            post['deprioritise'] or post['blog__deprioritise'],
+            now,
+            post['score'],
+            formula)
+        if score != post['score']:
+            changed.append((post['pk'], score))
+
+    # Decayed scores of posts that left the window are close to nothing
+    expired = Post.objects.none()
+    if formula in DECAYING_FORMULAS:
+        expired = Post.objects.filter(discover_entry__published_date__lt=window_start).exclude(score=0)
+
+    if not dry_run:
+        for i in range(0, len(changed), chunk_size):
+            chunk = changed[i:i + chunk_size]
+            Post.objects.bulk_update([Post(pk=pk, score=score) for pk, score in chunk], ['score'])
+            DiscoverEntry.objects.bulk_update([DiscoverEntry(post_id=pk, score=score) for pk, score in chunk], ['score'])
+
+        expired_count = DiscoverEntry.objects.filter(post__in=expired).update(score=0)
+        Post.objects.filter(pk__in=expired.values('pk')).update(score=0)
+    else:
+        expired_count = expired.count()
+
+    print(f'{"[dry run] " if dry_run else ""}Rescored {len(changed)} of {total} posts '
+          f'and expired {expired_count} with {formula} in {time.monotonic() - started:.2f}s')
+    return changed
+
+
+@task()
+def close_analytics_days():
+    rollups.close_analytics_days()
+
+
+@task()
+def prune_jobs():
+    print(f'Deleted {delete_finished_jobs()} finished jobs')
+
+
+@task()
+def prune_tags():
+    print(f'Deleted {delete_orphan_tags()} tags without posts')
@@ -1,49 +1,43 @@
 from django import template
+from django.core.cache import cache
 from django.utils import timezone
 from django.template.loader import render_to_string
+from django.urls import reverse
 from django.utils import dateformat, translation
 from django.utils.dateformat import format as date_format
+from django.utils.safestring import mark_safe
 from django.utils.timesince import timesince
 
 from pygments import highlight
 from pygments.lexers import get_lexer_by_name
 from pygments.formatters import HtmlFormatter
 
+from functools import lru_cache
 from html import escape
 from slugify import slugify
 
 from mistune import HTMLRenderer, create_markdown
 
 import latex2mathml.converter
+import hashlib
 import re
 
+from blogs.caching import memoise_by_digest
 from blogs.helpers import unmark
 from blogs.models import Post
+from blogs.sanitizer import sanitize_html
+from blogs.stylesheets import compile_blog_stylesheet, shared_stylesheet
 
 register = template.Library()
 
-HOST_WHITELIST = [
-    'www.youtube.com',
-    'www.youtube-nocookie.com',
-    'www.slideshare.net',
-    'player.vimeo.com',
-    'w.soundcloud.com',
-    'www.google.com',
-    'codepen.io',
-    'stackblitz.com',
-    'onedrive.live.com',
-    'docs.google.com',
-    'bandcamp.com',
-    'embed.music.apple.com',
-    'drive.google.com',
-    'share.transistor.fm',
-    'share.descript.com',
-    'mrkennedy.ca',
-    'open.spotify.com',
-    'umap.openstreetmap.fr',
-    'music.163.com',
-    'sheevcharan.substack.com'
-]
+# Bump when the markdown rendering pipeline changes to invalidate stored markup
+RENDERER_VERSION = 2
+RENDER_CACHE_TIMEOUT = 604800  # 1 week in seconds
+
+CODE_STYLE = 'friendly'
+LEXER_CACHE_SIZE = 256
+HIGHLIGHT_CACHE_SIZE = 1024  # highlighted blocks run ~2.5-7.5KB, so at most ~8MB a process
+MATH_CACHE_SIZE = 4096
 
 TYPOGRAPHIC_REPLACEMENTS = [
     ('(c)', '©'),
@@ -58,31 +52,72 @@ TYPOGRAPHIC_REPLACEMENTS = [
 ]
 
 
+INLINE_LATEX_REGEX = re.compile(r'\$\$([^\n]*?)\$\$')
+LINK_WITH_PARENTHESES_REGEX = re.compile(r'\[([^\]]+)\]\(((?:tab:)?https?://[^\)]+\([^\)]+\)[^\)]*)\)')
+LINE_BREAK_REGEX = re.compile(r'^\s*\\\s*$')
+
+
 def typographic_replacements(text):
+    # Called for every text node, most have nothing to replace
+    if '(' not in text and '+-' not in text:
+        return text
     for old, new in TYPOGRAPHIC_REPLACEMENTS:
         text = text.replace(old, new)
     return text
 
 def replace_inline_latex(text):
-    latex_exp_inline = re.compile(r'\$\$([^\n]*?)\$\$')
-    replaced_text = latex_exp_inline.sub(r'$\1$', text)
+    return INLINE_LATEX_REGEX.sub(r'$\1$', text)
 
-    return replaced_text
+def escape_parentheses(match):
+    label = match.group(1)
+    url = match.group(2)
+    # Escape parentheses in the URL
+    escaped_url = url.replace('(', '%28').replace(')', '%29')
+    return f'[{label}]({escaped_url})'
 
 def fix_links(text):
-    parentheses_pattern = r'\[([^\]]+)\]\(((?:tab:)?https?://[^\)]+\([^\)]+\)[^\)]*)\)'
+    return LINK_WITH_PARENTHESES_REGEX.sub(escape_parentheses, text)
 
-    def escape_parentheses(match):
-        label = match.group(1)
-        url = match.group(2)
-        # Escape parentheses in the URL
-        escaped_url = url.replace('(', '%28').replace(')', '%29')
-        return f'[{label}]({escaped_url})'
+# Lexers and the formatter keep no state between highlight calls, so one of each is shared
+@lru_cache(maxsize=LEXER_CACHE_SIZE)
+def code_lexer(language):
+    try:
+        return get_lexer_by_name(language)
+    except ValueError:
+        return get_lexer_by_name('text')
 
-    fixed_text = re.sub(parentheses_pattern, escape_parentheses, text)
-    
 
-    return fixed_text
+@lru_cache(maxsize=None)
+def code_formatter(style):
+    return HtmlFormatter(style=style)
+
+
+# Code blocks usually survive edits to the text around them
+@memoise_by_digest(maxsize=HIGHLIGHT_CACHE_SIZE)
+def highlight_code(code, language):
+    return highlight(code, code_lexer(language), code_formatter(CODE_STYLE))
+
+
+# Formulas repeat within and across posts
+@lru_cache(maxsize=MATH_CACHE_SIZE)
+def latex_to_mathml(latex, display):
+    mathml = latex2mathml.converter.convert(latex)
+    if display:
+        mathml = mathml.replace('display="inline"', 'display="block"')
+    return mathml
+
+
+# Counts are for this process only
+def math_cache_stats():
+    info = latex_to_mathml.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'conversions': info.misses,
+        'hit_rate': info.hits / lookups if lookups else 0,
+        'size': info.currsize,
+    }
+
 
 class MyRenderer(HTMLRenderer):
     def heading(self, text, level, **attrs):
@@ -104,7 +139,7 @@ class MyRenderer(HTMLRenderer):
 
     def text(self, text):
         # Replace trailing backslashes with <br>
-        if re.match(r'^\s*\\\s*$', text):
+        if LINE_BREAK_REGEX.match(text):
             text = '<br>'
         return typographic_replacements(text)
     
@@ -116,28 +151,19 @@ class MyRenderer(HTMLRenderer):
     
     def inline_math(self, text):
         try:
-            return latex2mathml.converter.convert(text)
+            return latex_to_mathml(text, False)
         except Exception as e:
             print("LaTeX rendering error")
 
     
     def block_math(self, text):
         try:
-            return latex2mathml.converter.convert(text).replace('display="inline"', 'display="block"')
+            return latex_to_mathml(text, True)
         except Exception as e:
             print("LaTeX rendering error")
     
     def block_code(self, code, info=None):
-        if info is None:
-            info = 'text'
-        try:
-            lexer = get_lexer_by_name(info)
-        except ValueError:
-            lexer = get_lexer_by_name('text')
-        
-        formatter = HtmlFormatter(style='friendly')
-        highlighted_code = highlight(code, lexer, formatter)
-        return highlighted_code
+        return highlight_code(code, info or 'text')
     
     
 markdown_renderer = create_markdown(
@@ -160,55 +186,49 @@ def markdown(content, blog_or_post=False):
         else:
             blog = blog_or_post
 
-    # Removes old formatted inline LaTeX
-    content = replace_inline_latex(content)
-    # Find urls with parentheses and escape them
-    content = fix_links(content)
-
-    try:
-        processed_markup = markdown_renderer(content)
-    except TypeError:
-        return ''
-
-    # If not upgraded remove iframes and js
-    if not blog or not blog.user.settings.upgraded:
-        processed_markup = clean(processed_markup)
+    processed_markup = render_markup(content, bool(blog and blog.user.settings.upgraded))
 
     # Replace {{ xyz }} elements
     if blog:
-        processed_markup = excluding_pre(processed_markup, element_replacement, blog, post)
+        processed_markup = element_replacement(processed_markup, blog, post)
 
     return processed_markup
 
 
-def excluding_pre(markup, func, blog=None, post=None):
-    placeholders = {}
+def rendered_markup_cache_key(content, upgraded):
+    content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    return f'markup_{RENDERER_VERSION}_{int(upgraded)}_{content_hash}'
 
-    def placeholder_div(match):
-        key = f"PLACEHOLDER_{len(placeholders)}"
-        placeholders[key] = match.group(0)
-        return key
 
-    markup = re.sub(r'(<pre.*?>.*?</pre>|<code.*?>.*?</code>)', placeholder_div, markup, flags=re.DOTALL)
+# Renders the static part of the markdown (everything but the {{ xyz }} elements)
+def render_markup(content, upgraded):
+    cache_key = rendered_markup_cache_key(content, upgraded)
+    processed_markup = cache.get(cache_key)
 
-    if blog:
-        if post: 
-            markup = func(markup, blog, post)
-        else:
-            markup = func(markup, blog)
-    else:
-        markup = func(markup)
+    if processed_markup is None:
+        # Removes old formatted inline LaTeX
+        content = replace_inline_latex(content)
+        # Find urls with parentheses and escape them
+        content = fix_links(content)
 
-    for key in sorted(placeholders.keys(), reverse=True):
-        markup = markup.replace(key, placeholders[key])
+        try:
+            processed_markup = markdown_renderer(content)
+        except TypeError:
+            processed_markup = ''
+
+        # If not upgraded remove iframes and js
+        if not upgraded:
+            processed_markup = clean(processed_markup)
 
-    return markup
+        cache.set(cache_key, processed_markup, RENDER_CACHE_TIMEOUT)
+
+    return processed_markup
 
 
 def apply_filters(posts, tag=None, limit=None, order=None):
     if tag:
         tag = tag.replace('"', '').strip()
-        posts = posts.filter(all_tags__contains=tag)
+        posts = posts.filter(post_tags__tag__name__iexact=tag).distinct()
     if order == 'asc':
         posts = posts.order_by('published_date')
     else:
@@ -222,91 +242,118 @@ def apply_filters(posts, tag=None, limit=None, order=None):
     return posts
 
 
-def element_replacement(markup, blog, post=None):
-    # Match the entire {{ posts ... }} directive, including parameters
-    pattern = r'\{\{\s*posts([^}]*)\}\}'
-    
-    def replace_with_filtered_posts(match):
-        params_str = match.group(1) 
-        tag, limit, order, description, content = None, None, None, False, False
-        
-        # Extract and process parameters one by one
-        param_pattern = r'(tag:"([^"]+)"|limit:(\d+)|order:(asc|desc)|description:(True)|content:(True))'
-        params = re.findall(param_pattern, params_str)
-        for param in params:
-            if 'tag:' in param[0]:
-                tag = param[1]
-            elif 'limit:' in param[0]:
-                limit = int(param[2])
-            elif 'order:' in param[0]:
-                order = param[3]
-            elif 'description:' in param[0]:
-                description = param[4] == 'True'
+# {{ name }} directives. None leaves the directive as it was written
+VARIABLE_DIRECTIVES = {
+    'email-signup': lambda context: render_to_string('snippets/email_subscribe_form.html') if context.blog.user.settings.upgraded else '',
+    'blog_title': lambda context: escape(context.blog.title),
+    'blog_description': lambda context: escape(context.blog.meta_description),
+    'blog_created_date': lambda context: format_date(context.blog.created_date, context.blog.date_format, context.blog.lang),
+    'blog_last_modified': lambda context: context.timesince(context.blog.last_modified),
+    'blog_last_posted': lambda context: context.timesince(context.blog.last_posted),
+    'blog_link': lambda context: f'https://{context.blog.subdomain}.ichoria.cc',
+    'post_title': lambda context: context.post and escape(context.post.title),
+    'post_description': lambda context: context.post and escape(context.post.meta_description),
+    'post_published_date': lambda context: context.post and format_date(context.post.published_date, context.blog.date_format, context.blog.lang),
+    'post_last_modified': lambda context: context.post and context.timesince(context.post.last_modified or timezone.now()),
+    'post_link': lambda context: context.post and f'https://{context.blog.subdomain}.ichoria.cc/{context.post.slug}',
+}
+
+# Code blocks are matched first so directives inside them are left alone
+DIRECTIVE_REGEX = re.compile(
+    r'<pre.*?>.*?</pre>|<code.*?>.*?</code>'
+    r'|\{\{\s*posts(?P<params>[^}]*)\}\}'
+    r'|\{\{ (?P<name>[\w-]+) \}\}'
+    r'|\{\{(?P<bare_name>email-signup)\}\}',
+    re.DOTALL)
+POSTS_PARAM_REGEX = re.compile(r'(tag:"([^"]+)"|limit:(\d+)|order:(asc|desc)|description:(True)|content:(True))')
+
+
+def parse_posts_params(params_str):
+    tag, limit, order, description, content = None, None, None, False, False
+    for param in POSTS_PARAM_REGEX.findall(params_str):
+        if 'tag:' in param[0]:
+            tag = param[1]
+        elif 'limit:' in param[0]:
+            limit = int(param[2])
+        elif 'order:' in param[0]:
+            order = param[3]
+        elif 'description:' in param[0]:
+            description = param[4] == 'True'
+        elif 'content:' in param[0]:
+            content = param[5] == 'True'
+    return tag, limit, order, description, content
+
+
+# Finds the directives in rendered markup once, only their positions are kept so the markup isn't
+@memoise_by_digest(maxsize=1024)
+def compile_directives(markup):
+    spans = []
+    for match in DIRECTIVE_REGEX.finditer(markup):
+        if match.group('params') is not None:
+            spans.append((match.start(), match.end(), 'posts', parse_posts_params(match.group('params'))))
+        elif (match.group('name') or match.group('bare_name')) in VARIABLE_DIRECTIVES:
+            spans.append((match.start(), match.end(), 'variable', match.group('name') or match.group('bare_name')))
+    return tuple(spans)
+
+
+# Everything a render needs, each value is looked up at most once
+class DirectiveContext:
+    def __init__(self, blog, post=None):
+        self.blog = blog
+        self.post = post
+        self.lang = post.lang if post else blog.lang
+        self.variables = {}
+        self.post_lists = {}
+
+    def timesince(self, date):
+        if not date:
+            return None
+        with translation.override(self.lang):
+            return timesince(date)
+
+    def variable(self, name):
+        if name not in self.variables:
+            self.variables[name] = VARIABLE_DIRECTIVES[name](self)
+        return self.variables[name]
+
+    def posts(self, tag, limit, order, description, content):
+        if (tag, limit, order) not in self.post_lists:
+            posts = apply_filters(self.blog.posts.filter(publish=True, is_page=False, published_date__lte=timezone.now()), tag, limit, order)
+            self.post_lists[(tag, limit, order)] = list(posts)
+
+        return render_to_string('snippets/post_list.html', {
+            'blog': self.blog,
+            'posts': self.post_lists[(tag, limit, order)],
+            'embed': True,
+            'show_description': description,
             # Only show content if injection is on page or homepage
-            elif 'content:' in param[0] and not post or post.is_page:
-                content = param[5] == 'True'
+            'show_content': content and (not self.post or self.post.is_page),
+        })
 
-        filtered_posts = apply_filters(blog.posts.filter(publish=True, is_page=False, published_date__lte=timezone.now()), tag, limit, order)
-        context = {'blog': blog, 'posts': filtered_posts, 'embed': True, 'show_description': description, 'show_content': content}
-        return render_to_string('snippets/post_list.html', context)
 
-    # Replace each matched directive with rendered content
-    markup = re.sub(pattern, replace_with_filtered_posts, markup)
-
-    # Date translation replacement
-    current_lang = "en" # translation.get_language()
-    translation.activate(blog.lang)
-    if post:
-        translation.activate(post.lang)
-
-    if blog.user.settings.upgraded:
-        markup = markup.replace('{{ email-signup }}', render_to_string('snippets/email_subscribe_form.html'))
-        markup = markup.replace('{{email-signup}}', render_to_string('snippets/email_subscribe_form.html'))
-    else:
-        markup = markup.replace('{{ email-signup }}', '')
-        markup = markup.replace('{{email-signup}}', '')
-
-    markup = markup.replace('{{ blog_title }}', escape(blog.title))
-    markup = markup.replace('{{ blog_description }}', escape(blog.meta_description))
-    markup = markup.replace('{{ blog_created_date }}', format_date(blog.created_date, blog.date_format, blog.lang))
-    markup = markup.replace('{{ blog_last_modified }}', timesince(blog.last_modified))
-    if blog.last_posted:
-        markup = markup.replace('{{ blog_last_posted }}', timesince(blog.last_posted))
-    markup = markup.replace('{{ blog_link }}', f'https://{blog.subdomain}.ichoria.cc')
-
-    if post:
-        markup = markup.replace('{{ post_title }}', escape(post.title))
-        markup = markup.replace('{{ post_description }}', escape(post.meta_description))
-        markup = markup.replace('{{ post_published_date }}', format_date(post.published_date, blog.date_format, blog.lang))
-        last_modified = post.last_modified or timezone.now()
-        markup = markup.replace('{{ post_last_modified }}', timesince(last_modified))
-        markup = markup.replace('{{ post_link }}', f"https://{blog.subdomain}.ichoria.cc/{post.slug}")
-
-    translation.activate(current_lang)
-
-    return markup
+def element_replacement(markup, blog, post=None):
+    spans = compile_directives(markup)
+    if not spans:
+        return markup
+
+    context = DirectiveContext(blog, post)
+    rendered = []
+    text_start = 0
+    for start, end, kind, argument in spans:
+        rendered.append(markup[text_start:start])
+        if kind == 'posts':
+            rendered.append(context.posts(*argument))
+        else:
+            value = context.variable(argument)
+            rendered.append(markup[start:end] if value is None else value)
+        text_start = end
+    rendered.append(markup[text_start:])
+    return ''.join(rendered)
 
 
 @register.filter
 def clean(markup):
-    cleaned_markup = re.sub(r'<script.*?>.*?</script>', '', markup, flags=re.DOTALL | re.IGNORECASE)
-    
-    cleaned_markup = re.sub(r'\son\w+="[^"]*"', '', cleaned_markup, flags=re.IGNORECASE)
-    cleaned_markup = re.sub(r'\son\w+=\'[^\']*\'', '', cleaned_markup, flags=re.IGNORECASE)
-    cleaned_markup = re.sub(r'\son\w+=\w+', '', cleaned_markup, flags=re.IGNORECASE)
-    cleaned_markup = re.sub(r'(<\w+\s+.*?)(href|src)\s*=\s*["\']?javascript:[^"\']*["\']?', r'\1', cleaned_markup, flags=re.IGNORECASE)
-    cleaned_markup = re.sub(r'<(object|embed|form|input|button).*?>', '', cleaned_markup, flags=re.IGNORECASE)
-    cleaned_markup = re.sub(r'</(object|embed|form|input|button)>', '', cleaned_markup, flags=re.IGNORECASE)
-    
-    def iframe_whitelisted(match):
-        src = match.group(2)
-        if any(host in src for host in HOST_WHITELIST):
-            return match.group(0)
-        return ''
-
-    cleaned_markup = re.sub(r'(<iframe.*?src=["\'])([^"\']*)(["\'].*?>.*?</iframe>)', iframe_whitelisted, cleaned_markup, flags=re.DOTALL | re.IGNORECASE)
-
-    return cleaned_markup
+    return sanitize_html(markup)
 
 
 @register.filter
@@ -336,3 +383,25 @@ def format_date(date, format_string, lang=None, tz='UTC'):
         translation.activate(current_lang)
         return formatted_date
     return dateformat.format(date, format_string)
+
+
+# Either a shared stylesheet name ('default', 'dashboard') or a blog, templates without a blog get the default
+@register.simple_tag
+def stylesheet_url(blog_or_name=None):
+    if blog_or_name and isinstance(blog_or_name, str):
+        return reverse('stylesheet', kwargs={'name': blog_or_name, 'css_hash': shared_stylesheet(blog_or_name)[1]})
+    if blog_or_name and blog_or_name.styles_hash:
+        return reverse('stylesheet', kwargs={'name': blog_or_name.pk, 'css_hash': blog_or_name.styles_hash})
+    return reverse('stylesheet', kwargs={'name': 'default', 'css_hash': shared_stylesheet('default')[1]})
+
+
+# Styles set on the blog but not saved yet (the theme preview) aren't in the linked stylesheet
+@register.simple_tag
+def unsaved_styles(blog=None):
+    if not blog or isinstance(blog, str) or getattr(blog, '_loaded_styles', None) == (blog.custom_styles, blog.overwrite_styles):
+        return ''
+    css = compile_blog_stylesheet(blog.custom_styles)[0]
+    if not blog.overwrite_styles:
+        css = shared_stylesheet('default')[0] + css
+    # Keeps the styles from closing the style element
+    return mark_safe(css.replace('</', '<\\/'))
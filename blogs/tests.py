@@ -0,0 +1,411 @@
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache, caches
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from blogs.caching import ADDRESS_REVALIDATE_INTERVAL, new_cache_version
+from blogs.feed_subscribers import flush_feed_subscribers
+from blogs.jobs import JOB_TIMEOUT, JobLost, claim_job, current_job, heartbeat, requeue_stale_jobs, run_job
+from blogs.management.commands.benchmark_sanitizer import XSS_VECTORS, build_corpus, regex_clean
+from blogs.management.commands.profile_views import SKIPPED_VIEWS, VIEW_REQUESTS, seed_dataset, seeded_clients
+from blogs.models import Blog, DiscoverEntry, Hit, Job, Newsletter, NewsletterDelivery, Post, Stylesheet, Subscriber, Upvote
+from blogs.newsletters import deliver_newsletter, queue_newsletter, unsubscribe_url
+from blogs.sanitizer import DROPPED_BLOCKS, DROPPED_TAGS, URL_ATTRIBUTES, is_unsafe_url, sanitize_html, whitelisted_iframe
+from blogs.stylesheets import shared_stylesheet
+from blogs.urls import urlpatterns
+from blogs.views.blog import resolve_address
+
+from datetime import timedelta
+from html.parser import HTMLParser
+from unittest import mock, skipUnless
+import time
+
+
+class StylesPreviewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.blog = Blog.objects.create(user=self.user, title='Blog', subdomain='owner', custom_styles='body { color: #111111; }')
+        Stylesheet.objects.create(title='Theme', identifier='theme', css='body { color: #abcdef; }')
+        self.client.force_login(self.user)
+
+    def test_preview_inlines_the_previewed_theme(self):
+        response = self.client.get('/owner/dashboard/styles/?style=theme&preview=true', HTTP_HOST='ichoria.cc')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response.content.decode(), r'<style>[^<]*#abcdef[^<]*</style>')
+        self.assertNotContains(response, '<link rel="stylesheet" href="/styles/')
+
+        # Previewing doesn't save the theme
+        self.blog.refresh_from_db()
+        self.assertEqual(self.blog.custom_styles, 'body { color: #111111; }')
+
+    def test_saved_styles_are_linked(self):
+        self.client.logout()
+        response = self.client.get('/', HTTP_HOST='owner.ichoria.cc')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f'<link rel="stylesheet" href="/styles/default.{shared_stylesheet("default")[1]}.css">')
+        self.assertContains(response, f'<link rel="stylesheet" href="/styles/{self.blog.pk}.{self.blog.styles_hash}.css">')
+        self.assertNotContains(response, '#abcdef')
+
+    def test_blog_stylesheet_holds_only_custom_styles(self):
+        response = self.client.get(f'/styles/{self.blog.pk}.{self.blog.styles_hash}.css', HTTP_HOST='owner.ichoria.cc')
+        self.assertEqual(response.content.decode(), 'body{color: #111111}')
+
+        self.blog.overwrite_styles = True
+        self.blog.save()
+        self.client.logout()
+        response = self.client.get('/', HTTP_HOST='owner.ichoria.cc')
+        self.assertNotContains(response, '/styles/default.')
+
+    def test_unknown_stylesheet_is_not_found(self):
+        for path in ('/styles/foo.abc.css', f'/styles/{self.blog.pk + 1}.abc.css'):
+            with self.subTest(path):
+                response = self.client.get(path, HTTP_HOST='owner.ichoria.cc', follow=True)
+                self.assertEqual(response.status_code, 404)
+
+
+class AddressCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.blog = Blog.objects.create(user=self.user, title='Blog', subdomain='owner')
+        self.request = RequestFactory().get('/', HTTP_HOST='owner.ichoria.cc')
+
+    def test_cached_blog_is_served_without_queries(self):
+        resolve_address(self.request)
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_address(self.request).pk, self.blog.pk)
+
+    def test_change_in_another_process_is_picked_up(self):
+        resolve_address(self.request)
+        # Saved elsewhere, this process's cache wasn't told
+        Blog.objects.filter(pk=self.blog.pk).update(title='Renamed', cache_version=new_cache_version())
+
+        with mock.patch('blogs.views.blog.time.time', return_value=time.time() + ADDRESS_REVALIDATE_INTERVAL):
+            self.assertEqual(resolve_address(self.request).title, 'Renamed')
+
+    def test_unchanged_blog_is_revalidated_with_one_query(self):
+        resolve_address(self.request)
+        with mock.patch('blogs.views.blog.time.time', return_value=time.time() + ADDRESS_REVALIDATE_INTERVAL):
+            with self.assertNumQueries(1):
+                resolve_address(self.request)
+
+    def test_misses_are_not_cached(self):
+        request = RequestFactory().get('/', HTTP_HOST='later.ichoria.cc')
+        with self.assertRaises(Http404):
+            resolve_address(request)
+        # Created by another process
+        Blog.objects.bulk_create([Blog(user=self.user, title='Later', subdomain='later')])
+
+        self.assertEqual(resolve_address(request).title, 'Later')
+
+
+class NewsletterTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('writer', 'writer@example.com', 'password')
+        self.blog = Blog.objects.create(user=user, title='Letters', subdomain='letters')
+        self.post = Post.objects.create(
+            blog=self.blog, title='Issue one', slug='issue-one', content='Hello from {{ blog_title }}', publish=True,
+            published_date=timezone.now())
+        Subscriber.objects.create(blog=self.blog, email_address='reader@example.com')
+
+    def test_newsletter_renders_directives_and_links_unsubscribe(self):
+        newsletter, created = queue_newsletter(self.post)
+        deliver_newsletter(newsletter.pk)
+
+        self.assertEqual(len(mail.outbox), 1)
+        html = mail.outbox[0].alternatives[0][0]
+        self.assertIn('Hello from Letters', html)
+        self.assertNotIn('{{', html)
+        self.assertIn(unsubscribe_url(self.blog, 'reader@example.com').replace('&', '&amp;'), html)
+        self.assertEqual(mail.outbox[0].extra_headers['List-Unsubscribe'], f'<{unsubscribe_url(self.blog, "reader@example.com")}>')
+        self.assertEqual(NewsletterDelivery.objects.get().status, NewsletterDelivery.SENT)
+
+    def test_recorded_delivery_is_not_sent_again(self):
+        newsletter, created = queue_newsletter(self.post)
+        # A previous attempt recorded the delivery and died before finishing the batch
+        NewsletterDelivery.objects.create(
+            newsletter=newsletter, email_address='reader@example.com', status=NewsletterDelivery.SENDING)
+        deliver_newsletter(newsletter.pk)
+
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_heartbeat_keeps_a_long_job_from_being_requeued(self):
+        job = Job.objects.create(
+            name='send_newsletter', status=Job.RUNNING, locked_by='worker:0',
+            locked_at=timezone.now() - timedelta(seconds=JOB_TIMEOUT * 2))
+        current_job.job = job
+        self.addCleanup(setattr, current_job, 'job', None)
+
+        heartbeat()
+        self.assertEqual(requeue_stale_jobs(), 0)
+
+        # Requeued and claimed by another worker
+        Job.objects.filter(pk=job.pk).update(locked_by='worker:1')
+        with self.assertRaises(JobLost):
+            heartbeat()
+
+    def test_lost_newsletter_job_is_left_to_its_new_worker(self):
+        newsletter, created = queue_newsletter(self.post)
+        job = claim_job('worker:0')
+        Job.objects.filter(pk=job.pk).update(locked_by='worker:1')
+        run_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (Job.RUNNING, 'worker:1'))
+        self.assertNotEqual(Newsletter.objects.get(pk=newsletter.pk).status, Newsletter.FAILED)
+
+    def test_email_list_counts_subscribers(self):
+        self.client.force_login(self.blog.user)
+        response = self.client.get('/letters/dashboard/email-list/', HTTP_HOST='ichoria.cc')
+
+        self.assertContains(response, 'value="Enviar a 1 suscriptores"')
+        self.assertNotContains(response, 'Esta característica no está implementada')
+
+    def test_email_list_exports(self):
+        self.client.force_login(self.blog.user)
+        response = self.client.get('/letters/dashboard/email-list/', HTTP_HOST='ichoria.cc')
+        for export in ('csv', 'txt', 'ndjson'):
+            self.assertContains(response, f"window.location = '?export-{export}=True'")
+
+        response = self.client.get('/letters/dashboard/email-list/?export-ndjson=True', HTTP_HOST='ichoria.cc')
+        self.assertIn(b'"email_address": "reader@example.com"', b''.join(response.streaming_content))
+
+    def test_unsubscribe(self):
+        url = unsubscribe_url(self.blog, 'reader@example.com').replace('https://letters.ichoria.cc', '')
+
+        self.client.get(url, HTTP_HOST='letters.ichoria.cc')
+        self.assertTrue(Subscriber.objects.exists())
+
+        self.client.post(url.replace('token=', 'token=x'), HTTP_HOST='letters.ichoria.cc')
+        self.assertTrue(Subscriber.objects.exists())
+
+        self.client.post(url, HTTP_HOST='letters.ichoria.cc')
+        self.assertFalse(Subscriber.objects.exists())
+
+
+class MarkupAudit(HTMLParser):
+    """Collects the markup a browser would run script from, as it would parse it"""
+
+    def __init__(self, markup):
+        super().__init__()
+        self.problems = []
+        self.feed(markup)
+        self.close()
+
+    def handle_starttag(self, tag, attributes):
+        if tag in DROPPED_BLOCKS | DROPPED_TAGS:
+            self.problems.append(tag)
+        if tag == 'iframe' and not whitelisted_iframe(dict(attributes)):
+            self.problems.append('iframe host')
+        for name, value in attributes:
+            if name.startswith('on') or name == 'srcdoc' or (name in URL_ATTRIBUTES and is_unsafe_url(value or '')):
+                self.problems.append(f'{tag} {name}')
+
+
+class SanitizerTests(SimpleTestCase):
+    """sanitize_html against the regex clean() it replaced"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.corpus = build_corpus()
+
+    def test_rendered_markdown_is_unchanged(self):
+        for name, markup in self.corpus.items():
+            if not name.endswith(' + vectors'):
+                with self.subTest(name):
+                    self.assertEqual(sanitize_html(markup), regex_clean(markup))
+
+    def test_output_is_identical_or_safer(self):
+        cases = {**self.corpus, **{vector: vector for vector in XSS_VECTORS}}
+        for name, markup in cases.items():
+            with self.subTest(name):
+                cleaned = sanitize_html(markup)
+                if cleaned != regex_clean(markup):
+                    self.assertEqual(MarkupAudit(cleaned).problems, [])
+
+    def test_vectors_are_neutralised(self):
+        for vector in XSS_VECTORS:
+            with self.subTest(vector):
+                self.assertEqual(MarkupAudit(sanitize_html(vector)).problems, [])
+
+    def test_vectors_dont_change_the_markup_before_them(self):
+        for name, markup in self.corpus.items():
+            if name.endswith(' + vectors'):
+                with self.subTest(name):
+                    document = self.corpus[name[:-len(' + vectors')]]
+                    self.assertTrue(sanitize_html(markup).startswith(regex_clean(document)))
+
+    def test_iframes_are_kept_only_for_whitelisted_hosts(self):
+        embed = '<iframe src="https://www.youtube.com/embed/x" allowfullscreen></iframe>'
+        self.assertEqual(sanitize_html(embed), embed)
+        self.assertEqual(sanitize_html(embed.replace('www.youtube.com', 'evil.example/?www.youtube.com')), '')
+        self.assertEqual(sanitize_html(embed.replace('www.youtube.com', 'www.youtube.com.evil.example')), '')
+        # The old check matched the host anywhere in the src
+        self.assertNotEqual(regex_clean(embed.replace('www.youtube.com', 'evil.example/?www.youtube.com')), '')
+
+
+# Enough rows that the planners prefer the indexes, on an empty table every plan is a full scan
+PLAN_SEED_BLOGS = 50
+PLAN_SEED_POSTS_PER_BLOG = 20
+# The queries run against one long running blog, where the indexes matter most
+PLAN_SEED_BIG_BLOG_POSTS = 2000
+PLAN_SEED_HITS = 20000
+PLAN_SEED_DAYS = 60
+PLAN_SEED_SUBSCRIBERS = 2000
+
+# The index each hot query is meant to use, any one of the names will do
+EXPECTED_INDEXES = {
+    'blog home': ['post_published_idx'],
+    'blog feed': ['post_published_idx', 'post_studio_list_idx'],
+    'post by slug or alias': ['post_alias_idx'],
+    'post by uid': ['post_uid_idx'],
+    'studio posts': ['post_studio_list_idx'],
+    'discover trending': ['discover_trending_idx'],
+    'analytics hits': ['hit_post_date_idx'],
+    'hit de-duplication': ['hit_post_visitor_idx'],
+    'rollup day': ['hit_date_idx'],
+    'upvoted check': ['upvote_post_visitor_idx'],
+    'subscriber lookup': ['subscriber_email_idx'],
+    'subscription rate limit': ['subscriber_date_idx'],
+}
+# Django writes is_page=False as NOT is_page, which Postgres matches against an index column and SQLite doesn't
+POSTGRES_ONLY_INDEXES = {'studio posts'}
+
+
+# The queries behind the busiest views and jobs, with the ids they'd be run with
+def hot_queries(blog_id, post_id):
+    now = timezone.now()
+    return {
+        'blog home': Post.objects.filter(blog_id=blog_id, publish=True, published_date__lte=now).order_by('-published_date'),
+        'blog feed': Post.objects.filter(blog_id=blog_id, publish=True, is_page=False, published_date__lte=now).order_by('-published_date')[:10],
+        'post by slug or alias': Post.objects.filter(Q(blog_id=blog_id, slug='hello') | Q(blog_id=blog_id, alias='hello')).order_by(
+            Case(When(slug='hello', then=Value(0)), default=Value(1), output_field=IntegerField()))[:1],
+        'post by uid': Post.objects.filter(uid='abc'),
+        'studio posts': Post.objects.filter(blog_id=blog_id, is_page=False).order_by('-published_date'),
+        'discover trending': DiscoverEntry.objects.order_by('-score', '-published_date', '-post_id')[:20],
+        'analytics hits': Hit.objects.filter(post__blog_id=blog_id, created_date__gt=now - timedelta(days=7)),
+        'hit de-duplication': Hit.objects.filter(post_id__in=[post_id], hash_id__in=['abc']),
+        'rollup day': Hit.objects.filter(created_date__gte=now - timedelta(days=1), created_date__lt=now),
+        'upvoted check': Upvote.objects.filter(post_id=post_id, hash_id='abc'),
+        'subscriber lookup': Subscriber.objects.filter(blog_id=blog_id, email_address='reader@example.com'),
+        'subscription rate limit': Subscriber.objects.filter(subscribed_date__gt=now - timedelta(minutes=2)),
+    }
+
+
+# Bulk inserts skip Post.save and friends, only the rows the planners look at matter
+def seed_plan_rows():
+    now = timezone.now()
+    # Only Postgres sets the pks on bulk created objects, so they're read back
+    User.objects.bulk_create([User(username=f'plan-{i}', email=f'plan-{i}@example.com') for i in range(PLAN_SEED_BLOGS)])
+    Blog.objects.bulk_create([
+        Blog(user=user, title=f'Plan blog {i}', subdomain=f'plan-blog-{i}', reviewed=True)
+        for i, user in enumerate(User.objects.filter(username__startswith='plan-'))
+    ])
+    blogs = list(Blog.objects.filter(subdomain__startswith='plan-blog-'))
+    Post.objects.bulk_create([
+        Post(
+            blog=blog,
+            uid=f'plan-{blog.pk}-{i}',
+            title=f'Post {i}',
+            slug=f'post-{i}',
+            alias=f'alias-{i}' if i % 10 == 0 else '',
+            content='Seeded',
+            publish=i % 5 != 0,
+            is_page=i % 8 == 0,
+            published_date=now - timedelta(days=i))
+        for blog in blogs for i in range(PLAN_SEED_BIG_BLOG_POSTS if blog == blogs[0] else PLAN_SEED_POSTS_PER_BLOG)
+    ], batch_size=500)
+    posts = list(Post.objects.filter(uid__startswith='plan-').only('pk', 'blog_id', 'publish', 'is_page', 'published_date'))
+    DiscoverEntry.objects.bulk_create([
+        DiscoverEntry(post=post, blog_id=post.blog_id, score=i % 97, published_date=post.published_date)
+        for i, post in enumerate(posts) if post.publish and not post.is_page
+    ], batch_size=500)
+    Hit.objects.bulk_create([
+        Hit(post=posts[i % len(posts)], hash_id=f'visitor-{i % 3000}', country='ES')
+        for i in range(PLAN_SEED_HITS)
+    ], batch_size=1000)
+    Upvote.objects.bulk_create([Upvote(post=posts[i % len(posts)], hash_id=f'visitor-{i}') for i in range(PLAN_SEED_HITS // 4)], batch_size=1000)
+    Subscriber.objects.bulk_create([
+        Subscriber(blog=blogs[i % len(blogs)], email_address=f'reader{i}@example.com') for i in range(PLAN_SEED_SUBSCRIBERS)
+    ], batch_size=1000)
+
+    # auto_now_add dates are all now, spread them out like real traffic
+    for day in range(PLAN_SEED_DAYS):
+        Hit.objects.filter(pk__in=[hit.pk for hit in Hit.objects.only('pk')[day::PLAN_SEED_DAYS]]).update(
+            created_date=now - timedelta(days=day))
+        Subscriber.objects.filter(pk__in=[subscriber.pk for subscriber in Subscriber.objects.only('pk')[day::PLAN_SEED_DAYS]]).update(
+            subscribed_date=now - timedelta(days=day * 10))
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    return blogs[0].pk, posts[1].pk
+
+
+def full_scans(plan):
+    if connection.vendor == 'postgresql':
+        return [line.strip() for line in plan.splitlines() if 'Seq Scan' in line]
+    # SQLite: SEARCH uses an index, SCAN without one reads the whole table
+    return [line.strip() for line in plan.splitlines() if ' SCAN ' in f' {line} ' and 'INDEX' not in line]
+
+
+class QueryPlanTests(TestCase):
+    """The hot queries read their index rather than a whole table"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.blog_id, cls.post_id = seed_plan_rows()
+
+    def assertUsesIndex(self, name):
+        plan = hot_queries(self.blog_id, self.post_id)[name].explain()
+        self.assertEqual(full_scans(plan), [], f'{name} reads a whole table:\n{plan}')
+        self.assertTrue(
+            any(index in plan for index in EXPECTED_INDEXES[name]),
+            f'{name} should use {" or ".join(EXPECTED_INDEXES[name])}:\n{plan}')
+
+    def test_hot_queries_use_their_indexes(self):
+        for name in EXPECTED_INDEXES.keys() - POSTGRES_ONLY_INDEXES:
+            with self.subTest(name):
+                self.assertUsesIndex(name)
+
+    @skipUnless(connection.vendor == 'postgresql', 'SQLite plans NOT is_page as a filter, not an index column')
+    def test_postgres_only_indexes(self):
+        for name in POSTGRES_ONLY_INDEXES:
+            with self.subTest(name):
+                self.assertUsesIndex(name)
+
+
+class ViewBudgetTests(TestCase):
+    """Every URL's cold request stays within its VIEW_REQUESTS query budget"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seeded = seed_dataset()
+
+    def tearDown(self):
+        # Feed readers are buffered, write them before the test's transaction goes
+        flush_feed_subscribers()
+
+    def test_every_url_has_a_budget(self):
+        unprofiled = [pattern.name for pattern in urlpatterns if pattern.name and pattern.name not in VIEW_REQUESTS.keys() | SKIPPED_VIEWS]
+        self.assertEqual(unprofiled, [])
+
+    def test_views_stay_within_their_query_budget(self):
+        clients, hosts = seeded_clients(self.seeded)
+        for name, options in VIEW_REQUESTS.items():
+            with self.subTest(name):
+                for cache in caches.all():
+                    cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = clients[options.get('user')].get(options['path'].format(**self.seeded), HTTP_HOST=hosts[options.get('host')])
+
+                self.assertLess(response.status_code, 500)
+                self.assertLessEqual(len(queries), options['budget'], '\n'.join(query['sql'] for query in queries.captured_queries))
@@ -1,4 +1,4 @@
-from django.urls import path
+from django.urls import path, re_path
 from django.views.generic import RedirectView
 
 from blogs.views import blog, dashboard, studio, feed, discover, analytics, emailer, staff, signup_flow, media
@@ -71,12 +71,14 @@ urlpatterns = [
     
     path('sitemap.xml', blog.sitemap, name='sitemap'),
     path('robots.txt', blog.robots, name='robots'),
+    re_path(r'^styles/(?P<name>default|dashboard|\d+)\.(?P<css_hash>[0-9a-f]+)\.css$', blog.stylesheet, name='stylesheet'),
     path('public-analytics/', blog.public_analytics, name="public_analytics"),
     path('upvote/<uid>/', blog.upvote, name='upvote'),
     path('hit/<uid>/', analytics.post_hit, name='post_hit'),
     path('subscribe/', emailer.subscribe, name='subscribe'),
     path('email-subscribe/', emailer.email_subscribe, name='email_subscribe'),
     path('confirm-subscription/', emailer.confirm_subscription, name='confirm_subscription'),
+    path('unsubscribe/', emailer.unsubscribe, name='unsubscribe'),
     path("feed/", feed.feed, name="rss_feed"),
     path('<path:slug>/', blog.post, name='post'),
 ]
@@ -1,30 +1,30 @@
 from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
-from django.db import IntegrityError
 from datetime import timedelta
 from django.db.models.functions import TruncDate
 
+from blogs.exports import export_response
 from blogs.forms import AnalyticsForm
-from blogs.models import Blog, Hit, Post, RssSubscriber
-from blogs.helpers import daterange, get_country, salt_and_hash
+from blogs.feed_subscribers import feed_subscriber_count
+from blogs.models import Blog, DailyBlogStats, DailyPostStats, Hit, Post
+from blogs.helpers import daterange, salt_and_hash
+from blogs.hits import enqueue_hit
+from blogs.rollups import BREAKDOWNS, day_start, merge_rollups, rolled_up_to, rollup_chart_data, rollup_hit_counts
 from django.db.models import Count, Sum, Q
 from django.http import HttpResponse
 
+from collections import Counter
 from ipaddr import client_ip
-from urllib.parse import urlparse
-import httpagentparser
 import pygal
-import threading
 
 import pygal
 from pygal.style import LightColorizedStyle
-import djqscsv
 
 
 @login_required
 def analytics(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
 
     if blog.user.settings.upgraded:
         return analytics_upgraded(request, id=id)
@@ -71,7 +71,7 @@ def analytics(request, id):
 
 @login_required
 def analytics_upgraded(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
 
     if not blog.user.settings.upgraded:
         return redirect('analytics', id=blog.subdomain)
@@ -85,7 +85,7 @@ def analytics_upgraded(request, id):
 
     if request.GET.get('export', False):
         hits = Hit.objects.filter(post__blog=blog).order_by('created_date')
-        return djqscsv.render_to_csv_response(hits)
+        return export_response(hits, 'hit_export', request.GET.get('format', 'csv'))
     return render_analytics(request, blog)
 
 
@@ -97,33 +97,40 @@ def render_analytics(request, blog, public=False):
     start_date = (now - timedelta(days=days_filter)).date()
     end_date = now.date()
 
-    base_hits = Hit.objects.filter(post__blog=blog, created_date__gt=start_date)
+    # Closed days come from the daily rollups, the rest (usually just today) from raw hits
+    rollup_end = rolled_up_to()
+    use_rollups = bool(rollup_end and rollup_end >= start_date and not referrer_filter)
+
+    base_hits = Hit.objects.filter(post__blog=blog, created_date__gt=day_start(start_date))
+
+    if use_rollups:
+        rollup_end = min(rollup_end, end_date - timedelta(days=1))
+        base_hits = base_hits.filter(created_date__gte=day_start(rollup_end + timedelta(days=1)))
 
     if post_filter:
         base_hits = base_hits.filter(post__slug=post_filter)
     if referrer_filter:
         base_hits = base_hits.filter(referrer=referrer_filter)
 
-    posts = Post.objects.annotate(
+    posts = list(Post.objects.annotate(
         hit_count=Count('hit', filter=Q(hit__in=base_hits)),
     ).filter(
         blog=blog,
         publish=True,
     ).filter(Q(slug=post_filter) if post_filter else Q()
-            ).values('title', 'hit_count', 'upvotes', 'published_date', 'slug').order_by('-hit_count', '-published_date')
+            ).values('pk', 'title', 'hit_count', 'upvotes', 'published_date', 'slug').order_by('-hit_count', '-published_date'))
 
 
     hits = base_hits.order_by('created_date')
-    start_date = hits.first().created_date.date() if hits.exists() else start_date
+    first_hit = hits.first()
 
     unique_reads = hits.count()
     unique_visitors = hits.values('hash_id').distinct().count()
     on_site = hits.filter(created_date__gt=now-timedelta(minutes=4)).count()
 
-    referrers = hits.exclude(referrer='').values('referrer').annotate(count=Count('referrer')).order_by('-count').values('referrer', 'count')
-    devices = hits.exclude(device='').values('device').annotate(count=Count('device')).order_by('-count').values('device', 'count')
-    browsers = hits.exclude(browser='').values('browser').annotate(count=Count('browser')).order_by('-count').values('browser', 'count')
-    countries = hits.exclude(country='').values('country').annotate(count=Count('country')).order_by('-count').values('country', 'count')
+    breakdowns = {}
+    for field, name in BREAKDOWNS.items():
+        breakdowns[name] = Counter(dict(hits.exclude(**{field: ''}).order_by().values(field).annotate(count=Count(field)).values_list(field, 'count')))
 
     # Build chart data
 
@@ -133,9 +140,40 @@ def render_analytics(request, blog, public=False):
         c=Count('date')
     ).order_by('date')
 
+    hit_date_count = {hit['date']: hit['c'] for hit in hit_dict}
+
+    if use_rollups:
+        if post_filter:
+            stats = DailyPostStats.objects.filter(post__blog=blog, post__slug=post_filter, date__range=(start_date, rollup_end))
+        else:
+            stats = DailyBlogStats.objects.filter(blog=blog, date__range=(start_date, rollup_end))
+        stats = stats.filter(hits__gt=0)
+
+        totals = merge_rollups(stats)
+        unique_reads += totals['hits']
+        unique_visitors += totals['unique_visitors']
+        for name in BREAKDOWNS.values():
+            breakdowns[name].update(totals[name])
+
+        hit_date_count.update(rollup_chart_data(stats))
+
+        post_hit_counts = rollup_hit_counts(DailyPostStats.objects.filter(post__blog=blog, date__range=(start_date, rollup_end)))
+        for post in posts:
+            post['hit_count'] += post_hit_counts.get(post['pk'], 0)
+        posts.sort(key=lambda post: (post['hit_count'], post['published_date']), reverse=True)
+
+    if hit_date_count:
+        start_date = min(hit_date_count)
+    elif first_hit:
+        start_date = first_hit.created_date.date()
+
+    referrers, devices, browsers, countries = [
+        [{field: value, 'count': count} for value, count in breakdowns[name].most_common()]
+        for field, name in BREAKDOWNS.items()
+    ]
+
     chart_data = []
     date_range = [start_date + timedelta(days=x) for x in range((end_date - start_date).days + 1)]
-    hit_date_count = {hit['date']: hit['c'] for hit in hit_dict}
 
     for date in date_range:
         date_str = date.strftime('%Y-%m-%d')
@@ -161,7 +199,7 @@ def render_analytics(request, blog, public=False):
         form = AnalyticsForm(instance=blog)
 
     # RSS Subscriber count
-    rss_subscriber_count = RssSubscriber.objects.filter(blog=blog, access_date__gt=now - timedelta(hours=24)).count()
+    rss_subscriber_count = feed_subscriber_count(blog)
 
     return render(request, 'studio/analytics.html', {
         'public': public,
@@ -186,49 +224,10 @@ def render_analytics(request, blog, public=False):
 
 
 def post_hit(request, uid):
-    HitThread(request, uid).start()
+    enqueue_hit(
+        uid,
+        salt_and_hash(request),
+        client_ip(request),
+        request.META.get('HTTP_USER_AGENT', None),
+        request.GET.get('ref', ''))
     return HttpResponse("Logged")
-
-
-class HitThread(threading.Thread):
-    def __init__(self, request, uid):
-        self.request = request
-        self.uid = uid
-        threading.Thread.__init__(self)
-
-    def run(self):
-        try:
-            user_agent = httpagentparser.detect(self.request.META.get('HTTP_USER_AGENT', None))
-            if user_agent.get('bot', False):
-                print('Bot traffic')
-                return
-
-            # Prevent duplicates with ip hash + date
-            hash_id = salt_and_hash(self.request)
-
-            country = get_country(client_ip(self.request)).get('country_name', '')
-            device = user_agent.get('platform', {}).get('name', '')
-            browser = user_agent.get('browser', {}).get('name', '')
-
-            referrer = self.request.GET.get('ref', '')
-            if referrer:
-                referrer = urlparse(referrer)
-                referrer = '{uri.scheme}://{uri.netloc}/'.format(uri=referrer)
-            
-            post_pk = Post.objects.filter(uid=self.uid).values_list('pk', flat=True).first()
-
-            if post_pk:
-                hit, create = Hit.objects.get_or_create(
-                    post_id=post_pk,
-                    hash_id=hash_id,
-                    referrer=referrer,
-                    country=country,
-                    device=device,
-                    browser=browser)
-                if create:
-                    print(hit, 'hit')
-
-        except Hit.MultipleObjectsReturned:
-            print('Duplicate hit')
-        except IntegrityError:
-            print('Post does not exist')
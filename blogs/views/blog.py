@@ -2,18 +2,44 @@ from django.http import FileResponse
 from django.http import HttpResponse
 from django.http.response import Http404
 from django.shortcuts import get_object_or_404, render, redirect
+from django.template.loader import render_to_string
 from django.views.decorators.csrf import csrf_exempt
-from django.contrib.sites.models import Site
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers, quote_etag
+from django.utils.html import escape
+from django.utils.http import http_date
+from django.utils.safestring import mark_safe
 from django.utils.text import slugify
+from django.core.cache import cache, caches
+from django.db.models import Case, IntegerField, Q, Value, When
 
+from blogs.caching import ADDRESS_CACHE_TIMEOUT, ADDRESS_REVALIDATE_INTERVAL, PAGE_CACHE_TIMEOUT, address_cache_key
 from blogs.models import Blog, Post, Upvote
 from blogs.helpers import get_posts, salt_and_hash, unmark
-from blogs.tasks import daily_task
+from blogs.stylesheets import STYLESHEET_CACHE_CONTROL, STYLESHEET_TEMPLATES, shared_stylesheet
 from blogs.views.analytics import render_analytics
 
+from functools import lru_cache
+import hashlib
 import tldextract
 import re
+import time
+
+
+VALID_DOMAINS = [
+    '127.0.0.1:8000',
+    '127.0.0.1:8001',
+    'localhost:8000',
+    'localhost:8001',
+    'ichoria.cc',
+    'https://ichoria.cc'
+]
+
+# Reader specific parts of a cached page, filled in on every request
+UPVOTE_FORM_MARKER = '<!--reader:upvote-form-->'
+HIT_QUERY_MARKER = '<!--reader:hit-query-->'
+
+SUBDOMAIN_REGEX = re.compile(r'^(?!www\.)((?!www\.)(?:[a-zA-Z0-9-]+\.)+[a-zA-Z]{2,})(?::\d{1,5})?$')
 
 
 def resolve_address(request):
@@ -22,41 +48,150 @@ def resolve_address(request):
     if http_host == 'bear-blog.herokuapp.com':
         http_host = request.META.get('HTTP_X_FORWARDED_HOST', 'bear-blog.herokuapp.com')
 
-    sites = Site.objects.all()
-    valid_domains = [
-        '127.0.0.1:8000',
-        '127.0.0.1:8001',
-        'localhost:8000',
-        'localhost:8001',
-        'ichoria.cc',
-        'https://ichoria.cc'
-    ]
-
-    subdomain_pattern = r'^(?!www\.)((?!www\.)(?:[a-zA-Z0-9-]+\.)+[a-zA-Z]{2,})(?::\d{1,5})?$'
-    regex = re.compile(subdomain_pattern)
+    kind, name = parse_address(http_host.lower())
 
-    if any(http_host == site for site in valid_domains):
+    if kind is None:
         # Homepage
         return None
-    elif regex.match(http_host):
+
+    cache_key = address_cache_key(kind, name)
+    cached = cache.get(cache_key)
+
+    if cached is not None:
+        blog = cached['blog']
+        if time.time() - cached['checked'] < ADDRESS_REVALIDATE_INTERVAL:
+            return blog
+
+        # Other processes may have changed the blog since it was cached, every change moves its version on
+        current_version = Blog.objects.filter(pk=blog.pk, user__is_active=True).values_list('cache_version', flat=True).first()
+        if current_version == blog.cache_version:
+            cache.set(cache_key, {'blog': blog, 'checked': time.time()}, ADDRESS_CACHE_TIMEOUT)
+            return blog
+
+    if kind == 'subdomain':
         # Subdomained blog
-        return get_object_or_404(Blog, subdomain__iexact=tldextract.extract(http_host).subdomain, user__is_active=True)
+        blog = get_object_or_404(Blog.objects.select_related('user', 'user__settings'), subdomain__iexact=name, user__is_active=True)
     else:
         # Custom domain blog
-        return get_blog_with_domain(http_host)
+        blog = get_blog_with_domain(http_host)
+
+    cache.set(cache_key, {'blog': blog, 'checked': time.time()}, ADDRESS_CACHE_TIMEOUT)
+    return blog
+
+
+@lru_cache(maxsize=4096)
+def parse_address(http_host):
+    if http_host in VALID_DOMAINS:
+        return None, None
+    elif SUBDOMAIN_REGEX.match(http_host):
+        return 'subdomain', tldextract.extract(http_host).subdomain
+    else:
+        return 'domain', http_host
 
 
 def get_blog_with_domain(domain):
     if not domain:
         return False
+    blogs = Blog.objects.select_related('user', 'user__settings')
     try:
-        return Blog.objects.get(domain=domain, user__is_active=True)
+        return blogs.get(domain=domain, user__is_active=True)
     except Blog.DoesNotExist:
         # Handle www subdomain if necessary
         if 'www.' in domain:
-            return get_object_or_404(Blog, domain__iexact=domain.replace('www.', ''), user__is_active=True)
+            return get_object_or_404(blogs, domain__iexact=domain.replace('www.', ''), user__is_active=True)
         else:
-            return get_object_or_404(Blog, domain__iexact=f'www.{domain}', user__is_active=True)
+            return get_object_or_404(blogs, domain__iexact=f'www.{domain}', user__is_active=True)
+
+
+def page_cache_key(request, blog):
+    # Only anonymous readers share pages
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return None
+
+    variant = '|'.join([
+        request.get_host(),
+        request.path,
+        request.META.get('QUERY_STRING', ''),
+        request.COOKIES.get('lang', ''),
+        request.COOKIES.get('timezone', ''),
+    ])
+    variant_hash = hashlib.md5(variant.encode('utf-8')).hexdigest()
+    return f'page_{blog.pk}_{blog.cache_version}_{variant_hash}'
+
+
+def cached_page(request, blog, reader_fragments=None):
+    cache_key = page_cache_key(request, blog)
+    if not cache_key:
+        return None
+
+    page = caches['pages'].get(cache_key)
+    if page is None:
+        return None
+
+    return page_response(request, page, reader_fragments)
+
+
+def cache_page(request, blog, response, reader_fragments=None):
+    cache_key = page_cache_key(request, blog)
+    if not cache_key or response.status_code != 200:
+        return response
+
+    content = response.content.decode(response.charset)
+    # Validators come from the blog's version so every process answers a conditional request the same way,
+    # the content hash still changes the ETag when time alone changes the page (scheduled posts)
+    page = {
+        'content': content,
+        'content_type': response['Content-Type'],
+        'etag': hashlib.md5(f'{blog.cache_version}|{content}'.encode('utf-8')).hexdigest(),
+        'last_modified': blog.cache_version // 1_000_000_000,
+    }
+    caches['pages'].set(cache_key, page, PAGE_CACHE_TIMEOUT)
+
+    return page_response(request, page, reader_fragments)
+
+
+def page_response(request, page, reader_fragments=None):
+    content = page['content']
+    etag = page['etag']
+
+    if reader_fragments:
+        for marker, fragment in reader_fragments.items():
+            content = content.replace(marker, fragment)
+        etag = hashlib.md5(''.join([etag, *reader_fragments.values()]).encode('utf-8')).hexdigest()
+
+    etag = quote_etag(etag)
+    response = get_conditional_response(request, etag=etag, last_modified=page['last_modified'])
+    if response is None:
+        response = HttpResponse(content, content_type=page['content_type'])
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(page['last_modified'])
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+# Served from any host so previews and error pages on the main domain can use it too
+def stylesheet(request, name, css_hash):
+    if name in STYLESHEET_TEMPLATES:
+        css, current_hash = shared_stylesheet(name)
+    else:
+        blog = Blog.objects.filter(pk=name).values('compiled_styles', 'styles_hash').first()
+        if not blog:
+            raise Http404('No such stylesheet')
+        css, current_hash = blog['compiled_styles'], blog['styles_hash']
+
+    # Pages cached before the styles changed still point to the old hash
+    if css_hash != current_hash:
+        return redirect('stylesheet', name=name, css_hash=current_hash)
+
+    etag = quote_etag(current_hash)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(css, content_type='text/css; charset=utf-8')
+    response['ETag'] = etag
+    response['Cache-Control'] = STYLESHEET_CACHE_CONTROL
+    return response
 
 
 @csrf_exempt
@@ -75,14 +210,17 @@ def ping(request):
 def home(request):
     blog = resolve_address(request)
     if not blog:
-        daily_task()
         return render(request, 'landing.html')
 
+    response = cached_page(request, blog)
+    if response:
+        return response
+
     all_posts = blog.posts.filter(publish=True, published_date__lte=timezone.now()).order_by('-published_date')
 
     meta_description = blog.meta_description or unmark(blog.content)[:157] + '...'
 
-    return render(
+    response = render(
         request,
         'home.html',
         {
@@ -92,24 +230,29 @@ def home(request):
             'meta_description': meta_description
         })
 
+    return cache_page(request, blog, response)
+
 
 def posts(request):
     blog = resolve_address(request)
     if not blog:
         return not_found(request)
 
+    response = cached_page(request, blog)
+    if response:
+        return response
+
     tag = request.GET.get('q', '')
 
     if tag:
-        posts = Post.objects.filter(blog=blog, publish=True, published_date__lte=timezone.now()).order_by('-published_date')
-        blog_posts = [post for post in posts if tag in post.tags]
+        blog_posts = Post.objects.filter(blog=blog, publish=True, published_date__lte=timezone.now(), post_tags__tag__name=tag).order_by('-published_date')
     else:
         all_posts = blog.posts.filter(publish=True, published_date__lte=timezone.now()).order_by('-published_date')
         blog_posts = get_posts(all_posts)
 
     meta_description = blog.meta_description or unmark(blog.content)[:157] + '...'
 
-    return render(
+    response = render(
         request,
         'posts.html',
         {
@@ -121,6 +264,8 @@ def posts(request):
         }
     )
 
+    return cache_page(request, blog, response)
+
 
 @csrf_exempt
 def post(request, slug):
@@ -133,22 +278,33 @@ def post(request, slug):
         from blogs.views.feed import feed
         return feed(request)
 
-    # Find by post slug
-    post = Post.objects.filter(blog=blog, slug__iexact=slugify(slug)).first()
+    # Find by post slug or alias in one query, a slug match wins
+    post_slug = slugify(slug)
+    # blog is repeated in each branch so both can use their (blog, ...) index
+    post = Post.objects.filter(Q(blog=blog, slug=post_slug) | Q(blog=blog, alias=slug.lower())).order_by(
+        Case(When(slug=post_slug, then=Value(0)), default=Value(1), output_field=IntegerField())
+    ).first()
     if not post:
-        # Find by post alias
-        post = Post.objects.filter(blog=blog, alias__iexact=slug).first()
-        if post:
-            return redirect('post', slug=post.slug)
-        else:
-            # Check for a custom blogreel path and render the blog page
-            if slug == blog.blog_path or slug == 'blog':
-                return posts(request)
-            return render(request, '404.html', {'blog': blog}, status=404)
+        # Check for a custom blogreel path and render the blog page
+        if slug == blog.blog_path or slug == 'blog':
+            return posts(request)
+        return render(request, '404.html', {'blog': blog}, status=404)
+
+    if post.slug != post_slug:
+        # Found by post alias
+        return redirect('post', slug=post.slug)
     
-    # Check if upvoted
-    hash_id = salt_and_hash(request, 'year')
-    upvoted = post.upvote_set.filter(hash_id=hash_id).exists()
+    if post.publish is False and not request.GET.get('token') == post.token:
+        return not_found(request)
+
+    reader_fragments = {
+        UPVOTE_FORM_MARKER: upvote_form(request, post),
+        HIT_QUERY_MARKER: hit_query(request, blog),
+    }
+
+    response = cached_page(request, blog, reader_fragments)
+    if response:
+        return response
 
     root = f'https://{blog.subdomain}.ichoria.cc'
     meta_description = post.meta_description or unmark(post.content)[:157] + '...'
@@ -157,10 +313,7 @@ def post(request, slug):
     if post.canonical_url and post.canonical_url.startswith('https://'):
         canonical_url = post.canonical_url
 
-    if post.publish is False and not request.GET.get('token') == post.token:
-        return not_found(request)
-
-    return render(
+    response = render(
         request,
         'post.html',
         {
@@ -172,17 +325,38 @@ def post(request, slug):
             'canonical_url': canonical_url,
             'meta_description': meta_description,
             'meta_image': post.meta_image or blog.meta_image,
-            'upvoted': upvoted
+            'upvote_form': mark_safe(UPVOTE_FORM_MARKER),
+            'hit_query': mark_safe(HIT_QUERY_MARKER),
         }
     )
 
+    return cache_page(request, blog, response, reader_fragments)
+
+
+def upvote_form(request, post):
+    if not post.make_discoverable:
+        return ''
+
+    # Check if upvoted
+    hash_id = salt_and_hash(request, 'year')
+    upvoted = post.upvote_set.filter(hash_id=hash_id).exists()
+
+    return render_to_string('snippets/upvote_form.html', {'post': post, 'upvoted': upvoted}, request)
+
+
+def hit_query(request, blog):
+    referrer = request.META.get('HTTP_REFERER')
+    if referrer and blog.subdomain not in referrer:
+        return f'?ref={escape(referrer)}'
+    return ''
+
 
 @csrf_exempt
 def upvote(request, uid):
     hash_id = salt_and_hash(request, 'year')
 
     if uid == request.POST.get("uid", "") and not request.POST.get("title", False):
-        post = get_object_or_404(Post, uid=uid)
+        post = get_object_or_404(Post.objects.select_related('blog'), uid=uid)
         print("Upvoting", post)
         try:
             upvote, created = Upvote.objects.get_or_create(post=post, hash_id=hash_id)
@@ -212,15 +386,35 @@ def not_found(request, *args, **kwargs):
 
 def sitemap(request):
     blog = resolve_address(request)
+
+    if blog:
+        response = cached_page(request, blog)
+        if response:
+            return response
+
     posts = []
     try:
         posts = blog.posts.filter(publish=True, published_date__lte=timezone.now()).order_by('-published_date')
     except AttributeError:
         posts = []
 
-    return render(request, 'sitemap.xml', {'blog': blog, 'posts': posts}, content_type='text/xml')
+    response = render(request, 'sitemap.xml', {'blog': blog, 'posts': posts}, content_type='text/xml')
+
+    if blog:
+        return cache_page(request, blog, response)
+    return response
 
 
 def robots(request):
     blog = resolve_address(request)
-    return render(request, 'robots.txt',  {'blog': blog}, content_type="text/plain")
+
+    if blog:
+        response = cached_page(request, blog)
+        if response:
+            return response
+
+    response = render(request, 'robots.txt',  {'blog': blog}, content_type="text/plain")
+
+    if blog:
+        return cache_page(request, blog, response)
+    return response
@@ -6,8 +6,8 @@ from django.utils.text import slugify
 
 from ipaddr import client_ip
 from unicodedata import lookup
-import djqscsv
 
+from blogs.exports import export_response
 from blogs.forms import NavForm, StyleForm
 from blogs.helpers import get_country, is_protected
 from blogs.models import Blog, Post, Stylesheet
@@ -15,7 +15,7 @@ from blogs.models import Blog, Post, Stylesheet
 
 @login_required
 def nav(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
 
     if request.method == "POST":
         form = NavForm(request.POST, instance=blog)
@@ -36,7 +36,7 @@ def nav(request, id):
 
 @login_required
 def styles(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
 
     if request.method == "POST":
         form = StyleForm(
@@ -69,14 +69,14 @@ def styles(request, id):
 
 @login_required
 def blog_delete(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
     blog.delete()
     return redirect('account')
 
 
 @login_required
 def posts_edit(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
 
     posts = Post.objects.filter(blog=blog, is_page=False).order_by('-published_date')
 
@@ -88,7 +88,7 @@ def posts_edit(request, id):
 
 @login_required
 def pages_edit(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
 
     posts = Post.objects.filter(blog=blog, is_page=True).order_by('-published_date')
 
@@ -101,7 +101,7 @@ def pages_edit(request, id):
 
 @login_required
 def post_delete(request, id, uid):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
     post = get_object_or_404(Post, blog=blog, uid=uid)
     is_page = post.is_page
     post.delete()
@@ -157,7 +157,7 @@ def upgrade(request):
 
 @login_required
 def opt_in_review(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
 
     if request.method == 'POST':
         spam = request.POST.get("spam", "")
@@ -172,7 +172,7 @@ def opt_in_review(request, id):
 
 @login_required
 def settings(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
     
     error_messages = []
     
@@ -191,7 +191,7 @@ def settings(request, id):
 
 
     if request.GET.get("export", ""):
-        return djqscsv.render_to_csv_response(blog.posts)
+        return export_response(blog.posts.order_by('id'), 'post_export', request.GET.get('format', 'csv'))
     
     if request.GET.get("generate"):
         blog.generate_auth_token()
@@ -4,11 +4,11 @@ from django.views.decorators.csrf import csrf_exempt
 from django.db.models import Count, Q
 from django.utils import timezone
 from django.contrib.sites.models import Site
-from django.db.models.functions import Length
 from django.core.cache import cache
 
-from blogs.models import Post, Upvote
+from blogs.models import DiscoverEntry, Post, Upvote
 from blogs.helpers import clean_text, sanitise_int
+from blogs.search import search_posts
 
 from feedgen.feed import FeedGenerator
 import mistune
@@ -19,20 +19,38 @@ CACHE_TIMEOUT = 300  # 5 minutes in seconds
 
 def get_base_query():
     """Returns the base query for fetching posts, with caching."""
-    
-    queryset = Post.objects.annotate(content_length=Length('content')).filter(
-        publish=True,
-        content_length__gt=100,
-        hidden=False,
-        blog__reviewed=True,
-        blog__user__is_active=True,
-        blog__hidden=False,
-        make_discoverable=True,
+
+    # Eligibility is kept up to date in the discover index by Post, Blog and User saves
+    queryset = Post.objects.filter(
+        discover_entry__isnull=False,
         published_date__lte=timezone.now()
     )
 
     return queryset
 
+
+def get_discover_entries(lang=None):
+    entries = DiscoverEntry.objects.filter(published_date__lte=timezone.now())
+    if lang:
+        entries = entries.filter(lang__icontains=lang)
+    return entries
+
+
+ORDERINGS = {
+    'trending': ('score', 'published_date', 'post_id'),
+    'newest': ('published_date', 'post_id'),
+}
+
+
+# Keyset pagination: rows strictly after (or before) the cursor entry in the given ordering
+def keyset_filter(entries, fields, cursor, before=False):
+    lookup = 'gt' if before else 'lt'
+    condition = Q()
+    for i, field in enumerate(fields):
+        equal = {f: getattr(cursor, f) for f in fields[:i]}
+        condition |= Q(**equal, **{f'{field}__{lookup}': getattr(cursor, field)})
+    return entries.filter(condition)
+
 def admin_actions(request):
     # admin actions
     if request.user.is_staff:
@@ -42,9 +60,8 @@ def admin_actions(request):
             post.save()
         if request.POST.get("boost-post", False):
             post = Post.objects.get(pk=request.POST.get("boost-post"))
-            for i in range(0, 5):
-                upvote = Upvote(post=post, hash_id=f"boost-{i}")
-                upvote.save()
+            Upvote.objects.bulk_create([Upvote(post=post, hash_id=f"boost-{i}") for i in range(0, 5)])
+            post.add_upvotes(5)
         if request.POST.get("deprioritise-post", False):
             post = Post.objects.get(pk=request.POST.get("deprioritise-post"))
             post.deprioritise = True
@@ -96,25 +113,33 @@ def discover(request):
     else:
         pinned_posts = []
 
-    # Use the base query function excluding pinned posts
-    base_query = get_base_query().exclude(id__in=pinned_posts)
-
     lang = request.COOKIES.get('lang')
 
-    if lang:
-        base_query = base_query.filter(
-            (Q(lang__icontains=lang) & ~Q(lang='')) |
-            (Q(lang='') & Q(blog__lang__icontains=lang) & ~Q(blog__lang=''))
-        )
+    # Use the discover index excluding pinned posts
+    entries = get_discover_entries(lang).exclude(post_id__in=pinned_posts)
 
-    if newest:
-        other_posts = base_query.order_by("-published_date")
+    fields = ORDERINGS['newest' if newest else 'trending']
+    ordering = [f'-{field}' for field in fields]
+
+    after = request.GET.get("after")
+    before = request.GET.get("before")
+    cursor = None
+    if after or before:
+        cursor = DiscoverEntry.objects.filter(pk=sanitise_int(after or before)).first()
+
+    if cursor and before:
+        entries = keyset_filter(entries, fields, cursor, before=True).order_by(*fields)
+        entries = list(entries.select_related("post__blog")[:posts_per_page])[::-1]
+    elif cursor:
+        entries = keyset_filter(entries, fields, cursor).order_by(*ordering)
+        entries = entries.select_related("post__blog")[:posts_per_page]
     else:
-        other_posts = base_query.order_by("-score", "-published_date")
+        # Plain page numbers (old links, or a cursor that has left the index)
+        entries = entries.order_by(*ordering).select_related("post__blog")[posts_from:posts_to]
 
-    other_posts = other_posts.select_related("blog")[posts_from:posts_to]
+    other_posts = [entry.post for entry in entries]
 
-    posts = list(pinned_posts) + list(other_posts)
+    posts = list(pinned_posts) + other_posts
 
     return render(request, "discover.html", {
         "site": Site.objects.get_current(),
@@ -123,6 +148,8 @@ def discover(request):
         "posts": posts,
         "previous_page": page - 1,
         "next_page": page + 1,
+        "first_post": other_posts[0].pk if other_posts else None,
+        "last_post": other_posts[-1].pk if other_posts else None,
         "posts_from": posts_from,
         "newest": newest,
     })
@@ -185,18 +212,19 @@ def feed(request):
 def search(request):
     search_string = request.GET.get('query', "")
     posts = None
+    has_next = False
+
+    page = 0
+    if request.GET.get("page", 0):
+        page = sanitise_int(request.GET.get("page"), 7)
 
     if search_string:
-        posts = (
-            get_base_query().filter(
-                Q(content__icontains=search_string) | Q(title__icontains=search_string)
-            )
-            .order_by('-upvotes', "-published_date")
-            .select_related("blog")[0:50]
-        )
+        posts, has_next = search_posts(search_string, request.COOKIES.get('lang'), page)
 
     return render(request, "search.html", {
         "site": Site.objects.get_current(),
         "posts": posts,
         "search_string": search_string,
+        "previous_page": page - 1,
+        "next_page": page + 1 if has_next else None,
     })
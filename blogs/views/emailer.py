@@ -2,21 +2,24 @@ from curses.ascii import HT
 import hashlib
 import re
 
-import djqscsv
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.html import escape
 
+from blogs.exports import export_response
 from blogs.helpers import send_async_mail
-from blogs.models import Blog, Subscriber
+from blogs.models import Blog, Post, Subscriber
+from blogs.newsletters import queue_newsletter, unsubscribe_token
 from blogs.views.blog import resolve_address, not_found
 
 
 @login_required
 def email_list(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
 
     if not blog.user.settings.upgraded:
         return redirect('upgrade')
@@ -24,17 +27,21 @@ def email_list(request, id):
     subscribers = Subscriber.objects.filter(blog=blog)
 
     if request.GET.get("export-csv", ""):
-        subscribers = subscribers.values('email_address', 'subscribed_date')
-        return djqscsv.render_to_csv_response(subscribers)
+        subscribers = subscribers.values('email_address', 'subscribed_date').order_by('id')
+        return export_response(subscribers, 'subscriber_export', 'csv')
 
     if request.GET.get("export-txt", ""):
-        subscribers = subscribers.values('email_address')
-        file_data = ""
-        for subscriber in subscribers:
-            file_data += subscriber['email_address'] + "\n"
-        response = HttpResponse(file_data, content_type='application/text charset=utf-8')
-        response['Content-Disposition'] = 'attachment; filename="emails.txt"'
-        return response
+        subscribers = subscribers.values('email_address').order_by('id')
+        return export_response(subscribers, 'emails', 'txt')
+
+    if request.GET.get("export-ndjson", ""):
+        subscribers = subscribers.values('email_address', 'subscribed_date').order_by('id')
+        return export_response(subscribers, 'subscriber_export', 'ndjson')
+
+    if request.POST.get("send-newsletter", ""):
+        post = get_object_or_404(Post, blog=blog, uid=request.POST.get("send-newsletter"), publish=True)
+        queue_newsletter(post)
+        return redirect('email_list', id=blog.subdomain)
 
     email_addresses_text = ""
     if request.POST.get("email_addresses", ""):
@@ -55,7 +62,10 @@ def email_list(request, id):
     return render(request, "dashboard/subscribers.html", {
         "blog": blog,
         "subscribers": subscribers,
-        "email_addresses_text": email_addresses_text
+        "subscriber_count": subscribers.count(),
+        "email_addresses_text": email_addresses_text,
+        "newsletters": blog.newsletters.select_related('post').order_by('-created_date')[:20],
+        "unsent_posts": blog.posts.filter(publish=True, newsletter__isnull=True).order_by('-published_date')[:20],
     })
 
 
@@ -117,6 +127,35 @@ def confirm_subscription(request):
     return HttpResponse("Error: intenta suscribirte de nuevo")
 
 
+# Linked from every newsletter. Mail clients' one-click unsubscribe POSTs straight to it, without a CSRF token.
+@csrf_exempt
+def unsubscribe(request):
+    blog = resolve_address(request)
+    if not blog:
+        return not_found(request)
+
+    email = request.GET.get("email", "")
+    if not email or not constant_time_compare(unsubscribe_token(blog, email), request.GET.get("token", "")):
+        return HttpResponse("Error: el link para cancelar la suscripción no es válido")
+
+    # Link scanners follow links in emails, so only a POST unsubscribes
+    if request.method == "POST":
+        Subscriber.objects.filter(blog=blog, email_address__iexact=email).delete()
+        return HttpResponse(f'''
+            <p style='text-align: center; padding-top: 10%'>
+                Cancelaste tu suscripción a
+                <a href="https://{blog.subdomain}.ichoria.cc">{escape(blog.title)}</a>.
+            </p>
+            ''')
+
+    return HttpResponse(f'''
+        <form method="post" style='text-align: center; padding-top: 10%'>
+            <p>¿Cancelar tu suscripción a <a href="https://{blog.subdomain}.ichoria.cc">{escape(blog.title)}</a>?</p>
+            <button type="submit">Cancelar suscripción</button>
+        </form>
+        ''')
+
+
 def validate_subscriber_email(email, blog):
     token = hashlib.md5(f'{email} {blog.subdomain} {timezone.now().strftime("%B %Y")}'.encode()).hexdigest()
     confirmation_link = f'https://{blog.subdomain}.ichoria.cc/confirm-subscription/?token={token}&email={email}'
@@ -1,23 +1,36 @@
-from django.core.exceptions import MultipleObjectsReturned
 from django.http import HttpResponse, HttpResponseServerError
 from django.utils import timezone
-from django.core.cache import cache
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from django.core.cache import caches
 
+from blogs.feed_subscribers import record_feed_subscriber
 from blogs.helpers import salt_and_hash, unmark
-from blogs.models import RssSubscriber
 from blogs.templatetags.custom_tags import markdown
 from blogs.views.blog import not_found, resolve_address
 
 from feedgen.feed import FeedGenerator
+import calendar
+import hashlib
 import re
 import logging
 
 logger = logging.getLogger(__name__)
 
-CACHE_TIMEOUT = 3600  # 1 hour in seconds
+CACHE_TIMEOUT = 900  # 15 minutes in seconds
+
+# Control characters that aren't allowed in XML
+CONTROL_CHARACTERS_REGEX = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]')
 
 def clean_string(s):
-    return re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', s)
+    return CONTROL_CHARACTERS_REGEX.sub('', s)
+
+
+# Serialized feeds share the blog's cache version, stored on the blog row so a save in any process moves it on
+def feed_cache_key(blog, feed_type, tag):
+    tag_hash = hashlib.md5((tag or '').lower().encode('utf-8')).hexdigest()
+    return f'feed_{blog.pk}_{blog.cache_version}_{feed_type}_{tag_hash}'
+
 
 def feed(request):
     blog = resolve_address(request)
@@ -25,23 +38,43 @@ def feed(request):
         return not_found(request)
 
     tag = request.GET.get('q')
-    
-    CACHE_KEY = f'{blog.subdomain}_all_posts'
-    cached_queryset = cache.get(CACHE_KEY)
+    feed_type = 'rss' if request.GET.get('type') == 'rss' else 'atom'
 
-    if cached_queryset is None:
-        all_posts = blog.posts.filter(publish=True, is_page=False, published_date__lte=timezone.now())
-        cache.set(CACHE_KEY, all_posts, CACHE_TIMEOUT)
-    else:
-        all_posts = cached_queryset
+    cache_key = feed_cache_key(blog, feed_type, tag)
+    document = caches['feeds'].get(cache_key)
+
+    # A scheduled post going live also changes the feed
+    if document is None or (document['valid_until'] and document['valid_until'] <= timezone.now()):
+        try:
+            document = build_feed(blog, feed_type, tag)
+        except ValueError as e:
+            # logger.error(f'Error generating feed for {blog}', exc_info=True)
+            return HttpResponseServerError("An error occurred while generating the feed.")
+        caches['feeds'].set(cache_key, document, CACHE_TIMEOUT)
+
+    # Count the reader, written to the daily aggregate in batches
+    record_feed_subscriber(blog.pk, salt_and_hash(request))
+
+    etag = quote_etag(document['etag'])
+    response = get_conditional_response(request, etag=etag, last_modified=document['last_modified'])
+    if response is None:
+        response = HttpResponse(document['content'], content_type=document['content_type'])
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(document['last_modified'])
+    return response
+
+
+def build_feed(blog, feed_type, tag):
+    now = timezone.now()
+    all_posts = blog.posts.filter(publish=True, is_page=False)
 
     if tag:
-        all_posts = all_posts.filter(all_tags__icontains=tag)
+        all_posts = all_posts.filter(post_tags__tag__name__iexact=tag).distinct()
 
-    all_posts = all_posts.order_by('-published_date')[:10]
-    all_posts = sorted(list(all_posts), key=lambda post: post.published_date)
+    valid_until = all_posts.filter(published_date__gt=now).order_by('published_date').values_list('published_date', flat=True).first()
 
-    all_posts = all_posts
+    all_posts = all_posts.filter(published_date__lte=now).order_by('-published_date')[:10]
+    all_posts = sorted(list(all_posts), key=lambda post: post.published_date)
 
     fg = FeedGenerator()
     fg.id(f'https://{blog.subdomain}.ichoria.cc')
@@ -70,21 +103,21 @@ def feed(request):
         fe.published(post.published_date)
         fe.updated(post.last_modified)
 
-    # Log feed request
-    try:
-        hash_id = salt_and_hash(request)
-        RssSubscriber.objects.get_or_create(blog=blog, hash_id=hash_id)
-    except MultipleObjectsReturned:
-        pass
-
-    try:
-        if request.GET.get('type') == 'rss':
-            rssfeed = fg.rss_str(pretty=True)
-            return HttpResponse(rssfeed, content_type='application/rss+xml')
-        else:
-            fg.link(href=f"https://{blog.subdomain}.ichoria.cc/feed/", rel='self')
-            atomfeed = fg.atom_str(pretty=True)
-            return HttpResponse(atomfeed, content_type='application/atom+xml')
-    except ValueError as e:
-        # logger.error(f'Error generating feed for {blog}', exc_info=True)
-        return HttpResponseServerError("An error occurred while generating the feed.")
+    if feed_type == 'rss':
+        content = fg.rss_str(pretty=True)
+        content_type = 'application/rss+xml'
+    else:
+        fg.link(href=f"https://{blog.subdomain}.ichoria.cc/feed/", rel='self')
+        content = fg.atom_str(pretty=True)
+        content_type = 'application/atom+xml'
+
+    modified_dates = [date for post in all_posts for date in (post.published_date, post.last_modified) if date]
+    last_modified = max(modified_dates) if modified_dates else blog.last_modified
+
+    return {
+        'content': content,
+        'content_type': content_type,
+        'etag': hashlib.md5(content).hexdigest(),
+        'last_modified': calendar.timegm(last_modified.utctimetuple()),
+        'valid_until': valid_until,
+    }
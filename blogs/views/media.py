@@ -21,7 +21,7 @@ file_types = ['png', 'jpg', 'jpeg', 'tiff', 'bmp', 'gif', 'svg', 'webp', 'webm',
 @csrf_exempt
 @login_required
 def upload_image(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
 
     if request.method == "POST":
         file_links = []
@@ -58,7 +58,7 @@ def upload_image(request, id):
 '''
 @login_required
 def media_center(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
     
     if not blog.user.settings.upgraded:
         return redirect('upgrade')
@@ -114,7 +114,7 @@ def get_uploaded_images(blog):
 '''
 @login_required
 def delete_selected_media(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
     
     if request.method == "POST":
         selected_media = request.POST.getlist('selected_media')
@@ -8,6 +8,8 @@ from django.contrib.auth.models import User
 
 from blogs.helpers import send_async_mail
 from blogs.models import Blog, PersistentStore, Post
+from blogs.rollups import day_start
+from blogs.templatetags.custom_tags import math_cache_stats
 
 from datetime import timedelta
 import pygal
@@ -26,7 +28,7 @@ def dashboard(request):
 
     all_empty_blogs = empty_blogs()
 
-    users = User.objects.filter(is_active=True, date_joined__gt=start_date).order_by('date_joined')
+    users = User.objects.filter(is_active=True, date_joined__gt=day_start(start_date)).order_by('date_joined')
 
     # Signups
     date_iterator = start_date
@@ -57,7 +59,7 @@ def dashboard(request):
 
     # Upgrades
     date_iterator = start_date
-    upgraded_users = User.objects.filter(settings__upgraded=True, settings__upgraded_date__gte=start_date).order_by('settings__upgraded_date')
+    upgraded_users = User.objects.filter(settings__upgraded=True, settings__upgraded_date__gte=day_start(start_date)).order_by('settings__upgraded_date')
     upgrades_count = upgraded_users.annotate(date=TruncDate('settings__upgraded_date')).values('date').annotate(c=Count('date')).order_by()
 
 
@@ -87,7 +89,7 @@ def dashboard(request):
 
     # Calculate signups and upgrades for the past month
     signups = users.count()
-    upgrades = User.objects.filter(settings__upgraded=True, settings__upgraded_date__gt=start_date).count()
+    upgrades = User.objects.filter(settings__upgraded=True, settings__upgraded_date__gt=day_start(start_date)).count()
 
     # Calculate all-time totals
     total_signups = User.objects.count()
@@ -118,7 +120,8 @@ def dashboard(request):
             'dodgy_blogs_count': dodgy_blogs_count,
             'new_blogs_count': new_blogs_count,
             'empty_blogs': all_empty_blogs,
-            'days_filter': days_filter
+            'days_filter': days_filter,
+            'math_cache': math_cache_stats(),
         }
     )
 
@@ -150,7 +153,7 @@ def new_blogs():
         user__is_active=True,
         to_review=False,
         created_date__lte=timezone.now() - timedelta(days=2)
-    ).order_by('created_date')
+    ).select_related('user').prefetch_related('posts').order_by('created_date')
 
     for term in ignore_terms:
         to_review = to_review.exclude(content__icontains=term)
@@ -159,7 +162,7 @@ def new_blogs():
 
 
 def opt_in_blogs():
-    to_review = Blog.objects.filter(reviewed=False, user__is_active=True, to_review=True).order_by('created_date')
+    to_review = Blog.objects.filter(reviewed=False, user__is_active=True, to_review=True).select_related('user').prefetch_related('posts').order_by('created_date')
     
     return to_review
 
@@ -171,7 +174,7 @@ def dodgy_blogs():
         to_review=False,
         dodginess_score__gt=2,
         ignored_date__isnull=True
-    ).prefetch_related('posts').order_by('-dodginess_score')
+    ).select_related('user').prefetch_related('posts').order_by('-dodginess_score')
 
     return to_review
 
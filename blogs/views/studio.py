@@ -58,7 +58,7 @@ def list(request):
 
 @login_required
 def studio(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
 
     error_messages = []
     header_content = request.POST.get('header_content', '')
@@ -133,7 +133,7 @@ def parse_raw_homepage(blog, header_content, body_content):
 
 @login_required
 def post(request, id, uid=None):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
     is_page = request.GET.get('is_page', '')
     tags = []
     post = None
@@ -297,7 +297,7 @@ def unique_slug(blog, post, new_slug):
 @csrf_exempt
 @login_required
 def preview(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
 
     post = Post(blog=blog)
 
@@ -398,7 +398,7 @@ def preview(request, id):
 
 @login_required
 def post_template(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
 
     if request.method == "POST":
         form = PostTemplateForm(request.POST, instance=blog)
@@ -415,7 +415,7 @@ def post_template(request, id):
 
 @login_required
 def custom_domain_edit(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
 
     if not blog.user.settings.upgraded:
         return redirect('upgrade')
@@ -452,7 +452,7 @@ def custom_domain_edit(request, id):
 
 @login_required
 def directive_edit(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
 
     if not blog.user.settings.upgraded:
         return redirect('upgrade')
@@ -471,7 +471,7 @@ def directive_edit(request, id):
 
 @login_required
 def advanced_settings(request, id):
-    blog = get_object_or_404(Blog, user=request.user, subdomain=id)
+    blog = get_object_or_404(Blog.objects.select_related('user__settings'), user=request.user, subdomain=id)
 
     if request.method == "POST":
         form = AdvancedSettingsForm(request.POST, instance=blog)
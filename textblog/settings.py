@@ -153,8 +153,62 @@ if os.getenv('DATABASE_URL'):
     db_from_env = dj_database_url.config(conn_max_age=600)
     DATABASES['default'].update(db_from_env)
 
+# Cache, held in every gunicorn worker. LocMemCache caps entries rather than bytes, so payloads of different
+# sizes get their own cache, each capped from the measured size of its entries (for a 6KB markdown post)
+# to keep a worker's cache under ~60MB.
+# Being per process, each worker warms its own copy and a cache.delete() only reaches the worker that ran it,
+# so nothing here relies on deletes: pages and feeds are keyed by the blog's cache_version, which is bumped in
+# the database and read by every worker through the address lookup (stale for at most
+# ADDRESS_REVALIDATE_INTERVAL seconds, see blogs/caching.py), rendered markup is keyed by its content's digest,
+# and discover only ever expires by its timeout. A shared backend (Redis or memcached) would warm once for all
+# workers, but costs a network round trip per hit and another service, and isn't needed for correctness
+CACHES = {
+    # Rendered post markup (~7KB an entry), host lookups and discover: ~18MB
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 2500,
+        },
+    },
+    # Anonymous full pages (~11KB): ~22MB
+    'pages': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pages',
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
+    # Serialized feeds, ten full posts each (~84KB): ~21MB
+    'feeds': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'feeds',
+        'OPTIONS': {
+            'MAX_ENTRIES': 250,
+        },
+    },
+}
+
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10 MB
 
+# Discover trending score, see blogs/scoring.py
+DISCOVER_SCORE_FORMULA = os.getenv('DISCOVER_SCORE_FORMULA', 'log')
+DISCOVER_SCORE_GRAVITY = 1.8
+DISCOVER_SCORE_WINDOW = 30  # days
+
+# Background jobs, run by `manage.py runworker`, see blogs/jobs.py
+PERIODIC_JOBS = {
+    'scrub_hash_ids': 24 * 60 * 60,  # seconds
+    'reconcile_upvotes': 24 * 60 * 60,
+    'rescore_posts': 60 * 60,
+    'close_analytics_days': 60 * 60,
+    'prune_jobs': 24 * 60 * 60,
+    'prune_tags': 24 * 60 * 60,
+}
+JOB_QUEUE_CONCURRENCY = {
+    'default': 2,
+    'email': 4,
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 